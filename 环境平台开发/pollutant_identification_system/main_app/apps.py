@@ -1,6 +1,46 @@
+import signal
+import sys
+import threading
+
 from django.apps import AppConfig
 
 
 class MainAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "main_app"
+
+    def ready(self):
+        from django.conf import settings
+        from . import warmup
+
+        # 管理命令、测试和脚本只使用任务存储等模块，不恢复任务、不启动后台清理和进程池
+        if not warmup.is_server_process(sys.argv):
+            warmup.skip()
+            return
+
+        # 恢复上次停机挂起的任务，核对已有记录和文件，启动过期清理
+        from . import thread_pool
+        thread_pool.start_service()
+
+        # 启动预热：后台读取参考数据、启动进程池，完成前 /ready/ 返回 503
+        if getattr(settings, 'WARMUP_ON_STARTUP', True):
+            warmup.start()
+        else:
+            warmup.skip()
+
+        # 收到 SIGTERM 时先执行任务停机（挂起排队任务、限时等待运行中的任务），再交给原有的处理函数：
+        # 默认处理（SIG_DFL）时直接退出，服务器自己的处理函数（如 gunicorn worker 的优雅退出）照常执行。
+        # 服务器在此之后才安装处理函数时（或 gunicorn 使用 preload_app），由解释器退出时的停机流程兜底，
+        # 见 thread_pool.start_service；也可以在 gunicorn 配置的 worker_exit 钩子中调用 thread_pool.shutdown()。
+        # 停机最长持续 TASK_DRAIN_TIMEOUT 加 10 秒，gunicorn 的 graceful_timeout 应大于这个时间，否则 worker 会被强制终止
+        previous = signal.getsignal(signal.SIGTERM)
+        if (threading.current_thread() is threading.main_thread()
+                and previous not in (signal.SIG_IGN, None)):
+            def terminate(signum, frame):
+                thread_pool.shutdown()
+                if callable(previous):
+                    previous(signum, frame)
+                else:
+                    sys.exit(0)
+
+            signal.signal(signal.SIGTERM, terminate)
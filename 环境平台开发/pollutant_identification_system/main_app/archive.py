@@ -0,0 +1,213 @@
+# main_app/archive.py
+"""
+结果归档
+
+结果文件在热存储中保留 TASK_RESULT_TTL 后转入归档：工作簿按列压缩保存为 .npz，
+数值、日期列保存原始数组，文本列保存为字符串数组和空值掩码，混合类型的列逐个值保存为字符串和类型代码，
+归档中不含 pickle 对象，读取时禁止反序列化对象，体积通常只有 xlsx 的一小部分。
+下载时按需恢复为工作簿，归档损坏或无法读取时按结果已过期处理。归档总大小有上限，超出时按最近使用时间（文件修改时间）淘汰。
+"""
+import datetime
+import json
+import os
+import threading
+import uuid
+import zipfile
+
+import numpy as np
+
+# 混合类型列中各个值的类型代码
+MIXED_NULL, MIXED_STR, MIXED_INT, MIXED_FLOAT, MIXED_BOOL, MIXED_DATETIME = range(6)
+
+
+def _encode_mixed(values, mask):
+    """混合类型的列 -> (字符串数组, 类型代码数组)，无法识别的类型按字符串保存"""
+    texts, codes = [], []
+    for value, missing in zip(values, mask):
+        if missing:
+            texts.append('')
+            codes.append(MIXED_NULL)
+        elif isinstance(value, (bool, np.bool_)):
+            texts.append('1' if value else '0')
+            codes.append(MIXED_BOOL)
+        elif isinstance(value, (int, np.integer)):
+            texts.append(str(int(value)))
+            codes.append(MIXED_INT)
+        elif isinstance(value, (float, np.floating)):
+            texts.append(repr(float(value)))
+            codes.append(MIXED_FLOAT)
+        elif isinstance(value, datetime.datetime):
+            texts.append(value.isoformat())
+            codes.append(MIXED_DATETIME)
+        else:
+            texts.append(str(value))
+            codes.append(MIXED_STR)
+    return np.array(texts, dtype=str), np.array(codes, dtype='int8')
+
+
+def _decode_mixed(texts, codes):
+    import pandas as pd
+
+    values = np.empty(len(texts), dtype=object)
+    for i, (text, code) in enumerate(zip(texts.tolist(), codes.tolist())):
+        if code == MIXED_NULL:
+            values[i] = None
+        elif code == MIXED_BOOL:
+            values[i] = text == '1'
+        elif code == MIXED_INT:
+            values[i] = int(text)
+        elif code == MIXED_FLOAT:
+            values[i] = float(text)
+        elif code == MIXED_DATETIME:
+            values[i] = pd.Timestamp(text)
+        else:
+            values[i] = text
+    return values
+
+
+class ResultArchive:
+    """按结果ID保存压缩列式归档"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __getstate__(self):
+        # 归档转换在进程池中执行，锁不能跨进程传递，子进程重新创建
+        return {'directory': self.directory, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.npz')
+
+    @staticmethod
+    def _encode(df):
+        """DataFrame -> {数组名: 数组}，每列单独保存"""
+        arrays = {}
+        kinds = []
+        for i, column in enumerate(df.columns):
+            values = df[column].to_numpy()
+            if values.dtype != object:
+                arrays[f'c{i}'] = values
+                kinds.append('array')
+                continue
+            mask = df[column].isna().to_numpy()
+            present = values[~mask]
+            if all(isinstance(v, str) for v in present):
+                arrays[f'c{i}'] = np.where(mask, '', values).astype(str)
+                kinds.append('str')
+            else:
+                # 混合类型的列逐个值保存为字符串和类型代码
+                arrays[f'c{i}'], arrays[f't{i}'] = _encode_mixed(values, mask)
+                kinds.append('mixed')
+            arrays[f'm{i}'] = mask
+        meta = {'columns': [str(c) for c in df.columns], 'kinds': kinds}
+        arrays['meta'] = np.array(json.dumps(meta, ensure_ascii=False))
+        return arrays
+
+    @staticmethod
+    def _decode(data):
+        import pandas as pd
+
+        meta = json.loads(str(data['meta']))
+        columns = {}
+        for i, (name, kind) in enumerate(zip(meta['columns'], meta['kinds'])):
+            values = data[f'c{i}']
+            if kind == 'mixed':
+                values = _decode_mixed(values, data[f't{i}'])
+            elif kind == 'str':
+                values = values.astype(object)
+                values[data[f'm{i}']] = None
+            elif kind != 'array':
+                raise ValueError(f'未知的列类型: {kind}')
+            columns[name] = values
+        return pd.DataFrame(columns, columns=meta['columns'])
+
+    def store(self, key, xlsx_path):
+        """把结果工作簿转为压缩列式归档，成功返回 True"""
+        import pandas as pd
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            arrays = self._encode(pd.read_excel(xlsx_path))
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self.evict()
+        return True
+
+    def restore(self, key, dest_path):
+        """把归档恢复为工作簿写入 dest_path，归档不存在、损坏或无法读取时返回 False"""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                df = self._decode(data)
+            # 更新修改时间，作为最近使用时间
+            os.utime(path)
+            df.to_excel(dest_path, index=False)
+        except (OSError, ValueError, KeyError, TypeError, EOFError, zipfile.BadZipFile):
+            return False
+        return True
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """超出大小上限时，按最近使用时间从旧到新删除"""
+        with self._lock:
+            entries = []
+            total = 0
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if not entry.name.endswith('.npz'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            entries.sort()
+            while entries and total > self.max_bytes:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_result_archive():
+    """按 settings.RESULT_ARCHIVE 创建（并缓存）归档实例"""
+    global _archive
+    if _archive is None:
+        with _archive_lock:
+            if _archive is None:
+                from django.conf import settings
+
+                config = getattr(settings, 'RESULT_ARCHIVE', {})
+                _archive = ResultArchive(
+                    config.get('PATH', os.path.join(settings.MEDIA_ROOT, 'archive')),
+                    config.get('MAX_BYTES', 2 * 1024 * 1024 * 1024),
+                )
+    return _archive
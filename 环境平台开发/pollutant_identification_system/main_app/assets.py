@@ -0,0 +1,78 @@
+# main_app/assets.py
+"""
+计算阶段共用的参考数据
+
+每个进程只读取一次，之后在同一进程的所有任务间共享；文件更新后下次访问时重新读取。
+返回的 DataFrame 视为只读，需要修改时请先 copy()。
+"""
+import os
+import threading
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 资源名称 -> 文件名
+ASSET_FILES = {
+    'risk_ranking': 'rank-inchikey-HQ.xlsx',
+    'tracing': '溯源结果.xlsx',
+}
+
+# 各参考数据必须包含的列，预热时校验
+REQUIRED_COLUMNS = {
+    'risk_ranking': ('rank', 'InChikey', 'HQ'),
+    'tracing': ('rank', '高风险物质', '对应生产使用物质', '相似性系数'),
+}
+
+# 资源名称 -> (文件签名, DataFrame)
+_assets = {}
+_lock = threading.Lock()
+
+
+def _signature(filename):
+    """文件的大小和修改时间，文件被替换或改写后会变化"""
+    stat = os.stat(os.path.join(APP_DIR, filename))
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def get_asset(name):
+    """返回已缓存的参考数据，首次访问或文件更新后从 Excel 读取"""
+    filename = ASSET_FILES[name]
+    signature = _signature(filename)
+    cached = _assets.get(name)
+    if cached is None or cached[0] != signature:
+        with _lock:
+            cached = _assets.get(name)
+            if cached is None or cached[0] != signature:
+                import pandas as pd
+                cached = (signature, pd.read_excel(os.path.join(APP_DIR, filename)))
+                _assets[name] = cached
+    return cached[1]
+
+
+def preload():
+    """预先读取全部参考数据（进程池 worker 启动时调用）"""
+    for name in ASSET_FILES:
+        get_asset(name)
+
+
+def validate():
+    """校验参考数据：必需的列存在且数据不为空，不符合时抛出 ValueError"""
+    for name, columns in REQUIRED_COLUMNS.items():
+        asset = get_asset(name)
+        missing = [column for column in columns if column not in asset.columns]
+        if missing:
+            raise ValueError(f"参考数据 {ASSET_FILES[name]} 缺少列: {', '.join(missing)}")
+        if asset.empty:
+            raise ValueError(f"参考数据 {ASSET_FILES[name]} 为空")
+
+
+def version():
+    """参考数据版本：各文件名、大小和修改时间的摘要，参考数据更新后结果缓存随之失效
+
+    每次调用时检查文件状态，文件变化后重新计算，不需要重启进程。
+    """
+    import hashlib
+    digest = hashlib.sha1()
+    for name, filename in sorted(ASSET_FILES.items()):
+        size, mtime_ns = _signature(filename)
+        digest.update(f'{name}:{filename}:{size}:{mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()[:12]
@@ -1,39 +1,65 @@
 import pandas as pd
-import time
 
+from .cancellation import check_cancelled
+from . import descriptor_cache
+from .descriptor_cache import get_descriptor_cache, get_generated_cache
+from .exposure import normalize_columns, quantify, resolve_descriptors
+from .model_registry import get_model
+from .progress import report_progress
+from .uploads import as_readable
 
 
-def process_data(input_file1_path, input_file2_path, output_file_path):
+
+def process_data(input_file1, input_file2, output_file_path, cancel_token=None, progress=None):
     """
     处理两个输入文件并生成输出文件
     
     参数:
-    input_file1_path: 参考物质的文件路径
-    input_file2_path: 检出物质的文件路径
+    input_file1: 参考物质的文件（路径、文件对象或字节内容）
+    input_file2: 检出物质的文件（路径、文件对象或字节内容）
     output_file_path: 结果输出的文件路径
+    cancel_token: 取消令牌，在各计算步骤之间检查
+    progress: 进度回调 progress(阶段名称, 已完成数, 总数)
     """
+    reference_data, detected_data = read_inputs(input_file1, input_file2, cancel_token, progress)
+    return quantify_inputs(reference_data, detected_data, output_file_path, cancel_token, progress)
+
+
+def read_inputs(input_file1, input_file2, cancel_token=None, progress=None):
+    """读取两个输入文件并统一列名，返回 (参考物质, 检出物质)"""
+    report_progress(progress, '读取输入文件', 0, 2)
+    reference_data = pd.read_excel(as_readable(input_file1))
+    report_progress(progress, '读取输入文件', 1, 2)
+    detected_data = pd.read_excel(as_readable(input_file2))
+    report_progress(progress, '读取输入文件', 2, 2)
+    check_cancelled(cancel_token)
+    reference_data = normalize_columns(reference_data, ['InChikey', '峰面积', '浓度'], '参考物质文件')
+    detected_data = normalize_columns(detected_data, ['InChikey', '峰面积'], '检出物质文件')
+    return reference_data, detected_data
+
+
+def quantify_inputs(reference_data, detected_data, output_file_path, cancel_token=None, progress=None):
+    """由 read_inputs 读取的数据计算检出物质浓度并写入输出文件，返回计算所用的描述符版本"""
     
     try:
-        # 读取输入文件
-
-        reference_data = pd.read_excel(input_file1_path)
-        
-        detected_data = pd.read_excel(input_file2_path)
-        
+        # 按 InChIKey 关联检出物质与参考物质，批量预测 logRF 并计算浓度
+        report_progress(progress, '浓度预测', 0, 2)
+        # 优先使用输入文件中的描述符，其余物质查描述符缓存，两者都没有时使用按结构生成的描述符
+        descriptors = resolve_descriptors(detected_data, reference_data, get_descriptor_cache(),
+                                          get_generated_cache())
+        version = descriptor_cache.version()
+        model = get_model('response_factor')
+        report_progress(progress, '浓度预测', 1, 2)
+        check_cancelled(cancel_token)
+        result_data, _ = quantify(detected_data, reference_data, model, descriptors)
+        report_progress(progress, '浓度预测', 2, 2)
+        check_cancelled(cancel_token)
         
-        # 示例：合并数据并进行简单计算
-        # 实际应用中请替换为您的具体计算逻辑
-        result_data = pd.DataFrame()
-        
-        # 假设您的计算逻辑是这样的...
-        # 这里只是一个示例，请替换为您的实际计算代码
-    
-        # 示例数据处理（替换为您的实际逻辑）
-        result_data = pd.read_excel('./main_app/inchikey-浓度.xlsx')
-        time.sleep(5)
-         # 保存结果到输出文件
+        # 保存结果到输出文件
+        report_progress(progress, '保存结果', 0, 1)
         result_data.to_excel(output_file_path, index=False)
-        return True
+        report_progress(progress, '保存结果', 1, 1)
+        return version
         
     except Exception as e:
         # 不记录日志，直接抛出异常由调用者处理
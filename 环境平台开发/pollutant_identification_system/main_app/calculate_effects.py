@@ -2,9 +2,13 @@ import pandas as pd
 import time
 import numpy as np
 
+from .assets import get_asset
+from .cancellation import check_cancelled
+from .progress import report_progress
 
 
-def calculate_risk_ranking(endpoint, exposure_result_path, result_path):
+
+def calculate_risk_ranking(endpoint, exposure_result_path, result_path, cancel_token=None, progress=None):
     """
     处理两个输入文件并生成输出文件
     
@@ -12,17 +16,24 @@ def calculate_risk_ranking(endpoint, exposure_result_path, result_path):
     input_file1_path: 参考物质的文件路径
     input_file2_path: 检出物质的文件路径
     output_file_path: 结果输出的文件路径
+    cancel_token: 取消令牌，在各计算步骤之间检查
+    progress: 进度回调 progress(阶段名称, 已完成数, 总数)
     """
     
     try:
         # 生成符合前端需要的标准化数据
-        risk_data = pd.read_excel('./main_app/rank-inchikey-HQ.xlsx')
+        report_progress(progress, '风险排序', 0, 1)
+        risk_data = get_asset('risk_ranking')
 
         # 处理所有的NaN值，转换为None(将被JSON序列化为null)
         risk_data = risk_data.replace({np.nan: None})
+        report_progress(progress, '风险排序', 1, 1)
+        check_cancelled(cancel_token)
         
         # 保存结果文件
+        report_progress(progress, '保存结果', 0, 1)
         risk_data.to_excel(result_path, index=False)
+        report_progress(progress, '保存结果', 1, 1)
         
         # 转换为字典列表并返回
         return risk_data.to_dict(orient='records')
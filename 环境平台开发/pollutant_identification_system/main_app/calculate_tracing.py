@@ -1,21 +1,31 @@
 import pandas as pd
 import time
 
+from .assets import get_asset
+from .cancellation import check_cancelled
+from .progress import report_progress
+from .uploads import as_readable
 
 
-def process_tracing(temp_file_path, exposure_result_path,result_path):
+
+def process_tracing(input_file, exposure_result_path,result_path, cancel_token=None, progress=None):
     """
     处理两个输入文件并生成输出文件
     
     参数:
-    input_file1_path: 参考物质的文件路径
-    input_file2_path: 检出物质的文件路径
-    output_file_path: 结果输出的文件路径
+    input_file: 企业生产使用化学品清单（路径、文件对象或字节内容）
+    exposure_result_path: 暴露分析结果的文件路径
+    result_path: 结果输出的文件路径
+    cancel_token: 取消令牌，在各计算步骤之间检查
+    progress: 进度回调 progress(阶段名称, 已完成数, 总数)
     """
     
     try:
         # 读取输入文件
-        
+        report_progress(progress, '读取输入文件', 0, 1)
+        tracing_data = pd.read_excel(as_readable(input_file))
+        report_progress(progress, '读取输入文件', 1, 1)
+        check_cancelled(cancel_token)
         
         # 示例：合并数据并进行简单计算
         # 实际应用中请替换为您的具体计算逻辑
@@ -25,10 +35,17 @@ def process_tracing(temp_file_path, exposure_result_path,result_path):
         # 这里只是一个示例，请替换为您的实际计算代码
     
         # 示例数据处理（替换为您的实际逻辑）
-        result_data = pd.read_excel('./main_app/溯源结果.xlsx')
-        time.sleep(5)
+        result_data = get_asset('tracing')
+        # 示例计算耗时，分段执行以便及时响应取消
+        for i in range(10):
+            report_progress(progress, '溯源计算', i, 10)
+            time.sleep(0.5)
+            check_cancelled(cancel_token)
+        report_progress(progress, '溯源计算', 10, 10)
          # 保存结果到输出文件
+        report_progress(progress, '保存结果', 0, 1)
         result_data.to_excel(result_path, index=False)
+        report_progress(progress, '保存结果', 1, 1)
         return True
         
     except Exception as e:
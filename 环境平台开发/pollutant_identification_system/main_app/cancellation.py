@@ -0,0 +1,48 @@
+# main_app/cancellation.py
+"""
+协作式任务取消
+
+取消请求记录在任务存储中（cancel_requested），计算函数在分块之间调用
+check_cancelled(token)，发现取消后抛出 TaskCancelled 由任务函数收尾。
+令牌只保存任务存储和任务ID，可以随计算函数一起传入进程池 worker。
+"""
+import time
+
+
+class TaskCancelled(Exception):
+    """任务已被用户取消"""
+
+
+class TaskSuspended(TaskCancelled):
+    """服务停机，任务在检查点停止并挂起，下次启动时恢复"""
+
+
+class CancellationToken:
+    """取消令牌，按间隔读取任务记录，避免每个检查点都访问存储"""
+
+    def __init__(self, store, task_id, interval=0.5):
+        self.store = store
+        self.task_id = task_id
+        self.interval = interval
+        self._cancelled = False
+        self._checked_at = 0.0
+
+    def cancelled(self):
+        """是否已请求取消"""
+        if not self._cancelled and time.monotonic() - self._checked_at >= self.interval:
+            self._checked_at = time.monotonic()
+            record = self.store.get(self.task_id)
+            # 记录暂时读不到（例如被外部清理）不等于取消，只有明确的取消请求才停止任务
+            self._cancelled = record is not None and bool(record.get('cancel_requested'))
+        return self._cancelled
+
+    def check(self):
+        """已请求取消时抛出 TaskCancelled"""
+        if self.cancelled():
+            raise TaskCancelled('任务已取消')
+
+
+def check_cancelled(token):
+    """计算函数中的检查点，未传入令牌时不做任何事"""
+    if token is not None:
+        token.check()
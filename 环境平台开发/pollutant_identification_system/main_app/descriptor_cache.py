@@ -0,0 +1,305 @@
+# main_app/descriptor_cache.py
+"""
+分子描述符缓存
+
+按 InChIKey 保存响应因子模型使用的分子描述符，同一园区各批样品中反复出现的物质不必重复获取描述符：
+- 列式存储：排好序的 InChIKey 数组和每个描述符一个 float64 数组，各自保存为 .npy 文件；
+- 读取时以 mmap_mode='r' 映射，按二分查找定位，只读取命中的行，多个进程共享页缓存；
+- 批量写入（upsert）时合并新旧数据，写成新的一代文件后原子切换 CURRENT 指针，读者不会看到写了一半的数据；
+  刚被替换的上一代保留到下次写入，仍按旧名称读取的读者不受影响；
+- 命中和未命中次数由各进程分别计数，写入 stats/ 下以进程号命名的文件（不加锁），stats() 汇总全部进程。
+缓存只做尽力而为，写入失败（例如拿不到锁）时跳过，下次仍按未命中处理。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+LOCK_TIMEOUT = 30
+# 持有锁的进程异常退出时，超过该时间的锁文件视为失效
+STALE_LOCK_AGE = 120
+# 映射的一代数据被并发写入清理时，重新读取 CURRENT 的次数
+OPEN_RETRIES = 3
+
+
+class _Generation:
+    """一代只读数据：keys 为排好序的 InChIKey 数组，columns 为 {列名: 数组}"""
+
+    __slots__ = ('name', 'keys', 'columns')
+
+    def __init__(self, name, keys, columns):
+        self.name = name
+        self.keys = keys
+        self.columns = columns
+
+
+class DescriptorCache:
+    """以 InChIKey 为键的列式描述符库"""
+
+    def __init__(self, directory, columns):
+        self.directory = str(directory)
+        self.columns = list(columns)
+        self.hits = 0
+        self.misses = 0
+        # 本进程统计文件中已有的计数（进程号被重用时接着累计），首次记录时读取
+        self._stats_base = None
+        self._current = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def _open(self):
+        """映射当前一代数据；CURRENT 变化（其他进程写入）后重新映射
+
+        读取期间这一代数据被并发写入替换并清理时重新读取 CURRENT；
+        多次重试仍失败时继续使用已映射的数据，缓存为空时返回 None。
+        """
+        for _ in range(OPEN_RETRIES):
+            try:
+                with open(self._path('CURRENT'), encoding='utf-8') as f:
+                    name = f.read().strip()
+            except FileNotFoundError:
+                return None
+            except OSError:
+                # Windows 上 CURRENT 被替换的瞬间可能无法打开
+                time.sleep(0.01)
+                continue
+            current = self._current
+            if current is not None and current.name == name:
+                return current
+            try:
+                keys = np.load(self._path(name, 'keys.npy'), mmap_mode='r')
+                columns = {column: np.load(self._path(name, f'{i}.npy'), mmap_mode='r')
+                           for i, column in enumerate(self._stored_columns(name))}
+            except (OSError, ValueError):
+                continue
+            current = _Generation(name, keys, columns)
+            self._current = current
+            return current
+        return self._current
+
+    def _stored_columns(self, name):
+        with open(self._path(name, 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)['columns']
+
+    def _acquire(self):
+        """跨进程文件锁（O_EXCL 创建锁文件），超时返回 False"""
+        path = self._path('.lock')
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE_LOCK_AGE:
+                        os.remove(path)
+                        continue
+                except OSError:
+                    continue
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+
+    def _release(self):
+        try:
+            os.remove(self._path('.lock'))
+        except OSError:
+            pass
+
+    def _find(self, generation, query):
+        """二分查找，返回 (是否命中, 命中行的位置)"""
+        if generation is None or not len(generation.keys) or not len(query):
+            return np.zeros(len(query), dtype=bool), np.empty(0, dtype='intp')
+        positions = np.searchsorted(generation.keys, query)
+        positions = np.minimum(positions, len(generation.keys) - 1)
+        hit = generation.keys[positions] == query
+        return hit, positions[hit]
+
+    def missing(self, keys):
+        """缓存中没有的 InChIKey（不计入命中统计）"""
+        keys = pd.Index(keys, dtype='object').unique()
+        hit, _ = self._find(self._open(), keys.to_numpy(dtype=str))
+        return keys[~hit]
+
+    def version(self):
+        """当前一代数据的名称，缓存为空时为空字符串；每次写入后都会变化"""
+        try:
+            with open(self._path('CURRENT'), encoding='utf-8') as f:
+                return f.read().strip()
+        except OSError:
+            return ''
+
+    def lookup(self, keys, record=True):
+        """查询描述符，返回 (命中的描述符表（以 InChIKey 为索引）, 未命中的 InChIKey)；record=False 时不计入命中统计"""
+        keys = pd.Index(keys, dtype='object').unique()
+        generation = self._open()
+        hit, positions = self._find(generation, keys.to_numpy(dtype=str))
+        data = {column: np.empty(0, dtype='float64') for column in self.columns}
+        if len(positions):
+            for column in self.columns:
+                stored = generation.columns.get(column)
+                data[column] = (np.asarray(stored[positions], dtype='float64') if stored is not None
+                                else np.full(len(positions), np.nan))
+        found = pd.DataFrame(data, index=pd.Index(keys[hit], name='InChikey'), columns=self.columns)
+        if record:
+            self._record(int(hit.sum()), int(len(hit) - hit.sum()))
+        return found, keys[~hit]
+
+    def upsert(self, table):
+        """批量写入描述符表（以 InChIKey 为索引），已存在的 InChIKey 被覆盖；返回是否写入成功"""
+        table = table.reindex(columns=self.columns).astype('float64')
+        table = table[~table.index.duplicated(keep='last')]
+        if table.empty:
+            return True
+        new_keys = table.index.to_numpy(dtype=str)
+        with self._lock:
+            if not self._acquire():
+                return False
+            try:
+                generation = self._open()
+                if generation is not None:
+                    keep = ~np.isin(generation.keys, new_keys)
+                    keys = np.concatenate([generation.keys[keep], new_keys])
+                    columns = {}
+                    for column in self.columns:
+                        stored = generation.columns.get(column)
+                        old = (np.asarray(stored[keep]) if stored is not None
+                               else np.full(int(keep.sum()), np.nan))
+                        columns[column] = np.concatenate([old, table[column].to_numpy()])
+                else:
+                    keys = new_keys
+                    columns = {column: table[column].to_numpy() for column in self.columns}
+                order = np.argsort(keys, kind='stable')
+                self._write(keys[order], {column: values[order] for column, values in columns.items()})
+            except OSError:
+                return False
+            finally:
+                self._release()
+        return True
+
+    def _write(self, keys, columns):
+        """写出新的一代数据并切换 CURRENT，随后删除上一代之前的旧数据"""
+        previous = self.version()
+        name = f'g{time.time_ns()}_{uuid.uuid4().hex[:8]}'
+        directory = self._path(name)
+        os.makedirs(directory)
+        try:
+            np.save(os.path.join(directory, 'keys.npy'), keys)
+            for i, column in enumerate(self.columns):
+                np.save(os.path.join(directory, f'{i}.npy'), np.ascontiguousarray(columns[column], dtype='float64'))
+            with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'columns': self.columns, 'entries': int(len(keys))}, f, ensure_ascii=False)
+            tmp_path = self._path(f'.{uuid.uuid4().hex}.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(name)
+            os.replace(tmp_path, self._path('CURRENT'))
+        except OSError:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        # 保留刚被替换的上一代，删除更早的数据；仍被其他进程映射的文件删除失败时留待下次清理
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name.startswith('g') and entry.name not in (name, previous):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _record(self, hits, misses):
+        """累计命中统计：只更新本进程的计数和统计文件，不占用跨进程的文件锁"""
+        if not hits and not misses:
+            return
+        path = self._path('stats', f'{os.getpid()}.json')
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            try:
+                if self._stats_base is None:
+                    os.makedirs(self._path('stats'), exist_ok=True)
+                    self._stats_base = self._read_stats(path)
+                totals = {'hits': self._stats_base['hits'] + self.hits,
+                          'misses': self._stats_base['misses'] + self.misses}
+                tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(totals, f)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _read_stats(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                totals = json.load(f)
+            return {'hits': int(totals['hits']), 'misses': int(totals['misses'])}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {'hits': 0, 'misses': 0}
+
+    def stats(self):
+        """所有进程累计的命中统计和当前条目数"""
+        totals = {'hits': 0, 'misses': 0}
+        try:
+            entries = [entry.path for entry in os.scandir(self._path('stats')) if entry.name.endswith('.json')]
+        except OSError:
+            entries = []
+        for path in entries:
+            counts = self._read_stats(path)
+            totals['hits'] += counts['hits']
+            totals['misses'] += counts['misses']
+        lookups = totals['hits'] + totals['misses']
+        generation = self._open()
+        return {
+            'entries': int(len(generation.keys)) if generation is not None else 0,
+            'hits': totals['hits'],
+            'misses': totals['misses'],
+            'hit_rate': round(totals['hits'] / lookups, 4) if lookups else None,
+            'miss_rate': round(totals['misses'] / lookups, 4) if lookups else None,
+        }
+
+
+_cache = None
+_generated_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_descriptor_cache():
+    """按 settings.DESCRIPTOR_CACHE 创建（并缓存）描述符缓存实例"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from django.conf import settings
+                from .exposure import DESCRIPTOR_COLUMNS
+
+                config = getattr(settings, 'DESCRIPTOR_CACHE', {})
+                _cache = DescriptorCache(
+                    config.get('PATH', os.path.join(settings.MEDIA_ROOT, 'descriptor_cache')),
+                    DESCRIPTOR_COLUMNS,
+                )
+    return _cache
+
+
+def version():
+    """描述符缓存和生成描述符库的当前版本，用作暴露分析结果缓存键的一部分"""
+    return f'{get_descriptor_cache().version()};{get_generated_cache().version()}'
+
+
+def get_generated_cache():
+    """按 settings.DESCRIPTOR_CACHE 创建（并缓存）按结构生成的描述符库，只包含能够生成的描述符列"""
+    global _generated_cache
+    if _generated_cache is None:
+        with _cache_lock:
+            if _generated_cache is None:
+                from django.conf import settings
+                from .descriptor_generation import GENERATED_COLUMNS
+
+                config = getattr(settings, 'DESCRIPTOR_CACHE', {})
+                _generated_cache = DescriptorCache(
+                    config.get('GENERATED_PATH', os.path.join(settings.MEDIA_ROOT, 'generated_descriptors')),
+                    GENERATED_COLUMNS,
+                )
+    return _generated_cache
@@ -0,0 +1,148 @@
+# main_app/descriptor_generation.py
+"""
+根据结构生成分子描述符
+
+检出或参考物质既不在描述符缓存中、输入文件中也没有描述符时，如果提供了结构（SMILES 或 InChI 列），
+在浓度预测之前为这些物质生成描述符：
+- 按块分发到计算进程池并行计算，块的数量不少于 worker 数，吞吐量随核数增加；
+- 每完成一块就写入生成描述符库（get_generated_cache）并上报进度，任务取消或中断时已完成的部分不会丢失；
+- 依赖 RDKit（可选），未安装时跳过生成，缺少描述符的检出物质在浓度预测阶段报错。
+只生成与训练数据定义一致的描述符（GENERATED_COLUMNS）。训练数据中的 MoleculeVolume（约 0.47~1.07）
+和 LogD 与 RDKit 能计算的量不是同一定义，不生成，预测时为空值，由模型的缺失值处理补齐。
+生成的描述符与输入文件提供的描述符分开保存，同一物质之后在输入文件中提供描述符时以输入为准。
+InChIKey 是结构的哈希值，无法反推结构，只有 InChIKey 的物质不能生成描述符。
+"""
+import contextlib
+import importlib.util
+import logging
+import math
+
+import pandas as pd
+
+from .cancellation import check_cancelled
+from .descriptor_cache import get_descriptor_cache, get_generated_cache
+from .exposure import DESCRIPTOR_COLUMNS, descriptor_table
+from .progress import report_progress
+
+logger = logging.getLogger('access')
+
+# 结构列，同一行两列都有时优先使用 SMILES
+STRUCTURE_COLUMNS = ('SMILES', 'InChI')
+
+# 每块最多包含的物质数
+CHUNK_SIZE = 50
+
+STAGE = '生成分子描述符'
+
+# 能按训练数据的定义生成的描述符列（DESCRIPTOR_COLUMNS 的子集，顺序一致）
+GENERATED_COLUMNS = [column for column in DESCRIPTOR_COLUMNS if column not in ('MoleculeVolume', 'LogD')]
+
+
+def rdkit_available():
+    return importlib.util.find_spec('rdkit') is not None
+
+
+def structure_table(*frames):
+    """按 InChIKey 汇总各输入中的结构（每个 InChIKey 取第一条），返回 InChIKey -> 结构 的 Series"""
+    parts = []
+    for df in frames:
+        for column in STRUCTURE_COLUMNS:
+            if column in df.columns:
+                parts.append(pd.DataFrame({
+                    'InChikey': df['InChikey'],
+                    'structure': df[column].astype('string').str.strip(),
+                }))
+    if not parts:
+        return pd.Series([], index=pd.Index([], name='InChikey'), dtype='object')
+    table = pd.concat(parts, ignore_index=True)
+    table = table[table['structure'].fillna('') != ''].drop_duplicates('InChikey')
+    return pd.Series(table['structure'].to_numpy(dtype=object), index=pd.Index(table['InChikey'], name='InChikey'))
+
+
+def pending_structures(reference, detected):
+    """需要生成描述符的物质：缓存和生成描述符库中都没有、输入中也没有描述符，但提供了结构
+
+    reference、detected 为已统一列名的两份输入；都没有结构列时直接返回空表，不查询缓存。
+    """
+    structures = structure_table(detected, reference)
+    if not structures.empty:
+        supplied = descriptor_table(detected, reference).dropna(how='all')
+        candidates = structures.index.difference(supplied.index)
+        candidates = get_descriptor_cache().missing(candidates)
+        structures = structures[get_generated_cache().missing(candidates)]
+    return structures
+
+
+def _parse(structure):
+    from rdkit import Chem
+
+    if structure.startswith('InChI='):
+        return Chem.MolFromInchi(structure)
+    return Chem.MolFromSmiles(structure)
+
+
+def _descriptors(mol):
+    """与 GENERATED_COLUMNS 顺序一致的描述符"""
+    from rdkit.Chem import Crippen, Descriptors, Lipinski, rdMolDescriptors
+
+    return [
+        Crippen.MolMR(mol),
+        Descriptors.MolWt(mol),
+        Lipinski.NumHAcceptors(mol),
+        Lipinski.NumHDonors(mol),
+        rdMolDescriptors.CalcTPSA(mol),
+        Crippen.MolLogP(mol),
+    ]
+
+
+def compute_chunk(chunk):
+    """（在计算进程中执行）为一块 (InChIKey, 结构) 计算描述符，返回 (描述符表, 结构无法解析的 InChIKey 列表)"""
+    from rdkit import RDLogger
+
+    RDLogger.DisableLog('rdApp.*')
+    keys, rows, failed = [], [], []
+    for key, structure in chunk:
+        mol = _parse(structure)
+        if mol is None:
+            failed.append(key)
+            continue
+        keys.append(key)
+        rows.append(_descriptors(mol))
+    table = pd.DataFrame(rows, index=pd.Index(keys, name='InChikey'), columns=GENERATED_COLUMNS, dtype='float64')
+    return table, failed
+
+
+def split_chunks(structures, workers):
+    """把待生成的物质切分成块：块的数量不少于 worker 数，每块不超过 CHUNK_SIZE"""
+    items = list(structures.items())
+    size = max(1, min(CHUNK_SIZE, math.ceil(len(items) / max(1, workers))))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def generate(structures, run_chunks, workers, cancel_token=None, progress=None):
+    """并行生成描述符并逐块写入生成描述符库，返回成功生成的物质数
+
+    structures: pending_structures 的返回值
+    run_chunks: run_chunks(函数, 各块) 把各块分发到进程池，按完成顺序返回结果
+    """
+    if structures.empty:
+        return 0
+    if not rdkit_available():
+        logger.warning(f"未安装 RDKit，{len(structures)} 个物质无法根据结构生成分子描述符")
+        return 0
+    cache = get_generated_cache()
+    total = len(structures)
+    done = generated = 0
+    failed = []
+    report_progress(progress, STAGE, 0, total)
+    with contextlib.closing(run_chunks(compute_chunk, split_chunks(structures, workers))) as results:
+        for table, chunk_failed in results:
+            cache.upsert(table)
+            generated += len(table)
+            failed.extend(chunk_failed)
+            done += len(table) + len(chunk_failed)
+            report_progress(progress, STAGE, done, total)
+            check_cancelled(cancel_token)
+    if failed:
+        logger.warning(f"{len(failed)} 个物质的结构无法解析，未生成分子描述符，例如 {failed[0]}")
+    return generated
@@ -0,0 +1,79 @@
+# main_app/expiry.py
+"""
+过期调度
+
+记录创建时按过期时间登记到小顶堆，后台线程睡眠到最早的过期时间再处理，
+每条记录的登记和移除都是 O(log n)，不再定期遍历全部记录和结果目录。
+同一个键重复登记时以最后一次为准，堆中旧的条目在弹出时跳过。
+"""
+import heapq
+import itertools
+import threading
+import time
+
+
+class ExpiryScheduler:
+    """按过期时间调用 on_expire(key) 的后台调度器"""
+
+    def __init__(self, on_expire, name='expiry'):
+        self._on_expire = on_expire
+        self._name = name
+        self._heap = []
+        # key -> 当前有效的过期时间
+        self._deadlines = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def register(self, key, expires_at):
+        """登记（或更新）键的过期时间"""
+        with self._cond:
+            self._deadlines[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, next(self._seq), key))
+            # 新条目成为堆顶时唤醒后台线程，重新计算等待时间
+            if self._heap[0][2] == key:
+                self._cond.notify()
+
+    def discard(self, key):
+        """取消键的过期登记"""
+        with self._cond:
+            self._deadlines.pop(key, None)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._deadlines)
+
+    def start(self):
+        """启动后台线程（重复调用无副作用）"""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def _pop_due(self):
+        """等待到有键过期，弹出并返回该键"""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                expires_at, _, key = self._heap[0]
+                if self._deadlines.get(key) != expires_at:
+                    # 已取消或已重新登记的旧条目
+                    heapq.heappop(self._heap)
+                    continue
+                delay = expires_at - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._deadlines[key]
+                return key
+
+    def _run(self):
+        while True:
+            key = self._pop_due()
+            try:
+                self._on_expire(key)
+            except Exception:
+                pass
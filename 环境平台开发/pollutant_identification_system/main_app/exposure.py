@@ -0,0 +1,161 @@
+# main_app/exposure.py
+"""
+暴露分析：基于响应因子的半定量浓度预测
+
+响应因子 RF = 峰面积 / 浓度，模型根据分子描述符预测 logRF（以 10 为底）：
+- 参考物质（已知浓度）的实测 logRF 与预测 logRF 之差取中位数，作为本批次的校正量；
+- 检出物质按 InChIKey 与参考物质关联，本身就是参考物质的直接使用实测 logRF，
+  其余物质使用校正后的预测 logRF；
+- 浓度 = 峰面积 / 10 ** logRF，浓度单位与参考物质浓度的单位相同。
+全部物质一次批量预测，关联和浓度计算都按整列进行，不逐行循环。
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('access')
+
+# 响应因子模型使用的分子描述符列（与 POS预测输入.xlsx 一致）
+DESCRIPTOR_COLUMNS = [
+    'MolarRefractivity', 'MoleculeWeight', 'MoleculeVolume', 'H-Acceptors',
+    'H-Donor', 'PolarSurfaceArea', 'LogP', 'LogD',
+]
+
+# 标准列名 -> 可接受的列名（不区分大小写，忽略空格、连字符和下划线）
+COLUMN_ALIASES = {
+    'InChikey': ('inchikey',),
+    '峰面积': ('峰面积', 'area', 'peakarea'),
+    '浓度': ('浓度', 'concentration', 'conc'),
+    # 可选的结构列，缺少描述符的新物质据此生成描述符
+    'SMILES': ('smiles', 'canonicalsmiles', 'isomericsmiles'),
+    'InChI': ('inchi',),
+}
+
+# 定量方式
+QUANT_REFERENCE = '参考物质'
+QUANT_PREDICTED = '模型预测'
+# 没有同时具备实测值和描述符的参考物质时，预测值无法校正
+QUANT_UNCALIBRATED = '模型预测（未校正）'
+
+
+def _normalize(name):
+    return ''.join(str(name).split()).replace('-', '').replace('_', '').lower()
+
+
+def normalize_columns(df, required, label):
+    """去掉列名首尾空格，把别名统一为标准列名，InChIKey 统一为大写；缺少 required 中的列时抛出 ValueError"""
+    df = df.rename(columns=lambda c: str(c).strip())
+    aliases = {_normalize(alias): standard
+               for standard, names in COLUMN_ALIASES.items() for alias in names}
+    renames = {}
+    for column in df.columns:
+        standard = aliases.get(_normalize(column))
+        if standard and standard not in df.columns and standard not in renames.values():
+            renames[column] = standard
+    df = df.rename(columns=renames)
+    missing = [column for column in required if column not in df.columns]
+    if missing:
+        raise ValueError(f"{label}缺少列: {', '.join(missing)}")
+    # 没有 InChIKey 的行无法关联，不参与计算
+    df['InChikey'] = df['InChikey'].astype('string').str.strip().str.upper()
+    return df[df['InChikey'].fillna('') != ''].reset_index(drop=True)
+
+
+def descriptor_table(*frames):
+    """按 InChIKey 汇总各输入中的分子描述符（每个 InChIKey 取第一条），返回以 InChIKey 为索引的数值表"""
+    parts = [df[['InChikey'] + DESCRIPTOR_COLUMNS] for df in frames
+             if all(column in df.columns for column in DESCRIPTOR_COLUMNS)]
+    if not parts:
+        return pd.DataFrame(columns=DESCRIPTOR_COLUMNS, dtype='float64',
+                            index=pd.Index([], name='InChikey'))
+    table = pd.concat(parts, ignore_index=True).drop_duplicates('InChikey').set_index('InChikey')
+    return table.apply(pd.to_numeric, errors='coerce').astype('float64')
+
+
+def resolve_descriptors(detected, reference, cache, generated=None):
+    """汇总两份输入涉及的全部物质的描述符：输入文件中提供了描述符的物质使用提供的描述符，
+    并把与缓存不同的行写入缓存；其余物质查描述符缓存，两者都没有的物质最后使用按结构生成的描述符（generated），
+    生成的描述符另行保存，不写入描述符缓存，也不会取代输入文件中的描述符"""
+    keys = pd.Index(detected['InChikey']).append(pd.Index(reference['InChikey'])).unique()
+    # 描述符全部为空的行视为没有提供，不写入缓存，避免以后把空值当作命中
+    supplied = descriptor_table(detected, reference).dropna(how='all')
+    cached = cache.lookup(supplied.index, record=False)[0].reindex(supplied.index)
+    same = ((supplied == cached) | (supplied.isna() & cached.isna())).all(axis=1)
+    # 只写入新的或有变化的行，缓存内容不变时不产生新的一代数据
+    cache.upsert(supplied[~same])
+    found, missing = cache.lookup(keys.difference(supplied.index))
+    parts = [supplied, found]
+    if generated is not None and len(missing):
+        # 无法生成的描述符列为空值，由模型的缺失值处理补齐
+        parts.append(generated.lookup(missing)[0].reindex(columns=DESCRIPTOR_COLUMNS))
+    return pd.concat(parts)
+
+
+def predict_log_rf(model, descriptors):
+    """批量预测 logRF，descriptors 为描述符表，返回与其索引对齐的 Series"""
+    if descriptors.empty:
+        return pd.Series([], index=descriptors.index, dtype='float64')
+    values = model.predict(descriptors[DESCRIPTOR_COLUMNS].reset_index(drop=True))
+    return pd.Series(np.asarray(values, dtype='float64'), index=descriptors.index)
+
+
+def measured_log_rf(reference):
+    """参考物质的实测 logRF，同一 InChIKey 多次测定时取平均；峰面积或浓度不为正的记录不参与"""
+    area = pd.to_numeric(reference['峰面积'], errors='coerce').to_numpy(dtype='float64')
+    concentration = pd.to_numeric(reference['浓度'], errors='coerce').to_numpy(dtype='float64')
+    valid = (area > 0) & (concentration > 0)
+    log_rf = np.log10(area[valid] / concentration[valid])
+    return pd.Series(log_rf, index=reference['InChikey'].to_numpy()[valid]).groupby(level=0).mean()
+
+
+def calibration_offset(measured, predicted):
+    """实测与预测 logRF 之差的中位数；没有同时具备实测值和描述符的参考物质时返回 None"""
+    common = measured.index.intersection(predicted.index)
+    if not len(common):
+        return None
+    return float(np.median(measured[common].to_numpy() - predicted[common].to_numpy()))
+
+
+def quantify(detected, reference, model, descriptors=None):
+    """计算检出物质的浓度
+
+    detected: 检出物质（InChikey、峰面积，及分子描述符列）
+    reference: 参考物质（InChikey、峰面积、浓度，可带分子描述符列）
+    descriptors: 以 InChIKey 为索引的描述符表，默认从两份输入中汇总
+    返回 (结果表, 校正量)，无法校正时校正量为 0，预测定量的行标记为未校正
+    """
+    if descriptors is None:
+        descriptors = descriptor_table(detected, reference)
+    keys = detected['InChikey'].to_numpy()
+    measured = measured_log_rf(reference)
+    measured_rows = measured.reindex(keys).to_numpy()
+    use_measured = ~np.isnan(measured_rows)
+    # 直接使用实测 logRF 的物质不需要描述符
+    missing = pd.Index(keys[~use_measured]).unique().difference(descriptors.index)
+    if len(missing):
+        raise ValueError(f"{len(missing)} 个检出物质缺少分子描述符（{', '.join(DESCRIPTOR_COLUMNS)}），"
+                         f"例如 {missing[0]}")
+
+    predicted = predict_log_rf(model, descriptors)
+    offset = calibration_offset(measured, predicted)
+    calibrated = offset is not None
+    if not calibrated:
+        offset = 0.0
+        if not use_measured.all():
+            logger.warning("没有同时具备实测值和分子描述符的参考物质，预测 logRF 未经校正")
+
+    predicted_rows = predicted.reindex(keys).to_numpy() + offset
+    log_rf = np.where(use_measured, measured_rows, predicted_rows)
+    area = pd.to_numeric(detected['峰面积'], errors='coerce').to_numpy(dtype='float64')
+
+    # 保留检出物质的标识列（描述符列不输出）
+    result = detected.drop(columns=[c for c in DESCRIPTOR_COLUMNS if c in detected.columns])
+    result = result.drop(columns=['峰面积', '浓度'], errors='ignore')
+    result['峰面积'] = area
+    result['预测logRF'] = predicted_rows
+    result['logRF'] = log_rf
+    result['定量方式'] = np.where(use_measured, QUANT_REFERENCE,
+                              QUANT_PREDICTED if calibrated else QUANT_UNCALIBRATED)
+    result['浓度'] = area / np.power(10.0, log_rf)
+    return result, offset
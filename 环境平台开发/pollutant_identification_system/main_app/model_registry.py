@@ -0,0 +1,208 @@
+# main_app/model_registry.py
+"""
+模型注册表
+
+按名称管理计算阶段使用的模型（settings.MODEL_REGISTRY['MODELS'] 中配置名称和文件路径）：
+- 每个进程只加载一次，同一进程的所有线程共享同一个模型对象；
+- 以 mmap_mode='r' 加载，joblib 单独保存的 numpy 数组直接映射文件，多个 worker 进程共享页缓存；
+- 模型文件被替换（原子替换或覆盖）后，下一次访问时自动加载新版本，无需重启，
+  正在使用旧版本的任务继续持有旧对象直到完成；
+- 版本号为模型文件内容的 SHA-256 前 12 位，结果缓存的键包含版本号，模型更新后缓存随之失效；
+- 配置了 COMPILED_PATH 时，树集成模型首次加载后编译为 NumPy 数组（见 tree_ensemble）并按版本号保存，
+  之后直接加载编译结果，worker 进程启动时不再导入 xgboost 和 scikit-learn；无法编译的模型照常使用原对象。
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('access')
+
+
+def _signature(path):
+    """文件的身份标识：替换或改写文件后会变化"""
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _compat(estimator):
+    """兼容旧版 scikit-learn 保存的模型：补齐新版本预测时需要的属性"""
+    from sklearn.impute import SimpleImputer
+
+    if isinstance(estimator, SimpleImputer) and not hasattr(estimator, '_fill_dtype'):
+        estimator._fill_dtype = getattr(estimator, '_fit_dtype', None)
+    for _, step in getattr(estimator, 'steps', ()):
+        _compat(step)
+    for _, transformer, _ in getattr(estimator, 'transformers_', ()):
+        if not isinstance(transformer, str):
+            _compat(transformer)
+
+
+def _is_compiled(model):
+    from .tree_ensemble import CompiledModel
+    return isinstance(model, CompiledModel)
+
+
+class ModelVersion:
+    """已加载的模型及其版本信息"""
+
+    __slots__ = ('name', 'version', 'model', 'path', 'signature', 'loaded_at')
+
+    def __init__(self, name, version, model, path, signature):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.path = path
+        self.signature = signature
+        self.loaded_at = time.time()
+
+
+class ModelRegistry:
+    """按名称加载并缓存模型，模型文件变化时自动切换到新版本"""
+
+    def __init__(self, paths, check_interval=5.0, compiled_dir=None):
+        self.paths = {name: str(path) for name, path in paths.items()}
+        self.check_interval = check_interval
+        self.compiled_dir = str(compiled_dir) if compiled_dir else None
+        self._models = {}
+        self._versions = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """返回当前版本的模型（ModelVersion），首次访问或文件被替换后加载"""
+        current = self._models.get(name)
+        if current is not None and not self._changed(name, current):
+            return current
+        with self._lock:
+            current = self._models.get(name)
+            if current is not None and not self._changed(name, current, force=True):
+                return current
+            loaded = self._load(name)
+            self._models[name] = loaded
+            self._versions[name] = (loaded.signature, loaded.version)
+        if current is not None:
+            logger.info(f"模型 {name} 已切换到新版本 {loaded.version}（原版本 {current.version}）")
+        return loaded
+
+    def version(self, name):
+        """模型文件的版本号，不加载模型；文件不存在时返回 'missing'"""
+        path = self.paths[name]
+        try:
+            signature = _signature(path)
+        except FileNotFoundError:
+            return 'missing'
+        cached = self._versions.get(name)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        version = _digest(path)
+        self._versions[name] = (signature, version)
+        return version
+
+    def preload(self):
+        """加载全部模型（启动预热和进程池 worker 初始化时调用）"""
+        for name in self.paths:
+            self.get(name)
+
+    def _changed(self, name, current, force=False):
+        """检查模型文件是否被替换，两次检查之间至少间隔 check_interval 秒"""
+        now = time.monotonic()
+        if not force and now - self._checked.get(name, 0) < self.check_interval:
+            return False
+        self._checked[name] = now
+        try:
+            return _signature(current.path) != current.signature
+        except FileNotFoundError:
+            # 文件暂时不存在（正在替换）时继续使用当前版本
+            return False
+
+    def _compiled_path(self, name, version):
+        return os.path.join(self.compiled_dir, f'{name}-{version}.npz')
+
+    def _load_compiled(self, name, version):
+        """加载已编译的模型，没有编译结果时返回 None"""
+        if not self.compiled_dir:
+            return None
+        from .tree_ensemble import CompiledModel
+
+        try:
+            return CompiledModel.load(self._compiled_path(name, version))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _compile(self, name, version, model):
+        """编译并保存模型，无法编译时返回原模型"""
+        from .tree_ensemble import UnsupportedModel, compile_pipeline
+
+        try:
+            compiled = compile_pipeline(model)
+        except UnsupportedModel as e:
+            logger.info(f"模型 {name} 无法编译，使用原模型: {str(e)}")
+            return model
+        try:
+            os.makedirs(self.compiled_dir, exist_ok=True)
+            compiled.save(self._compiled_path(name, version))
+        except OSError as e:
+            logger.warning(f"保存编译后的模型 {name} 失败: {str(e)}")
+        return compiled
+
+    def _load(self, name):
+        path = self.paths[name]
+        for _ in range(3):
+            signature = _signature(path)
+            version = _digest(path)
+            model = self._load_compiled(name, version)
+            if model is None:
+                import joblib
+
+                model = joblib.load(path, mmap_mode='r')
+            # 加载期间文件被替换时重新加载，保证版本号与模型内容一致
+            if _signature(path) == signature:
+                if not _is_compiled(model):
+                    _compat(model)
+                    if self.compiled_dir:
+                        model = self._compile(name, version, model)
+                logger.info(f"已加载模型 {name}（版本 {version}）")
+                return ModelVersion(name, version, model, path, signature)
+        raise RuntimeError(f'模型文件 {path} 在加载期间被反复替换')
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_model_registry():
+    """按 settings.MODEL_REGISTRY 创建（并缓存）模型注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                from django.conf import settings
+
+                config = getattr(settings, 'MODEL_REGISTRY', {})
+                _registry = ModelRegistry(
+                    config.get('MODELS', {}),
+                    config.get('CHECK_INTERVAL', 5.0),
+                    config.get('COMPILED_PATH'),
+                )
+    return _registry
+
+
+def get_model(name):
+    """返回当前版本的模型对象"""
+    return get_model_registry().get(name).model
+
+
+def version():
+    """全部模型的版本摘要，用作结果缓存键的一部分"""
+    registry = get_model_registry()
+    return ';'.join(f'{name}:{registry.version(name)}' for name in sorted(registry.paths))
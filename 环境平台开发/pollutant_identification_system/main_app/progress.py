@@ -0,0 +1,49 @@
+# main_app/progress.py
+"""
+计算进度上报
+
+计算函数通过 report_progress(progress, 阶段名称, 已完成数, 总数) 上报进度，
+进度写入任务记录的 progress 字段，各阶段耗时写入 stage_times 字段，同时刷新任务心跳（updated_at），
+状态接口和页面据此显示当前阶段与完成比例。
+上报器只保存任务存储和任务ID，可以随计算函数一起传入进程池 worker；
+同一任务的各步骤在不同进程中上报时，每个副本在开始新阶段时合并任务记录中已有的各阶段耗时。
+"""
+import time
+
+
+class ProgressReporter:
+    """进度上报器，同一阶段内按间隔写入任务存储，切换阶段或阶段完成时立即写入"""
+
+    def __init__(self, store, task_id, interval=0.5):
+        self.store = store
+        self.task_id = task_id
+        self.interval = interval
+        self._stage = None
+        self._stage_started = None
+        self._stage_times = {}
+        self._written_at = 0.0
+
+    def __call__(self, stage, done, total):
+        now = time.time()
+        changed = stage != self._stage
+        if changed:
+            self._stage = stage
+            self._stage_started = now
+            record = self.store.get(self.task_id) or {}
+            self._stage_times = dict(record.get('stage_times') or {}, **self._stage_times)
+        self._stage_times[stage] = round(now - self._stage_started, 3)
+        if not changed and done < total and now - self._written_at < self.interval:
+            return
+        self._written_at = now
+        self.store.update(
+            self.task_id,
+            progress={'stage': stage, 'done': done, 'total': total},
+            stage_times=dict(self._stage_times),
+            updated_at=now,
+        )
+
+
+def report_progress(progress, stage, done, total):
+    """上报计算进度，未传入上报器时不做任何事"""
+    if progress is not None:
+        progress(stage, done, total)
@@ -0,0 +1,139 @@
+# main_app/result_cache.py
+"""
+结果缓存
+
+以上传内容、参考数据和模型的版本以及分析参数的哈希作为键，缓存各分析阶段的结果文件。
+同样的输入再次提交时直接复制缓存的结果，不再进入计算队列。
+缓存文件按最近使用时间（文件修改时间）淘汰，总大小和条目数都有上限；
+缓存只做尽力而为，读写失败时按未命中处理。
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from . import assets, model_registry
+
+
+def cache_key(kind, *parts):
+    """计算缓存键：分析类型、参考数据和模型版本以及各输入部分（bytes 或 str）的 SHA-256"""
+    digest = hashlib.sha256()
+    for part in (kind, assets.version(), model_registry.version()) + parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        # 每部分前写入长度，避免不同切分方式得到相同的哈希
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """按内容寻址的结果文件缓存，键对应 <key>.xlsx 和可选的 <key>.json 元数据"""
+
+    def __init__(self, directory, max_bytes, max_entries):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.xlsx', base + '.json'
+
+    def get(self, key, dest_path):
+        """命中时把结果文件放到 dest_path 并返回元数据字典，未命中返回 None"""
+        data_path, meta_path = self._paths(key)
+        try:
+            try:
+                # 优先使用硬链接，结果文件过期删除不影响缓存
+                os.link(data_path, dest_path)
+            except OSError:
+                shutil.copyfile(data_path, dest_path)
+            # 更新修改时间，作为最近使用时间
+            os.utime(data_path)
+            meta = {}
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            return None
+        with self._lock:
+            self.hits += 1
+        return meta
+
+    def put(self, key, src_path, meta=None):
+        """把结果文件写入缓存，写入后按上限淘汰最久未使用的条目"""
+        data_path, meta_path = self._paths(key)
+        tmp_path = os.path.join(self.directory, f'.{uuid.uuid4().hex}.tmp')
+        try:
+            if meta:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, ensure_ascii=False)
+                os.replace(tmp_path, meta_path)
+            # 结果文件最后原子替换，其存在即表示条目完整
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, data_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """超出大小或条目数上限时，按最近使用时间从旧到新删除"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.xlsx'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.name[:-len('.xlsx')]))
+            total += stat.st_size
+        entries.sort()
+        while entries and (total > self.max_bytes or len(entries) > self.max_entries):
+            _, size, key = entries.pop(0)
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def stats(self):
+        """当前进程的命中统计"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """按 settings.RESULT_CACHE 创建（并缓存）结果缓存实例"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from django.conf import settings
+
+                config = getattr(settings, 'RESULT_CACHE', {})
+                _cache = ResultCache(
+                    config.get('PATH', os.path.join(settings.MEDIA_ROOT, 'result_cache')),
+                    config.get('MAX_BYTES', 1024 * 1024 * 1024),
+                    config.get('MAX_ENTRIES', 500),
+                )
+    return _cache
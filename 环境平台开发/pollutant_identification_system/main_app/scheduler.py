@@ -0,0 +1,253 @@
+# main_app/scheduler.py
+"""
+公平调度器
+
+位于线程池之前，决定排队任务的执行顺序：
+- 每个用户同时运行的任务数不超过上限，避免单个用户占满全部线程；
+- 优先级高（数值小）的任务先执行，交互式的单样本任务排在批量任务之前；
+- 同一优先级内按用户轮转派发；
+- 队列长度和任务占用的上传数据量有上限，超出时拒绝提交（QueueFull），单个任务超过数据量上限时
+  无论队列是否为空都拒绝（JobTooLarge）；
+- 停机时 close() 停止接收新任务并交出排队任务，wait_idle() 等待运行中的任务结束。
+
+队列、并发上限和排队位置都只在本进程内计算：任务存储虽然由多个 Web 进程共享，
+部署 N 个进程时每个用户最多同时运行 N × per_user_limit 个任务，队列总长度和数据量上限也是 N 倍。
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+
+# 任务优先级，数值越小越先执行
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+PRIORITIES = {
+    'interactive': PRIORITY_INTERACTIVE,
+    'batch': PRIORITY_BATCH,
+}
+
+
+class QueueFull(Exception):
+    """队列已满，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message, retry_after, queue_depth):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+
+
+class SchedulerClosed(QueueFull):
+    """调度器已关闭（服务停机中），不再接收任务"""
+
+
+class JobTooLarge(QueueFull):
+    """单个任务的数据量超过上限，重试也无法接收"""
+
+
+class _Job:
+    __slots__ = ('task_id', 'user_id', 'priority', 'seq', 'size', 'func', 'args')
+
+    def __init__(self, task_id, user_id, priority, seq, size, func, args):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.priority = priority
+        self.seq = seq
+        self.size = size
+        self.func = func
+        self.args = args
+
+
+class FairShareScheduler:
+    """按用户公平、按优先级派发任务到线程池"""
+
+    def __init__(self, executor, slots, per_user_limit, max_depth, max_bytes):
+        self._executor = executor
+        self._slots = slots
+        self._per_user_limit = per_user_limit
+        self._max_depth = max_depth
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 运行中的任务全部结束时通知 wait_idle
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+        self._seq = itertools.count()
+        # user_id -> [(priority, seq, task_id)] 小顶堆
+        self._queues = {}
+        # 有排队任务的用户，按轮转顺序排列
+        self._order = deque()
+        # task_id -> 排队中的任务
+        self._jobs = {}
+        # user_id -> 正在运行的任务数
+        self._running = {}
+        self._running_total = 0
+        self._running_ids = set()
+        # 排队和运行中任务持有的上传数据字节数
+        self._held_bytes = 0
+        # 任务平均耗时（指数滑动平均），用于估算 Retry-After
+        self._avg_duration = None
+
+    def submit(self, task_id, user_id, priority, size, func, *args):
+        """任务入队，有空闲线程时立即派发；超出队列长度或数据量上限时抛出 QueueFull"""
+        with self._lock:
+            if self._closed:
+                raise SchedulerClosed('服务正在重启，请稍后重试', self._retry_after_locked(), len(self._jobs))
+            if len(self._jobs) >= self._max_depth:
+                raise QueueFull('任务队列已满', self._retry_after_locked(), len(self._jobs))
+            if size > self._max_bytes:
+                raise JobTooLarge('任务数据量超过上限', 0, len(self._jobs))
+            if self._held_bytes + size > self._max_bytes:
+                raise QueueFull('排队任务的数据量已达上限', self._retry_after_locked(), len(self._jobs))
+            job = _Job(task_id, user_id, priority, next(self._seq), size, func, args)
+            self._held_bytes += size
+            self._enqueue_locked(job)
+            self._dispatch_locked()
+
+    def cancel(self, task_id):
+        """把排队中的任务移出队列，任务不在本进程队列中（已派发或不存在）时返回 False"""
+        with self._lock:
+            job = self._jobs.pop(task_id, None)
+            if job is None:
+                return False
+            heap = self._queues[job.user_id]
+            heap.remove((job.priority, job.seq, task_id))
+            heapq.heapify(heap)
+            if not heap:
+                del self._queues[job.user_id]
+                self._order.remove(job.user_id)
+            self._held_bytes -= job.size
+            return True
+
+    def close(self):
+        """停止接收和派发任务，清空队列并返回排队中任务的ID（运行中的任务不受影响）"""
+        with self._lock:
+            self._closed = True
+            task_ids = list(self._jobs)
+            for job in self._jobs.values():
+                self._held_bytes -= job.size
+            self._jobs.clear()
+            self._queues.clear()
+            self._order.clear()
+            return task_ids
+
+    def running_tasks(self):
+        """正在运行的任务ID"""
+        with self._lock:
+            return list(self._running_ids)
+
+    def wait_idle(self, timeout=None):
+        """等待运行中的任务全部结束，超时返回 False"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._running_total, timeout)
+
+    def queue_position(self, task_id):
+        """返回任务在队列中的位置（0 表示下一个执行），不在本进程队列中时返回 None"""
+        with self._lock:
+            if task_id not in self._jobs:
+                return None
+            # 按派发规则模拟出队顺序（不考虑并发上限，作为估计值）
+            queues = {user_id: list(heap) for user_id, heap in self._queues.items()}
+            order = deque(self._order)
+            position = 0
+            while order:
+                user_id = self._pick_user(order, queues, respect_limit=False)
+                _, _, next_id = heapq.heappop(queues[user_id])
+                if next_id == task_id:
+                    return position
+                self._rotate(order, user_id, queues)
+                position += 1
+            return None
+
+    def queue_depth(self):
+        """当前排队（尚未派发）的任务数"""
+        with self._lock:
+            return len(self._jobs)
+
+    def stats(self):
+        """本进程的队列状态，供客户端退避参考"""
+        with self._lock:
+            return {
+                'scope': 'process',
+                'queue_depth': len(self._jobs),
+                'max_depth': self._max_depth,
+                'running': self._running_total,
+                'slots': self._slots,
+                'held_bytes': self._held_bytes,
+                'max_bytes': self._max_bytes,
+                'retry_after': self._retry_after_locked() if len(self._jobs) else 0,
+            }
+
+    def _retry_after_locked(self):
+        """按平均耗时估算队列消化到有空位所需的秒数"""
+        avg = self._avg_duration if self._avg_duration is not None else 5.0
+        rounds = (len(self._jobs) + 1) / max(self._slots, 1)
+        return max(1, math.ceil(avg * rounds))
+
+    def _pick_user(self, order, queues, respect_limit=True):
+        """在轮转顺序中选出队首优先级最高的用户；同优先级取轮转顺序靠前者"""
+        best_user, best_priority = None, None
+        for user_id in order:
+            if respect_limit and self._running.get(user_id, 0) >= self._per_user_limit:
+                continue
+            priority = queues[user_id][0][0]
+            if best_priority is None or priority < best_priority:
+                best_user, best_priority = user_id, priority
+        return best_user
+
+    @staticmethod
+    def _rotate(order, user_id, queues):
+        """已派发任务的用户移到轮转队尾，没有剩余任务时移出"""
+        order.remove(user_id)
+        if queues[user_id]:
+            order.append(user_id)
+        else:
+            del queues[user_id]
+
+    def _enqueue_locked(self, job):
+        self._jobs[job.task_id] = job
+        if job.user_id not in self._queues:
+            self._queues[job.user_id] = []
+            self._order.append(job.user_id)
+        heapq.heappush(self._queues[job.user_id], (job.priority, job.seq, job.task_id))
+
+    def _dispatch_locked(self):
+        while self._running_total < self._slots and self._order:
+            user_id = self._pick_user(self._order, self._queues)
+            if user_id is None:
+                # 所有排队用户都已达到并发上限
+                return
+            _, _, task_id = heapq.heappop(self._queues[user_id])
+            self._rotate(self._order, user_id, self._queues)
+            job = self._jobs.pop(task_id)
+            try:
+                self._executor.submit(self._run, job)
+            except RuntimeError:
+                # 解释器退出时线程池不再接收任务：放回队列，停机时由 close() 交出并挂起
+                self._enqueue_locked(job)
+                return
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            self._running_total += 1
+            self._running_ids.add(task_id)
+
+    def _run(self, job):
+        started = time.monotonic()
+        try:
+            job.func(*job.args)
+        finally:
+            duration = time.monotonic() - started
+            with self._lock:
+                self._held_bytes -= job.size
+                if self._avg_duration is None:
+                    self._avg_duration = duration
+                else:
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+                self._running[job.user_id] -= 1
+                if not self._running[job.user_id]:
+                    del self._running[job.user_id]
+                self._running_total -= 1
+                self._running_ids.discard(job.task_id)
+                if not self._running_total:
+                    self._idle.notify_all()
+                self._dispatch_locked()
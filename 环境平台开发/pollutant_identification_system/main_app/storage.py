@@ -0,0 +1,135 @@
+# main_app/storage.py
+"""
+结果文件存储
+
+结果文件按名称存取，名称形如 results/3f/result_1_<id>.xlsx：
+第一级为分区（results / effect_results / tracing_results），
+第二级为文件名哈希的前两位，避免单个目录中文件过多导致列目录变慢。
+写入先生成同目录下的临时文件，完成后原子替换为正式名称，读取方不会看到写了一半的文件。
+任务记录中的 path 字段保存的是存储名称，下载和过期清理都通过存储读写。
+"""
+import hashlib
+import os
+import threading
+import uuid
+from abc import ABC, abstractmethod
+
+# 结果文件分区
+AREAS = ('results', 'effect_results', 'tracing_results')
+
+
+class ResultStorage(ABC):
+    """结果存储接口，具体实现需要提供以下抽象方法"""
+
+    def name_for(self, area, filename):
+        """生成分区内带哈希分片的存储名称"""
+        shard = hashlib.sha1(filename.encode('utf-8')).hexdigest()[:2]
+        return f'{area}/{shard}/{filename}'
+
+    @abstractmethod
+    def path(self, name):
+        """返回本地文件路径，计算进程直接读写该路径"""
+
+    @abstractmethod
+    def temp_path(self, name):
+        """返回用于写入的临时路径，写完后调用 commit(temp_path, name)"""
+
+    @abstractmethod
+    def commit(self, temp_path, name):
+        """把写好的临时文件原子替换为正式名称"""
+
+    @abstractmethod
+    def discard(self, temp_path):
+        """删除未提交的临时文件"""
+
+    @abstractmethod
+    def open(self, name):
+        """以二进制只读方式打开文件"""
+
+    @abstractmethod
+    def exists(self, name):
+        """文件是否存在"""
+
+    @abstractmethod
+    def delete(self, name):
+        """删除文件，文件不存在时不报错"""
+
+    @abstractmethod
+    def list(self, area):
+        """遍历分区内全部文件，返回 (存储名称, 修改时间)"""
+
+
+class LocalResultStorage(ResultStorage):
+    """本地文件系统实现，根目录默认为 MEDIA_ROOT"""
+
+    def __init__(self, root):
+        self.root = str(root)
+        for area in AREAS:
+            os.makedirs(os.path.join(self.root, area), exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def temp_path(self, name):
+        path = self.path(name)
+        directory, filename = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        # 保留扩展名，pandas 按扩展名选择写入引擎
+        return os.path.join(directory, f'.{uuid.uuid4().hex}.{filename}')
+
+    def commit(self, temp_path, name):
+        os.replace(temp_path, self.path(name))
+
+    def discard(self, temp_path):
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def list(self, area):
+        area_dir = os.path.join(self.root, area)
+        for shard in os.scandir(area_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                yield f'{area}/{shard.name}/{entry.name}', mtime
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_result_storage():
+    """按 settings.RESULT_STORAGE 创建（并缓存）结果存储实例"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                from django.conf import settings
+                from django.utils.module_loading import import_string
+
+                config = getattr(settings, 'RESULT_STORAGE', {})
+                backend = import_string(
+                    config.get('BACKEND', 'main_app.storage.LocalResultStorage')
+                )
+                options = config.get('OPTIONS', {})
+                if backend is LocalResultStorage and 'root' not in options:
+                    options = dict(options, root=settings.MEDIA_ROOT)
+                _storage = backend(**options)
+    return _storage
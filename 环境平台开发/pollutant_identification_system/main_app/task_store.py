@@ -0,0 +1,362 @@
+# main_app/task_store.py
+"""
+任务存储
+
+保存任务状态与结果记录，替代进程内的 TASK_RESULTS 字典。
+默认使用 SQLite（WAL 模式，按 user_id / type / status / timestamp 建索引），
+重启后状态不丢失，多个 Web 进程共享同一份任务状态。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+# 独立成列（可建索引）的字段，其余字段序列化到 data 列
+INDEXED_FIELDS = ('user_id', 'type', 'status', 'timestamp', 'path')
+
+
+class TaskStore(ABC):
+    """任务存储接口，具体实现需要提供以下方法"""
+
+    @abstractmethod
+    def put(self, task_id, record):
+        """写入（或覆盖）一条任务记录"""
+
+    @abstractmethod
+    def add(self, task_id, record):
+        """仅当记录不存在时写入（原子操作），返回是否写入"""
+
+    @abstractmethod
+    def get(self, task_id):
+        """读取任务记录，不存在时返回 None"""
+
+    @abstractmethod
+    def get_many(self, task_ids):
+        """批量读取任务记录，返回 {task_id: 记录}，不存在的任务不出现在结果中"""
+
+    @abstractmethod
+    def update(self, task_id, **fields):
+        """更新任务记录的部分字段，记录不存在时返回 False"""
+
+    @abstractmethod
+    def claim(self, task_id, field, expected, **fields):
+        """仅当记录的 field 字段当前值为 expected 时更新字段（比较并替换，原子操作），返回是否成功
+
+        例如多个进程同时启动时认领同一批挂起任务（field='status', expected='suspended'），
+        保证每个任务只被一个进程恢复。字段不存在时视为 None。
+        """
+
+    @abstractmethod
+    def delete(self, task_id):
+        """删除任务记录"""
+
+    @abstractmethod
+    def find(self, user_id=None, type=None, status=None, limit=None):
+        """按条件查询任务记录，按时间倒序返回"""
+
+    @abstractmethod
+    def expired(self, before):
+        """返回 timestamp 早于 before 的全部记录"""
+
+    @abstractmethod
+    def set_latest(self, user_id, stage, result_id, path):
+        """登记用户在某一阶段最新完成的结果"""
+
+    @abstractmethod
+    def get_latest(self, user_id, stage):
+        """返回用户在某一阶段最新完成的结果 {'result_id', 'path', 'timestamp'}，没有时返回 None"""
+
+    @abstractmethod
+    def clear_latest(self, result_id):
+        """结果过期时从最新结果索引中移除"""
+
+
+class MemoryTaskStore(TaskStore):
+    """进程内存实现，仅适用于单进程部署和测试"""
+
+    def __init__(self):
+        self._records = {}
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def put(self, task_id, record):
+        with self._lock:
+            self._records[task_id] = dict(record, task_id=task_id)
+
+    def add(self, task_id, record):
+        with self._lock:
+            if task_id in self._records:
+                return False
+            self._records[task_id] = dict(record, task_id=task_id)
+            return True
+
+    def get(self, task_id):
+        with self._lock:
+            record = self._records.get(task_id)
+            return dict(record) if record is not None else None
+
+    def get_many(self, task_ids):
+        with self._lock:
+            return {task_id: dict(self._records[task_id])
+                    for task_id in task_ids if task_id in self._records}
+
+    def update(self, task_id, **fields):
+        with self._lock:
+            if task_id not in self._records:
+                return False
+            self._records[task_id].update(fields)
+            return True
+
+    def claim(self, task_id, field, expected, **fields):
+        with self._lock:
+            record = self._records.get(task_id)
+            if record is None or record.get(field) != expected:
+                return False
+            record.update(fields)
+            return True
+
+    def delete(self, task_id):
+        with self._lock:
+            self._records.pop(task_id, None)
+
+    def find(self, user_id=None, type=None, status=None, limit=None):
+        with self._lock:
+            records = [
+                dict(r) for r in self._records.values()
+                if (user_id is None or r.get('user_id') == user_id)
+                and (type is None or r.get('type') == type)
+                and (status is None or r.get('status') == status)
+            ]
+        records.sort(key=lambda r: r.get('timestamp', 0), reverse=True)
+        return records[:limit] if limit else records
+
+    def expired(self, before):
+        with self._lock:
+            return [dict(r) for r in self._records.values()
+                    if r.get('timestamp', 0) < before]
+
+    def set_latest(self, user_id, stage, result_id, path):
+        with self._lock:
+            self._latest[(user_id, stage)] = {
+                'result_id': result_id, 'path': path, 'timestamp': time.time()
+            }
+
+    def get_latest(self, user_id, stage):
+        with self._lock:
+            latest = self._latest.get((user_id, stage))
+            return dict(latest) if latest is not None else None
+
+    def clear_latest(self, result_id):
+        with self._lock:
+            for key, latest in list(self._latest.items()):
+                if latest['result_id'] == result_id:
+                    del self._latest[key]
+
+
+class SQLiteTaskStore(TaskStore):
+    """SQLite 实现，每个线程使用独立连接"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id   TEXT PRIMARY KEY,
+            user_id   INTEGER,
+            type      TEXT,
+            status    TEXT,
+            timestamp REAL NOT NULL,
+            path      TEXT,
+            data      TEXT NOT NULL DEFAULT '{}'
+        );
+        CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks (user_id, timestamp);
+        CREATE INDEX IF NOT EXISTS idx_tasks_type ON tasks (type);
+        CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+        CREATE INDEX IF NOT EXISTS idx_tasks_timestamp ON tasks (timestamp);
+
+        -- 每个用户每个阶段最新完成的结果
+        CREATE TABLE IF NOT EXISTS latest_results (
+            user_id   INTEGER NOT NULL,
+            stage     TEXT NOT NULL,
+            result_id TEXT NOT NULL,
+            path      TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            PRIMARY KEY (user_id, stage)
+        );
+        CREATE INDEX IF NOT EXISTS idx_latest_results_result_id ON latest_results (result_id);
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(self.SCHEMA)
+
+    def __getstate__(self):
+        # 连接不能跨进程传递，子进程按路径重新连接
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_row(task_id, record):
+        data = {k: v for k, v in record.items()
+                if k not in INDEXED_FIELDS and k != 'task_id'}
+        return (task_id, record.get('user_id'), record.get('type'),
+                record.get('status'), record.get('timestamp', time.time()),
+                record.get('path'), json.dumps(data, ensure_ascii=False))
+
+    @staticmethod
+    def _from_row(row):
+        record = json.loads(row['data'])
+        record['task_id'] = row['task_id']
+        for field in INDEXED_FIELDS:
+            if row[field] is not None:
+                record[field] = row[field]
+        return record
+
+    def put(self, task_id, record):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO tasks '
+            '(task_id, user_id, type, status, timestamp, path, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self._to_row(task_id, record)
+        )
+
+    def add(self, task_id, record):
+        cursor = self._connection().execute(
+            'INSERT OR IGNORE INTO tasks '
+            '(task_id, user_id, type, status, timestamp, path, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            self._to_row(task_id, record)
+        )
+        return cursor.rowcount == 1
+
+    def get(self, task_id):
+        row = self._connection().execute(
+            'SELECT * FROM tasks WHERE task_id = ?', (task_id,)
+        ).fetchone()
+        return self._from_row(row) if row is not None else None
+
+    def get_many(self, task_ids):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+        placeholders = ', '.join('?' * len(task_ids))
+        rows = self._connection().execute(
+            f'SELECT * FROM tasks WHERE task_id IN ({placeholders})', task_ids
+        ).fetchall()
+        return {row['task_id']: self._from_row(row) for row in rows}
+
+    def update(self, task_id, **fields):
+        return self._update(task_id, fields)
+
+    def claim(self, task_id, field, expected, **fields):
+        return self._update(task_id, fields, (field, expected))
+
+    def _update(self, task_id, fields, expected=None):
+        conn = self._connection()
+        # 读-改-写放在同一个写事务中，避免并发更新互相覆盖
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT * FROM tasks WHERE task_id = ?', (task_id,)
+            ).fetchone()
+            record = self._from_row(row) if row is not None else None
+            if record is None or (expected is not None and record.get(expected[0]) != expected[1]):
+                conn.execute('COMMIT')
+                return False
+            record.update(fields)
+            conn.execute(
+                'UPDATE tasks SET user_id = ?, type = ?, status = ?, '
+                'timestamp = ?, path = ?, data = ? WHERE task_id = ?',
+                self._to_row(task_id, record)[1:] + (task_id,)
+            )
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, task_id):
+        self._connection().execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+
+    def find(self, user_id=None, type=None, status=None, limit=None):
+        clauses, params = [], []
+        for column, value in (('user_id', user_id), ('type', type), ('status', status)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        sql = 'SELECT * FROM tasks'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY timestamp DESC'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        rows = self._connection().execute(sql, params).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def expired(self, before):
+        rows = self._connection().execute(
+            'SELECT * FROM tasks WHERE timestamp < ?', (before,)
+        ).fetchall()
+        return [self._from_row(row) for row in rows]
+
+    def set_latest(self, user_id, stage, result_id, path):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO latest_results '
+            '(user_id, stage, result_id, path, timestamp) VALUES (?, ?, ?, ?, ?)',
+            (user_id, stage, result_id, path, time.time())
+        )
+
+    def get_latest(self, user_id, stage):
+        row = self._connection().execute(
+            'SELECT result_id, path, timestamp FROM latest_results '
+            'WHERE user_id = ? AND stage = ?', (user_id, stage)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def clear_latest(self, result_id):
+        self._connection().execute(
+            'DELETE FROM latest_results WHERE result_id = ?', (result_id,)
+        )
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_task_store():
+    """按 settings.TASK_STORE 创建（并缓存）任务存储实例"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                from django.conf import settings
+                from django.utils.module_loading import import_string
+
+                config = getattr(settings, 'TASK_STORE', {})
+                backend = import_string(
+                    config.get('BACKEND', 'main_app.task_store.SQLiteTaskStore')
+                )
+                options = config.get('OPTIONS', {})
+                if backend is SQLiteTaskStore and 'path' not in options:
+                    options = dict(options, path=os.path.join(settings.BASE_DIR, 'task_store.sqlite3'))
+                _store = backend(**options)
+    return _store
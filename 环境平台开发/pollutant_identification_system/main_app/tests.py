@@ -1,3 +1,1130 @@
-from django.test import TestCase
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import assets
+from .archive import ResultArchive
+from .cancellation import CancellationToken, TaskCancelled
+from .expiry import ExpiryScheduler
+from .exposure import (DESCRIPTOR_COLUMNS, QUANT_PREDICTED, QUANT_REFERENCE, QUANT_UNCALIBRATED,
+                       normalize_columns, quantify, resolve_descriptors)
+from .descriptor_cache import DescriptorCache
+from .progress import ProgressReporter, report_progress
+from .result_cache import ResultCache, cache_key
+from .scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, FairShareScheduler, JobTooLarge, QueueFull
+from .storage import LocalResultStorage, ResultStorage
+from .task_store import MemoryTaskStore, SQLiteTaskStore
+from .model_registry import ModelRegistry
+from .tree_ensemble import CompiledModel, UnsupportedModel, compile_pipeline
+from .uploads import SpooledUpload, as_readable, spool_upload
+
+MODEL_PATH = settings.MODEL_REGISTRY['MODELS']['response_factor']
+SAMPLE_PATH = os.path.join(os.path.dirname(MODEL_PATH), 'POS预测输入.xlsx')
+
+
+@unittest.skipUnless(importlib.util.find_spec('xgboost') and os.path.exists(MODEL_PATH), '需要 xgboost 和响应因子模型文件')
+class CompiledModelParityTests(SimpleTestCase):
+    """编译后的树集成与原流水线的预测结果逐位一致"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        import joblib
+        from .model_registry import _compat
+
+        cls.pipeline = joblib.load(MODEL_PATH)
+        _compat(cls.pipeline)
+        cls.compiled = compile_pipeline(cls.pipeline)
+
+    def samples(self):
+        """样例输入，加上随机生成的超出训练范围的数据和缺失值"""
+        sample = pd.read_excel(SAMPLE_PATH)[DESCRIPTOR_COLUMNS]
+        rng = np.random.default_rng(0)
+        noise = pd.DataFrame(rng.normal(sample.mean(), sample.std() * 3, (5000, len(DESCRIPTOR_COLUMNS))),
+                             columns=DESCRIPTOR_COLUMNS)
+        noise = noise.mask(rng.random(noise.shape) < 0.1)
+        return pd.concat([sample, noise], ignore_index=True)
+
+    def test_predictions_are_bitwise_identical(self):
+        X = self.samples()
+        expected = self.pipeline.predict(X)
+        actual = self.compiled.predict(X)
+        self.assertEqual(actual.dtype, expected.dtype)
+        np.testing.assert_array_equal(actual, expected)
+
+    def test_single_row_and_empty_batch(self):
+        X = self.samples()
+        np.testing.assert_array_equal(self.compiled.predict(X.head(1)), self.pipeline.predict(X.head(1)))
+        self.assertEqual(len(self.compiled.predict(X.head(0))), 0)
+
+    def test_saved_model_round_trip(self):
+        X = self.samples()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'model.npz')
+            self.compiled.save(path)
+            loaded = CompiledModel.load(path)
+        np.testing.assert_array_equal(loaded.predict(X), self.pipeline.predict(X))
+
+
+class UnsupportedModelTests(SimpleTestCase):
+    """无法编译的模型抛出 UnsupportedModel，模型注册表继续使用原模型"""
+
+    def test_unsupported_model(self):
+        with self.assertRaises(UnsupportedModel):
+            compile_pipeline(object())
+
+    def test_registry_falls_back_to_original_model(self):
+        from .model_registry import ModelRegistry
+
+        model = object()
+        with tempfile.TemporaryDirectory() as directory:
+            registry = ModelRegistry({}, compiled_dir=directory)
+            with self.assertLogs('access', 'INFO'):
+                self.assertIs(registry._compile('m', 'v', model), model)
+
+
+class LogPModel:
+    """以 LogP 作为 logRF 预测值的模型"""
+
+    def predict(self, X):
+        return X['LogP'].to_numpy()
+
+
+def descriptor_rows(**log_p):
+    """按 InChIKey 给出 LogP 的描述符表，其余描述符为 0"""
+    table = pd.DataFrame(0.0, index=pd.Index(list(log_p), name='InChikey'), columns=DESCRIPTOR_COLUMNS)
+    table['LogP'] = list(log_p.values())
+    return table
+
+
+class ExposureQuantifyTests(SimpleTestCase):
+    """浓度计算：参考物质使用实测 logRF，其余物质使用校正后的预测 logRF"""
+
+    reference = pd.DataFrame({'InChikey': ['REF'], '峰面积': [100.0], '浓度': [10.0]})
+
+    def test_concentrations(self):
+        detected = pd.DataFrame({'InChikey': ['REF', 'NEW'], '峰面积': [50.0, 300.0]})
+        # REF 实测 logRF 为 1，预测为 0.5，校正量 0.5；NEW 预测 1.5，校正后为 2
+        result, offset = quantify(detected, self.reference, LogPModel(), descriptor_rows(REF=0.5, NEW=1.5))
+        self.assertEqual(offset, 0.5)
+        np.testing.assert_allclose(result['logRF'], [1.0, 2.0])
+        np.testing.assert_allclose(result['浓度'], [5.0, 3.0])
+        self.assertEqual(list(result['定量方式']), [QUANT_REFERENCE, QUANT_PREDICTED])
+
+    def test_measured_rows_need_no_descriptors(self):
+        detected = pd.DataFrame({'InChikey': ['REF'], '峰面积': [50.0]})
+        result, offset = quantify(detected, self.reference, LogPModel(), descriptor_rows())
+        self.assertEqual(offset, 0.0)
+        np.testing.assert_allclose(result['浓度'], [5.0])
+        self.assertEqual(list(result['定量方式']), [QUANT_REFERENCE])
+
+    def test_uncalibrated_prediction_is_flagged(self):
+        detected = pd.DataFrame({'InChikey': ['NEW'], '峰面积': [100.0]})
+        with self.assertLogs('access', 'WARNING'):
+            result, offset = quantify(detected, self.reference, LogPModel(), descriptor_rows(NEW=1.0))
+        self.assertEqual(offset, 0.0)
+        np.testing.assert_allclose(result['浓度'], [10.0])
+        self.assertEqual(list(result['定量方式']), [QUANT_UNCALIBRATED])
+
+    def test_missing_descriptors(self):
+        detected = pd.DataFrame({'InChikey': ['REF', 'NEW'], '峰面积': [50.0, 300.0]})
+        with self.assertRaisesRegex(ValueError, 'NEW'):
+            quantify(detected, self.reference, LogPModel(), descriptor_rows(REF=0.5))
+
+    def test_missing_columns(self):
+        df = pd.DataFrame({' InChIKey ': ['abc'], 'Peak Area': [1.0]})
+        self.assertEqual(list(normalize_columns(df, ['InChikey', '峰面积'], '检出物质文件').columns),
+                         ['InChikey', '峰面积'])
+        with self.assertRaisesRegex(ValueError, '参考物质文件缺少列: 浓度'):
+            normalize_columns(df, ['InChikey', '峰面积', '浓度'], '参考物质文件')
+
+
+class DescriptorCacheTests(SimpleTestCase):
+    """描述符缓存的查询、批量写入、命中统计和并发写入时的读取"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = DescriptorCache(self.directory, DESCRIPTOR_COLUMNS)
+
+    def test_lookup_and_upsert(self):
+        found, missing = self.cache.lookup(['A'])
+        self.assertTrue(found.empty)
+        self.assertEqual(list(missing), ['A'])
+        self.assertTrue(self.cache.upsert(descriptor_rows(B=2.0, A=1.0)))
+        self.assertTrue(self.cache.upsert(descriptor_rows(A=3.0, C=np.nan)))
+        found, missing = self.cache.lookup(['C', 'A', 'D', 'B'])
+        self.assertEqual(list(found.columns), DESCRIPTOR_COLUMNS)
+        self.assertEqual(list(found.index), ['C', 'A', 'B'])
+        np.testing.assert_array_equal(found['LogP'], [np.nan, 3.0, 2.0])
+        self.assertEqual(list(missing), ['D'])
+
+    def test_stats(self):
+        self.cache.upsert(descriptor_rows(A=1.0))
+        self.cache.lookup(['A', 'B'])
+        self.cache.lookup(['A'])
+        self.cache.lookup(['A', 'B'], record=False)
+        self.assertEqual(self.cache.stats(), {'entries': 1, 'hits': 2, 'misses': 1,
+                                              'hit_rate': 0.6667, 'miss_rate': 0.3333})
+        # 其他实例（进程）写入的统计文件一并汇总
+        reader = DescriptorCache(self.directory, DESCRIPTOR_COLUMNS)
+        self.assertEqual(reader.stats()['hits'], 2)
+
+    def test_previous_generation_is_kept(self):
+        self.cache.upsert(descriptor_rows(A=1.0))
+        first = self.cache.version()
+        self.cache.upsert(descriptor_rows(B=2.0))
+        self.assertTrue(os.path.isdir(os.path.join(self.directory, first)))
+        self.cache.upsert(descriptor_rows(C=3.0))
+        self.assertFalse(os.path.isdir(os.path.join(self.directory, first)))
+
+    def test_reader_retries_when_generation_is_replaced(self):
+        self.cache.upsert(descriptor_rows(A=1.0))
+        reader = DescriptorCache(self.directory, DESCRIPTOR_COLUMNS)
+        load = np.load
+        replaced = []
+
+        def load_during_write(*args, **kwargs):
+            if not replaced:
+                # 读取期间其他进程写入了新的一代数据并清理了旧数据
+                replaced.append(True)
+                self.cache.upsert(descriptor_rows(B=2.0))
+                raise FileNotFoundError(args[0])
+            return load(*args, **kwargs)
+
+        with mock.patch.object(np, 'load', load_during_write):
+            found, missing = reader.lookup(['A', 'B'])
+        self.assertEqual(list(found.index), ['A', 'B'])
+        self.assertTrue(missing.empty)
+
+
+class InMemoryInputTests(SimpleTestCase):
+    """计算函数直接读取内存中的上传内容，不写临时文件"""
+
+    def xlsx(self, df):
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        return buffer.getvalue()
+
+    def test_as_readable(self):
+        self.assertEqual(as_readable(b'abc').read(), b'abc')
+        self.assertEqual(as_readable(memoryview(b'abc')).read(), b'abc')
+        f = io.BytesIO(b'abc')
+        f.read()
+        self.assertIs(as_readable(f), f)
+        self.assertEqual(f.read(), b'abc')
+        self.assertEqual(as_readable('input.xlsx'), 'input.xlsx')
+
+    def test_read_inputs_from_bytes(self):
+        from .calculate import read_inputs
+
+        reference = self.xlsx(pd.DataFrame({'InChIKey': ['abc'], '峰面积': [100.0], 'Concentration': [10.0]}))
+        detected = self.xlsx(pd.DataFrame({'inchikey': ['def', None], 'Area': [1.0, 2.0]}))
+        reference, detected = read_inputs(reference, memoryview(detected))
+        self.assertEqual(list(reference.columns), ['InChikey', '峰面积', '浓度'])
+        self.assertEqual(list(detected['InChikey']), ['DEF'])
+
+
+class SpoolUploadTests(SimpleTestCase):
+    """上传文件按块写入暂存目录，任务只持有句柄"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_spool_and_handle_round_trip(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        content = os.urandom(10000)
+        upload = spool_upload(SimpleUploadedFile('input.xlsx', content), self.directory, chunk_size=1024)
+        self.assertTrue(upload.path.endswith('.xlsx'))
+        self.assertEqual(upload.size, len(content))
+        self.assertEqual(upload.sha256, hashlib.sha256(content).hexdigest())
+        with open(upload.path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        restored = SpooledUpload.from_handle(json.loads(json.dumps(upload.handle())))
+        self.assertEqual(restored.handle(), upload.handle())
+        restored.remove()
+        restored.remove()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_failed_upload_leaves_no_file(self):
+        uploaded = mock.Mock()
+        uploaded.name = 'input.xlsx'
+        uploaded.chunks.return_value = self.broken_chunks()
+        with self.assertRaises(IOError):
+            spool_upload(uploaded, self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @staticmethod
+    def broken_chunks():
+        yield b'partial'
+        raise IOError('client disconnected')
+
+
+class ResolveDescriptorsTests(SimpleTestCase):
+    """输入文件中的描述符优先于缓存，缓存只补齐没有提供描述符的物质"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = DescriptorCache(directory.name, DESCRIPTOR_COLUMNS)
+        self.cache.upsert(descriptor_rows(A=1.0, B=2.0))
+
+    def frame(self, **log_p):
+        table = descriptor_rows(**log_p).reset_index()
+        table['峰面积'] = 1.0
+        return table
+
+    def test_supplied_descriptors_win_and_are_cached(self):
+        detected = pd.concat([self.frame(A=5.0), pd.DataFrame({'InChikey': ['B'], '峰面积': [1.0]})],
+                             ignore_index=True)
+        reference = pd.DataFrame({'InChikey': ['C'], '峰面积': [1.0], '浓度': [1.0]})
+        descriptors = resolve_descriptors(detected, reference, self.cache)
+        self.assertEqual(descriptors['LogP'].to_dict(), {'A': 5.0, 'B': 2.0})
+        self.assertEqual(self.cache.lookup(['A'])[0]['LogP'].tolist(), [5.0])
+        # 提供了描述符的物质不查缓存
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_unchanged_rows_are_not_rewritten(self):
+        version = self.cache.version()
+        reference = self.frame(A=1.0).assign(浓度=1.0)
+        resolve_descriptors(self.frame(B=2.0), reference, self.cache)
+        self.assertEqual(self.cache.version(), version)
+        resolve_descriptors(self.frame(B=3.0), reference, self.cache)
+        self.assertNotEqual(self.cache.version(), version)
+
+
+class ModelRegistryTests(SimpleTestCase):
+    """模型每个进程只加载一次，文件被替换后切换到新版本"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'model.pkl')
+        self.dump({'weights': np.arange(3)})
+        self.registry = ModelRegistry({'m': self.path}, check_interval=0)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def dump(self, model):
+        """原子替换模型文件"""
+        import joblib
+
+        tmp_path = f'{self.path}.tmp'
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def test_loads_once(self):
+        import joblib
+
+        with mock.patch.object(joblib, 'load', wraps=joblib.load) as load:
+            first = self.registry.get('m')
+            self.assertIs(self.registry.get('m'), first)
+        self.assertEqual(load.call_count, 1)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(first.version, hashlib.sha256(f.read()).hexdigest()[:12])
+        self.assertEqual(self.registry.version('m'), first.version)
+
+    def test_replaced_file_is_reloaded(self):
+        old = self.registry.get('m')
+        self.dump({'weights': np.arange(4)})
+        new = self.registry.get('m')
+        self.assertNotEqual(new.version, old.version)
+        self.assertEqual(len(new.model['weights']), 4)
+        # 正在使用旧版本的任务继续持有旧对象
+        self.assertEqual(len(old.model['weights']), 3)
+
+    def test_missing_file_version(self):
+        os.remove(self.path)
+        self.assertEqual(self.registry.version('m'), 'missing')
+
+
+class DescriptorGenerationTests(SimpleTestCase):
+    """只为缓存、生成描述符库和输入中都没有描述符、但提供了结构的物质生成描述符"""
+
+    def setUp(self):
+        from . import descriptor_generation
+
+        self.generation = descriptor_generation
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = DescriptorCache(os.path.join(directory.name, 'cache'), DESCRIPTOR_COLUMNS)
+        self.generated = DescriptorCache(os.path.join(directory.name, 'generated'),
+                                         descriptor_generation.GENERATED_COLUMNS)
+        for name, value in (('get_descriptor_cache', lambda: self.cache),
+                            ('get_generated_cache', lambda: self.generated)):
+            patcher = mock.patch.object(descriptor_generation, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    @staticmethod
+    def run_chunks(func, chunks):
+        return (func(chunk) for chunk in chunks)
+
+    def test_split_chunks(self):
+        structures = pd.Series(['C'] * 120, index=[f'K{i}' for i in range(120)])
+        chunks = self.generation.split_chunks(structures, 4)
+        self.assertEqual([len(chunk) for chunk in chunks], [30] * 4)
+        chunks = self.generation.split_chunks(structures, 1)
+        self.assertEqual([len(chunk) for chunk in chunks], [50, 50, 20])
+
+    def test_pending_structures(self):
+        self.cache.upsert(descriptor_rows(CACHED=1.0))
+        self.generated.upsert(descriptor_rows(GENERATED=1.0))
+        detected = descriptor_rows(SUPPLIED=1.0).reset_index()
+        detected = pd.concat([detected, pd.DataFrame({'InChikey': ['CACHED', 'GENERATED', 'NEW', 'BARE']})],
+                             ignore_index=True)
+        detected['SMILES'] = ['CCO', 'CCO', 'CCO', 'CCO', None]
+        reference = pd.DataFrame({'InChikey': ['INCHI'], 'InChI': ['InChI=1S/CH4/h1H4']})
+        pending = self.generation.pending_structures(reference, detected)
+        self.assertEqual(pending.to_dict(), {'NEW': 'CCO', 'INCHI': 'InChI=1S/CH4/h1H4'})
+
+    @unittest.skipUnless(importlib.util.find_spec('rdkit'), '需要 RDKit')
+    def test_generate(self):
+        structures = pd.Series(['CCO', 'InChI=1S/CH4/h1H4', 'not a smiles'], index=['ETHANOL', 'METHANE', 'BAD'])
+        progress = mock.Mock()
+        self.assertEqual(self.generation.generate(structures, self.run_chunks, 2, progress=progress), 2)
+        found, missing = self.generated.lookup(structures.index)
+        self.assertEqual(sorted(found.index), ['ETHANOL', 'METHANE'])
+        self.assertAlmostEqual(found.loc['ETHANOL', 'MoleculeWeight'], 46.069, places=2)
+        self.assertEqual(list(missing), ['BAD'])
+        self.assertEqual(progress.call_args.args, (self.generation.STAGE, 3, 3))
+
+    def test_generate_without_rdkit(self):
+        structures = pd.Series(['CCO'], index=['ETHANOL'])
+        with mock.patch.object(self.generation, 'rdkit_available', return_value=False):
+            self.assertEqual(self.generation.generate(structures, self.run_chunks, 2), 0)
+        self.assertEqual(self.generated.version(), '')
+
+
+class ResultCacheTests(SimpleTestCase):
+    """结果缓存按内容寻址，参考数据更新后缓存键随之变化"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = ResultCache(os.path.join(self.directory, 'cache'), 10 ** 6, 2)
+
+    def write(self, name, content=b'result'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_round_trip_and_miss(self):
+        self.assertTrue(self.cache.put('k', self.write('src'), {'risk_data': [1]}))
+        dest = os.path.join(self.directory, 'dest')
+        self.assertEqual(self.cache.get('k', dest), {'risk_data': [1]})
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), b'result')
+        self.assertIsNone(self.cache.get('missing', os.path.join(self.directory, 'other')))
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 1})
+
+    def test_evicts_least_recently_used(self):
+        for i, key in enumerate(('a', 'b', 'c')):
+            self.cache.put(key, self.write(key))
+            os.utime(self.cache._paths(key)[0], (i, i))
+        self.cache.evict()
+        self.assertFalse(os.path.exists(self.cache._paths('a')[0]))
+        self.assertTrue(os.path.exists(self.cache._paths('c')[0]))
+
+    def test_key_changes_when_reference_data_changes(self):
+        for filename in assets.ASSET_FILES.values():
+            self.write(filename)
+        with mock.patch.object(assets, 'APP_DIR', self.directory):
+            before = cache_key('exposure', b'a', b'b')
+            self.assertEqual(cache_key('exposure', b'a', b'b'), before)
+            path = os.path.join(self.directory, assets.ASSET_FILES['tracing'])
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+            self.assertNotEqual(cache_key('exposure', b'a', b'b'), before)
+        self.assertNotEqual(cache_key('exposure', b'a', b'b'), cache_key('exposure', b'ab', b''))
+
+
+class LocalResultStorageTests(SimpleTestCase):
+    """结果存储：按哈希分片命名，临时文件提交后才出现在正式名称下"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = LocalResultStorage(directory.name)
+
+    def test_write_commit_list_delete(self):
+        name = self.storage.name_for('results', 'result_1_abc.xlsx')
+        self.assertRegex(name, r'^results/[0-9a-f]{2}/result_1_abc\.xlsx$')
+        temp_path = self.storage.temp_path(name)
+        with open(temp_path, 'wb') as f:
+            f.write(b'data')
+        self.assertFalse(self.storage.exists(name))
+        self.storage.commit(temp_path, name)
+        self.assertFalse(os.path.exists(temp_path))
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'data')
+        self.assertEqual([n for n, _ in self.storage.list('results')], [name])
+        self.storage.delete(name)
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.storage.discard(temp_path)
+
+    def test_backend_must_implement_interface(self):
+        class Incomplete(ResultStorage):
+            def path(self, name):
+                return name
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+def run_concurrently(func, count=8):
+    """多个线程同时调用 func()，返回各次的返回值"""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(i):
+        barrier.wait()
+        results[i] = func()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class SQLiteTaskStoreTests(SimpleTestCase):
+    """SQLite 任务存储的认领和更新是原子操作"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = SQLiteTaskStore(os.path.join(directory.name, 'tasks.sqlite3'))
+        self.store.put('t', {'timestamp': time.time(), 'status': 'suspended', 'user_id': 1})
+
+    def test_claim_requires_expected_status(self):
+        self.assertFalse(self.store.claim('t', 'status', 'processing', status='queued'))
+        self.assertTrue(self.store.claim('t', 'status', 'suspended', status='queued'))
+        self.assertEqual(self.store.get('t')['status'], 'queued')
+        self.assertFalse(self.store.claim('missing', 'status', 'suspended', status='queued'))
+
+    def test_claim_compares_unindexed_field(self):
+        self.store.update('t', owner='a')
+        self.assertFalse(self.store.claim('t', 'owner', 'b', owner='c'))
+        self.assertTrue(self.store.claim('t', 'owner', 'a', owner='c'))
+        self.assertTrue(self.store.claim('t', 'missing_field', None, owner='d'))
+        self.assertEqual(self.store.get('t')['owner'], 'd')
+
+    def test_concurrent_claims_have_one_winner(self):
+        results = run_concurrently(lambda: self.store.claim('t', 'status', 'suspended', status='queued'))
+        self.assertEqual(results.count(True), 1)
+
+    def test_concurrent_add_has_one_winner(self):
+        results = run_concurrently(lambda: self.store.add('new', {'timestamp': time.time()}))
+        self.assertEqual(results.count(True), 1)
+
+    def test_concurrent_updates_are_not_lost(self):
+        run_concurrently(lambda: self.store.update('t', **{f'field{threading.get_ident()}': True}))
+        record = self.store.get('t')
+        self.assertEqual(sum(key.startswith('field') for key in record), 8)
+
+    def test_tests_use_temporary_store(self):
+        self.assertFalse(settings.TASK_STORE['OPTIONS']['path'].startswith(str(settings.BASE_DIR)))
+
+
+class ManualExecutor:
+    """只记录提交的任务，由测试逐个执行"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, func, *args):
+        self.pending.append((func, args))
+
+    def run_next(self):
+        func, args = self.pending.pop(0)
+        func(*args)
+
+
+class FairShareSchedulerTests(SimpleTestCase):
+    """公平调度：用户并发上限、优先级、用户轮转、队列上限和停机"""
+
+    def setUp(self):
+        self.executor = ManualExecutor()
+        self.started = []
+
+    def scheduler(self, slots=1, per_user_limit=1, max_depth=10, max_bytes=1000):
+        return FairShareScheduler(self.executor, slots, per_user_limit, max_depth, max_bytes)
+
+    def submit(self, scheduler, task_id, user_id, priority=PRIORITY_INTERACTIVE, size=0):
+        scheduler.submit(task_id, user_id, priority, size, self.started.append, task_id)
+
+    def run_all(self):
+        while self.executor.pending:
+            self.executor.run_next()
+
+    def test_per_user_limit(self):
+        scheduler = self.scheduler(slots=2)
+        self.submit(scheduler, 'a1', 'a')
+        self.submit(scheduler, 'a2', 'a')
+        self.submit(scheduler, 'b1', 'b')
+        self.assertCountEqual(scheduler.running_tasks(), ['a1', 'b1'])
+        self.assertEqual(scheduler.queue_position('a2'), 0)
+
+    def test_users_take_turns_and_priority_comes_first(self):
+        scheduler = self.scheduler()
+        self.submit(scheduler, 'a1', 'a')
+        self.submit(scheduler, 'a2', 'a')
+        self.submit(scheduler, 'a3', 'a')
+        self.submit(scheduler, 'b1', 'b')
+        self.submit(scheduler, 'c1', 'c', priority=PRIORITY_BATCH)
+        self.run_all()
+        self.assertEqual(self.started, ['a1', 'a2', 'b1', 'a3', 'c1'])
+
+    def test_queue_full(self):
+        scheduler = self.scheduler(max_depth=1)
+        self.submit(scheduler, 'a1', 'a')
+        self.submit(scheduler, 'a2', 'a')
+        with self.assertRaises(QueueFull) as raised:
+            self.submit(scheduler, 'a3', 'a')
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(raised.exception.queue_depth, 1)
+
+    def test_held_bytes_limit(self):
+        scheduler = self.scheduler(max_bytes=100)
+        self.submit(scheduler, 'a1', 'a', size=60)
+        with self.assertRaises(QueueFull):
+            self.submit(scheduler, 'b1', 'b', size=60)
+        with self.assertRaises(JobTooLarge):
+            self.submit(scheduler, 'b2', 'b', size=101)
+        self.run_all()
+        self.submit(scheduler, 'b3', 'b', size=60)
+
+    def test_queue_full_response(self):
+        from .views import queue_full_response
+
+        response = queue_full_response(QueueFull('任务队列已满', 7, 3))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(queue_full_response(JobTooLarge('任务数据量超过上限', 0, 0)).status_code, 413)
+
+    def test_close_returns_queued_tasks(self):
+        scheduler = self.scheduler()
+        self.submit(scheduler, 'a1', 'a')
+        self.submit(scheduler, 'b1', 'b')
+        self.assertEqual(scheduler.close(), ['b1'])
+        self.run_all()
+        self.assertEqual(self.started, ['a1'])
+        self.assertTrue(scheduler.wait_idle(0))
+
+
+class ThreadPoolTestCase(SimpleTestCase):
+    """thread_pool 的任务存储、调度器和过期调度替换为测试专用的实例"""
+
+    def setUp(self):
+        from . import thread_pool
+
+        self.thread_pool = thread_pool
+        self.store = MemoryTaskStore()
+        self.executor = ManualExecutor()
+        self.scheduler = FairShareScheduler(self.executor, 1, 1, 10, 10 ** 6)
+        self.expiry = ExpiryScheduler(thread_pool.expire)
+        for name, value in (('task_store', self.store), ('scheduler', self.scheduler), ('expiry', self.expiry),
+                            ('_owned', set())):
+            patcher = mock.patch.object(thread_pool, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def put_task(self, task_id, status, **fields):
+        self.store.put(task_id, dict({'timestamp': time.time(), 'user_id': 1, 'status': status,
+                                      'type': 'exposure_analysis_task'}, **fields))
+
+
+class CancellationTests(ThreadPoolTestCase):
+    """取消排队、挂起和运行中的任务"""
+
+    def test_cancel_queued_task(self):
+        self.put_task('t', 'queued')
+        self.scheduler.submit('busy', 2, PRIORITY_INTERACTIVE, 0, lambda: None)
+        self.scheduler.submit('t', 1, PRIORITY_INTERACTIVE, 0, lambda: None)
+        self.assertTrue(self.thread_pool.cancel_task('t'))
+        self.assertEqual(self.store.get('t')['status'], 'cancelled')
+        self.assertIsNone(self.scheduler.queue_position('t'))
+
+    def test_cancel_suspended_task(self):
+        self.put_task('t', 'suspended')
+        self.assertTrue(self.thread_pool.cancel_task('t'))
+        self.assertEqual(self.store.get('t')['status'], 'cancelled')
+
+    def test_cancel_running_task_at_checkpoint(self):
+        self.put_task('t', 'processing')
+        token = CancellationToken(self.store, 't', interval=0)
+        token.check()
+        self.assertFalse(self.thread_pool.cancel_task('t'))
+        self.assertEqual(self.store.get('t')['status'], 'processing')
+        with self.assertRaises(TaskCancelled):
+            token.check()
+
+    def test_missing_record_is_not_cancelled(self):
+        token = CancellationToken(self.store, 'missing', interval=0)
+        self.assertFalse(token.cancelled())
+
+
+class ProgressReporterTests(SimpleTestCase):
+    """进度上报：同一阶段内按间隔写入，切换阶段和阶段完成时立即写入"""
+
+    def setUp(self):
+        self.store = MemoryTaskStore()
+        self.store.put('t', {'timestamp': time.time(), 'status': 'processing'})
+
+    def test_throttles_within_stage(self):
+        progress = ProgressReporter(self.store, 't', interval=60)
+        progress('读取输入文件', 0, 2)
+        self.assertEqual(self.store.get('t')['progress'], {'stage': '读取输入文件', 'done': 0, 'total': 2})
+        progress('读取输入文件', 1, 2)
+        self.assertEqual(self.store.get('t')['progress']['done'], 0)
+        progress('读取输入文件', 2, 2)
+        self.assertEqual(self.store.get('t')['progress']['done'], 2)
+        self.assertIn('updated_at', self.store.get('t'))
+
+    def test_stage_times_merge_across_reporters(self):
+        # 不同进程中的上报器副本各自计时，开始新阶段时合并记录中已有的耗时
+        ProgressReporter(self.store, 't')('读取输入文件', 2, 2)
+        ProgressReporter(self.store, 't')('浓度预测', 0, 2)
+        self.assertEqual(set(self.store.get('t')['stage_times']), {'读取输入文件', '浓度预测'})
+
+    def test_without_reporter(self):
+        report_progress(None, '浓度预测', 0, 2)
+
+
+class ViewTestCase(ThreadPoolTestCase):
+    """直接调用视图函数，请求的用户由测试指定，不经过数据库和会话"""
+
+    def setUp(self):
+        super().setUp()
+        from . import views
+
+        self.views = views
+        for name, value in (('task_store', self.store), ('scheduler', self.scheduler)):
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def request(self, method, path='/', user_id=1, **kwargs):
+        request = getattr(self.factory, method)(path, **kwargs)
+        user = mock.Mock(id=user_id, username=f'user{user_id}', is_authenticated=True)
+
+        async def auser():
+            return user
+
+        request.user = user
+        request.auser = auser
+        return request
+
+
+class TaskEventsTests(ViewTestCase):
+    """状态推送：状态或进度变化时推送事件，任务结束后关闭连接"""
+
+    @override_settings(TASK_EVENTS_INTERVAL=0)
+    async def test_pushes_changes_until_finished(self):
+        self.put_task('t', 'processing', progress={'stage': '浓度预测', 'done': 1, 'total': 2})
+        response = await self.views.task_events(self.request('get'), 't')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = []
+        async for chunk in response.streaming_content:
+            event, data = chunk.decode().strip().split('\n')
+            self.assertEqual(event, 'event: status')
+            events.append(json.loads(data[len('data: '):]))
+            self.store.update('t', status='completed', progress=None)
+        self.assertEqual([payload['status'] for payload in events], ['processing', 'success'])
+        self.assertEqual(events[0]['progress'], {'stage': '浓度预测', 'done': 1, 'total': 2})
+
+    async def test_other_users_task(self):
+        self.put_task('t', 'processing')
+        response = await self.views.task_events(self.request('get', user_id=2), 't')
+        self.assertEqual(json.loads(response.content)['message'], '您无权访问此任务')
+
+
+class BatchTaskStatusTests(ViewTestCase):
+    """批量查询任务状态：一次返回多个任务，各任务分别校验归属"""
+
+    def setUp(self):
+        super().setUp()
+        self.put_task('done', 'completed', result_id='r')
+        self.put_task('queued', 'queued')
+        self.put_task('other', 'processing', user_id=2)
+        self.store.put('request', {'timestamp': time.time(), 'user_id': 1, 'type': self.thread_pool.REQUEST_TYPE})
+
+    async def test_get_with_comma_separated_ids(self):
+        request = self.request('get', data={'task_ids': ['done,queued', 'other,request,missing']})
+        tasks = json.loads((await self.views.check_tasks_status(request)).content)['tasks']
+        self.assertEqual(tasks['done']['status'], 'success')
+        self.assertEqual(tasks['done']['result_id'], 'r')
+        self.assertEqual(tasks['queued']['state'], 'queued')
+        self.assertEqual(tasks['other']['message'], '您无权访问此任务')
+        self.assertEqual(tasks['request']['message'], '任务不存在或已过期')
+        self.assertEqual(tasks['missing']['message'], '任务不存在或已过期')
+
+    async def test_post_json(self):
+        request = self.request('post', data={'task_ids': ['done']}, content_type='application/json')
+        payload = json.loads((await self.views.check_tasks_status(request)).content)
+        self.assertEqual(list(payload['tasks']), ['done'])
+
+    @override_settings(TASK_STATUS_BATCH_LIMIT=2)
+    async def test_invalid_requests(self):
+        for request in (self.request('get'),
+                        self.request('get', data={'task_ids': 'a,b,c'}),
+                        self.request('post', data='not json', content_type='application/json')):
+            self.assertEqual((await self.views.check_tasks_status(request)).status_code, 400)
+
+
+class AsyncViewTests(ViewTestCase):
+    """状态、取消和下载接口为原生异步视图，阻塞调用在线程中执行"""
+
+    def test_views_are_async(self):
+        for view in (self.views.check_task_status, self.views.cancel_task, self.views.download_result,
+                     self.views.process_files):
+            self.assertTrue(iscoroutinefunction(view), view.__name__)
+
+    async def test_check_and_cancel(self):
+        self.put_task('t', 'queued')
+        self.scheduler.submit('busy', 2, PRIORITY_INTERACTIVE, 0, lambda: None)
+        self.scheduler.submit('t', 1, PRIORITY_INTERACTIVE, 0, lambda: None)
+        payload = json.loads((await self.views.check_task_status(self.request('get'), 't')).content)
+        self.assertEqual((payload['state'], payload['queue_position']), ('queued', 0))
+        denied = await self.views.cancel_task(self.request('post', user_id=2), 't')
+        self.assertEqual(json.loads(denied.content)['message'], '您无权访问此任务')
+        response = await self.views.cancel_task(self.request('post'), 't')
+        self.assertEqual(json.loads(response.content)['status'], 'cancelled')
+
+    async def test_download_streams_result_file(self):
+        storage = self.views.storage
+        name = self.thread_pool.result_name('exposure', 1, 'r')
+        temp_path = storage.temp_path(name)
+        with open(temp_path, 'wb') as f:
+            f.write(b'result' * 10000)
+        storage.commit(temp_path, name)
+        self.addCleanup(storage.delete, name)
+        self.store.put('r', {'timestamp': time.time(), 'user_id': 1, 'status': 'completed', 'path': name})
+        response = await self.views.download_result(self.request('get'), 'r')
+        self.assertEqual(response['Content-Length'], str(60000))
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'result' * 10000)
+        denied = await self.views.download_result(self.request('get', user_id=2), 'r')
+        self.assertEqual(json.loads(denied.content)['message'], '您无权访问此文件')
+
+
+class ExpiryTests(ThreadPoolTestCase):
+    """保留期过后只删除已结束的记录；尚未结束的任务在心跳超时后由其他进程接管"""
+
+    def expired_task(self, task_id, status, **fields):
+        self.put_task(task_id, status, timestamp=time.time() - settings.TASK_RESULT_TTL - 1, **fields)
+
+    def test_terminal_records_expire(self):
+        for status in ('completed', 'failed', 'cancelled'):
+            self.expired_task(status, status)
+            self.thread_pool.expire(('record', status))
+            self.assertIsNone(self.store.get(status), status)
+
+    def test_in_flight_records_with_heartbeat_are_kept(self):
+        for status in ('queued', 'processing', 'suspended'):
+            self.expired_task(status, status, updated_at=time.time())
+            self.thread_pool.expire(('record', status))
+            self.assertEqual(self.store.get(status)['status'], status)
+        self.assertEqual(len(self.expiry), 3)
+
+    def test_retention_starts_when_task_finishes(self):
+        self.expired_task('t', 'processing')
+        self.thread_pool.finish_task('t', 'completed')
+        self.thread_pool.expire(('record', 't'))
+        self.assertEqual(self.store.get('t')['status'], 'completed')
+
+    def test_stale_task_without_resume_fails(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            pass
+        self.addCleanup(self.thread_pool.remove_inputs, [f.name])
+        self.expired_task('t', 'processing', owner='dead:1:x', inputs=[f.name])
+        self.thread_pool.expire(('record', 't'))
+        record = self.store.get('t')
+        self.assertEqual(record['status'], 'failed')
+        self.assertIn('异常退出', record['error'])
+        self.assertFalse(os.path.exists(f.name))
+
+    def test_stale_task_with_resume_is_requeued(self):
+        self.expired_task('t', 'processing', owner='dead:1:x', resume={'stage': 'effects', 'endpoint': 'e'})
+        with mock.patch.object(self.thread_pool, 'resume_task', return_value=True) as resume_task:
+            self.thread_pool.expire(('record', 't'))
+        resume_task.assert_called_once()
+        record = self.store.get('t')
+        self.assertEqual(record['status'], 'queued')
+        self.assertEqual(record['owner'], self.thread_pool.INSTANCE_ID)
+
+    def test_stale_cancel_request_is_cancelled(self):
+        self.expired_task('t', 'processing', owner='dead:1:x', cancel_requested=True,
+                          resume={'stage': 'effects', 'endpoint': 'e'})
+        self.thread_pool.expire(('record', 't'))
+        self.assertEqual(self.store.get('t')['status'], 'cancelled')
+
+    def test_heartbeat_keeps_owned_task_alive(self):
+        self.thread_pool.put_record('t', {'timestamp': time.time() - 1000, 'user_id': 1, 'status': 'queued'})
+        self.thread_pool.heartbeat()
+        self.thread_pool.expire(('record', 't'))
+        self.assertEqual(self.store.get('t')['status'], 'queued')
+        # 其他进程接管后不再刷新
+        self.store.update('t', owner='other')
+        self.thread_pool.heartbeat()
+        self.assertNotIn('t', self.thread_pool._owned)
+
+    def test_stale_placeholder_fails(self):
+        task_id, _ = self.thread_pool.claim_request(1, 'exposure', 'key')
+        self.thread_pool._owned.clear()
+        self.store.update(task_id, updated_at=time.time() - settings.TASK_HEARTBEAT_TIMEOUT - 1)
+        self.thread_pool.expire(('record', task_id))
+        self.assertEqual(self.store.get(task_id)['status'], 'failed')
+        # 请求ID不再返回已中断的任务
+        self.assertNotEqual(self.thread_pool.claim_request(1, 'exposure', 'key')[0], task_id)
+
+
+class SuspendResumeTests(ThreadPoolTestCase):
+    """停机挂起排队任务，启动时只认领状态为 suspended 的任务，并接管已退出进程遗留的任务"""
+
+    def test_shutdown_suspends_tasks(self):
+        self.put_task('running', 'processing')
+        self.put_task('queued', 'queued')
+        self.scheduler.submit('running', 1, PRIORITY_INTERACTIVE, 0, lambda: None)
+        self.scheduler.submit('queued', 2, PRIORITY_INTERACTIVE, 0, lambda: None)
+        with mock.patch.multiple(self.thread_pool, _shutdown_done=False, SUSPEND_GRACE=0):
+            self.thread_pool.shutdown(timeout=0)
+        self.assertEqual(self.store.get('queued')['status'], 'suspended')
+        # 运行中的任务在下一个检查点挂起
+        self.assertTrue(self.store.get('running')['suspend_requested'])
+        self.assertTrue(self.thread_pool.stop_cancelled('running'))
+        self.assertEqual(self.store.get('running')['status'], 'suspended')
+
+    def test_resume_claims_only_suspended_tasks(self):
+        self.put_task('suspended', 'suspended')
+        self.put_task('draining', 'processing', suspend_requested=True)
+        with mock.patch.object(self.thread_pool, 'resume_task', return_value=True) as resume_task:
+            run_concurrently(self.thread_pool.resume_suspended, count=4)
+        self.assertEqual([call.args[0] for call in resume_task.call_args_list], ['suspended'])
+        self.assertEqual(self.store.get('suspended')['status'], 'queued')
+        self.assertEqual(self.store.get('draining')['status'], 'processing')
+
+    def dead_owner(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return f'{socket.gethostname()}:{process.pid}:x'
+
+    def test_owner_exited(self):
+        self.assertTrue(self.thread_pool.owner_exited(self.dead_owner()))
+        self.assertFalse(self.thread_pool.owner_exited(self.thread_pool.INSTANCE_ID))
+        self.assertFalse(self.thread_pool.owner_exited(f'{socket.gethostname()}:{os.getppid()}:x'))
+        self.assertFalse(self.thread_pool.owner_exited('other-host:1:x'))
+        self.assertFalse(self.thread_pool.owner_exited(None))
+
+    def test_startup_takes_over_tasks_of_exited_process(self):
+        owner = self.dead_owner()
+        self.put_task('resumable', 'processing', owner=owner, updated_at=time.time(),
+                      resume={'stage': 'effects', 'endpoint': 'e'})
+        self.put_task('placeholder', 'queued', owner=owner, updated_at=time.time())
+        self.put_task('alive', 'processing', owner='other-host:1:x', updated_at=time.time())
+        with mock.patch.object(self.thread_pool, 'resume_task', return_value=True) as resume_task:
+            self.thread_pool.reconcile_results()
+        self.assertEqual([call.args[0] for call in resume_task.call_args_list], ['resumable'])
+        self.assertEqual(self.store.get('resumable')['status'], 'queued')
+        self.assertEqual(self.store.get('placeholder')['status'], 'failed')
+        self.assertEqual(self.store.get('alive')['status'], 'processing')
+
+
+class ResultArchiveTests(SimpleTestCase):
+    """结果归档与恢复"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.archive = ResultArchive(os.path.join(self.directory, 'archive'), 10 ** 8)
+
+    def test_round_trip(self):
+        df = pd.DataFrame({
+            'name': ['a', None, 'c'],
+            'value': [1.5, np.nan, 3.0],
+            'count': [1, 2, 3],
+            'mixed': ['x', 2, None],
+        })
+        source = os.path.join(self.directory, 'source.xlsx')
+        restored = os.path.join(self.directory, 'restored.xlsx')
+        df.to_excel(source, index=False)
+        # 归档转换在进程池中执行，归档实例随方法一起传入 worker
+        archive = pickle.loads(pickle.dumps(self.archive))
+        self.assertTrue(archive.store('result', source))
+        self.assertTrue(self.archive.restore('result', restored))
+        pd.testing.assert_frame_equal(pd.read_excel(restored), pd.read_excel(source))
+
+    def test_missing_or_corrupt_archive(self):
+        restored = os.path.join(self.directory, 'restored.xlsx')
+        self.assertFalse(self.archive.restore('missing', restored))
+        path = self.archive._path('corrupt')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'not an archive')
+        self.assertFalse(self.archive.restore('corrupt', restored))
+
+
+class ArchiveExpiryTests(ThreadPoolTestCase):
+    """热存储保留期过后，过期调度线程只提交归档转换，转换在进程池中进行"""
+
+    def setUp(self):
+        super().setUp()
+        storage = self.thread_pool.storage
+        self.name = self.thread_pool.result_name('exposure', 1, 'r')
+        temp_path = storage.temp_path(self.name)
+        pd.DataFrame({'a': [1, 2]}).to_excel(temp_path, index=False)
+        storage.commit(temp_path, self.name)
+        self.addCleanup(storage.delete, self.name)
+        self.put_task('r', 'completed', type='exposure_analysis', path=self.name,
+                      timestamp=time.time() - settings.TASK_RESULT_TTL - 1)
+        self.future = Future()
+        self.pool = mock.Mock()
+        self.pool.submit.return_value = self.future
+        for patcher in (mock.patch.object(self.thread_pool, 'get_process_executor', return_value=self.pool),
+                        mock.patch.object(self.thread_pool, '_archiving', set())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_conversion_is_submitted_to_process_pool(self):
+        self.thread_pool.expire(('record', 'r'))
+        self.pool.submit.assert_called_once_with(self.thread_pool.archive.store, 'r',
+                                                 self.thread_pool.storage.path(self.name))
+        self.assertNotIn('archived_at', self.store.get('r'))
+        # 转换完成前再次到期不会重复提交
+        self.thread_pool.expire(('record', 'r'))
+        self.assertEqual(self.pool.submit.call_count, 1)
+        self.future.set_result(True)
+        self.assertTrue(self.store.get('r')['archived_at'])
+        self.assertFalse(self.thread_pool.storage.exists(self.name))
+
+    def test_failed_conversion_removes_result(self):
+        self.thread_pool.expire(('record', 'r'))
+        self.future.set_result(False)
+        self.assertIsNone(self.store.get('r'))
+        self.assertFalse(self.thread_pool.storage.exists(self.name))
+
+    def test_cancelled_conversion_is_retried(self):
+        self.thread_pool.expire(('record', 'r'))
+        self.future.cancel()
+        self.assertIsNotNone(self.store.get('r'))
+        self.assertTrue(self.thread_pool.storage.exists(self.name))
+        self.assertEqual(len(self.expiry), 1)
+
+
+class IdempotentSubmissionTests(ThreadPoolTestCase):
+    """幂等提交：重复提交返回同一任务，任务失败或取消后按新提交处理"""
+
+    def test_repeated_claim_returns_same_task(self):
+        task_id, created = self.thread_pool.claim_request(1, 'exposure', 'key')
+        self.assertTrue(created)
+        self.assertEqual(self.thread_pool.claim_request(1, 'exposure', 'key'), (task_id, False))
+        self.assertNotEqual(self.thread_pool.claim_request(2, 'exposure', 'key')[0], task_id)
+
+    def test_concurrent_first_claims_share_one_task(self):
+        results = run_concurrently(lambda: self.thread_pool.claim_request(1, 'exposure', 'key'))
+        self.assertEqual(len({task_id for task_id, _ in results}), 1)
+        self.assertEqual([created for _, created in results].count(True), 1)
+
+    def test_reclaim_after_failure(self):
+        old_id, _ = self.thread_pool.claim_request(1, 'exposure', 'key')
+        self.thread_pool.finish_task(old_id, 'failed')
+        results = run_concurrently(lambda: self.thread_pool.claim_request(1, 'exposure', 'key'))
+        new_ids = {task_id for task_id, _ in results}
+        self.assertEqual(len(new_ids), 1)
+        self.assertNotIn(old_id, new_ids)
+        self.assertEqual([created for _, created in results].count(True), 1)
+
+    def test_new_exposure_result_changes_effects_request(self):
+        first, _ = self.thread_pool.claim_request(1, 'effects', 'key')
+        self.store.set_latest(1, 'exposure', 'result', 'path')
+        second, created = self.thread_pool.claim_request(1, 'effects', 'key')
+        self.assertTrue(created)
+        self.assertNotEqual(first, second)
+
+    def test_request_record_is_not_a_task(self):
+        from . import views
+
+        self.thread_pool.claim_request(1, 'exposure', 'key')
+        record_id = self.thread_pool.request_record_id(1, 'exposure', 'key')
+        self.assertNotIn('status', self.store.get(record_id))
+        with mock.patch.object(views, 'task_store', self.store):
+            self.assertEqual(views.get_user_task(record_id, 1), (None, '任务不存在或已过期'))
+
+
+class ServerProcessTests(SimpleTestCase):
+    """启动预热只在 Web 服务进程中执行，计算进程池的 worker 除外"""
+
+    def setUp(self):
+        from . import warmup
+
+        self.warmup = warmup
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(warmup.PROCESS_WORKER_ENV, None)
+        os.environ.pop('RUN_MAIN', None)
+
+    @override_settings(SERVER_PROCESS='auto')
+    def test_detects_servers_from_argv(self):
+        for argv in (['/usr/bin/gunicorn', 'app.wsgi'], ['/venv/bin/uvicorn', 'app.asgi:application'],
+                     ['/venv/lib/uvicorn/__main__.py'], ['manage.py', 'runserver', '--noreload']):
+            self.assertTrue(self.warmup.is_server_process(argv), argv)
+        for argv in (['manage.py', 'test'], ['manage.py', 'runserver'], ['script.py'], []):
+            self.assertFalse(self.warmup.is_server_process(argv), argv)
+
+    @override_settings(SERVER_PROCESS='auto')
+    def test_server_worker_processes_are_servers(self):
+        # uvicorn --workers、hypercorn 的 worker 是 multiprocessing 子进程，同样提供服务
+        with mock.patch('multiprocessing.parent_process', return_value=object()):
+            self.assertTrue(self.warmup.is_server_process(['/venv/bin/uvicorn', '--workers', '4']))
+
+    @override_settings(SERVER_PROCESS='auto')
+    def test_process_pool_workers_are_not_servers(self):
+        self.warmup.mark_process_worker()
+        self.assertFalse(self.warmup.is_server_process(['/usr/bin/gunicorn', 'app.wsgi']))
+
+    def test_setting_overrides_detection(self):
+        with self.settings(SERVER_PROCESS='1'):
+            self.assertTrue(self.warmup.is_server_process(['manage.py', 'test']))
+        with self.settings(SERVER_PROCESS='0'):
+            self.assertFalse(self.warmup.is_server_process(['/usr/bin/gunicorn']))
+
+    def test_readiness_waits_for_warmup(self):
+        from .views import readiness
+
+        with mock.patch.dict(self.warmup._state, status='warming'):
+            self.assertEqual(readiness(None).status_code, 503)
+        with mock.patch.dict(self.warmup._state, status='ready'):
+            self.assertEqual(readiness(None).status_code, 200)
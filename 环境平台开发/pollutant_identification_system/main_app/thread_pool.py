@@ -1,10 +1,25 @@
 import os
 import uuid
+import socket
+import hashlib
 import time
+import atexit
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError, as_completed
+from concurrent.futures.process import BrokenProcessPool
 import logging
-import uuid
+from django.conf import settings
+from .task_store import get_task_store
+from .scheduler import FairShareScheduler, JobTooLarge, QueueFull, PRIORITY_INTERACTIVE
+from .cancellation import CancellationToken, TaskCancelled, TaskSuspended
+from .progress import ProgressReporter
+from .expiry import ExpiryScheduler
+from .result_cache import get_result_cache, cache_key
+from . import descriptor_cache
+from .storage import get_result_storage, AREAS
+from .archive import get_result_archive
+from .uploads import SpooledUpload
 
 # 配置极简日志 - 只记录用户访问
 logging.basicConfig(
@@ -17,333 +32,1007 @@ logging.basicConfig(
 )
 logger = logging.getLogger('access')
 
-# 结果文件存储路径
-RESULTS_DIR = r"D:\环境平台开发\pollutant_identification_system\media\results"
-EFFECT_RESULTS_DIR = r"D:\环境平台开发\pollutant_identification_system\media\effect_results"
-TRACING_RESULTS_DIR = r"D:\环境平台开发\pollutant_identification_system\media\tracing_results"
-if not os.path.exists(TRACING_RESULTS_DIR):
-    os.makedirs(TRACING_RESULTS_DIR)
+# 结果文件存储（默认为 MEDIA_ROOT 下按哈希分片的本地目录，可在 settings.RESULT_STORAGE 中替换）
+storage = get_result_storage()
+
+# 结果归档：热存储保留期过后，结果转为压缩列式归档，下载时再恢复
+archive = get_result_archive()
+
+# 上传文件暂存目录，任务完成或取消后删除
+UPLOAD_SPOOL_DIR = settings.UPLOAD_SPOOL_DIR
+os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+
+# 全局线程池：负责任务编排、读写存储等 I/O 为主的工作
+executor = ThreadPoolExecutor(max_workers=settings.THREAD_POOL_WORKERS)
+
+# 公平调度器：限制每个用户的并发任务数，按优先级和用户轮转派发到线程池
+scheduler = FairShareScheduler(
+    executor,
+    slots=settings.THREAD_POOL_WORKERS,
+    per_user_limit=settings.TASK_MAX_PER_USER,
+    max_depth=settings.TASK_QUEUE_MAX_DEPTH,
+    max_bytes=settings.TASK_QUEUE_MAX_BYTES
+)
 
-if not os.path.exists(RESULTS_DIR):
-    os.makedirs(RESULTS_DIR)
+# 进程池：运行 Excel 解析、模型推理等受 GIL 限制的计算阶段（首次使用时创建）
+_process_executor = None
+_process_executor_lock = threading.Lock()
 
-if not os.path.exists(EFFECT_RESULTS_DIR):
-    os.makedirs(EFFECT_RESULTS_DIR)
+def _init_process_worker():
+    """进程池 worker 初始化：标记为计算进程（不会被识别为 Web 服务进程），预先导入计算模块，加载参考数据和模型"""
+    from . import warmup
+    warmup.mark_process_worker()
+    from . import assets, calculate, calculate_effects, calculate_tracing
+    from .model_registry import get_model_registry
+    assets.preload()
+    get_model_registry().preload()
 
-# 全局线程池
-executor = ThreadPoolExecutor(max_workers=10)
+def get_process_executor():
+    """返回计算进程池，按 settings.PROCESS_POOL_WORKERS 创建"""
+    global _process_executor
+    if _process_executor is None:
+        with _process_executor_lock:
+            if _process_executor is None:
+                # 使用 spawn 启动，避免在已有后台线程的进程中 fork
+                _process_executor = ProcessPoolExecutor(
+                    max_workers=settings.PROCESS_POOL_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_process_worker
+                )
+    return _process_executor
 
-# 任务结果存储
-TASK_RESULTS = {}
+def _discard_process_executor():
+    """worker 异常退出后进程池不可再用，丢弃后下次重新创建"""
+    global _process_executor
+    with _process_executor_lock:
+        _process_executor = None
+
+def _submit_to_process(executor, func, *args, **kwargs):
+    """提交到进程池；解释器退出时进程池已关闭，正在执行的任务改为挂起，下次启动时恢复"""
+    try:
+        return executor.submit(func, *args, **kwargs)
+    except BrokenProcessPool:
+        raise
+    except RuntimeError as e:
+        raise TaskSuspended('服务正在停机') from e
+
+def run_in_process(func, *args, **kwargs):
+    """在进程池中执行计算函数并等待结果（调用方为线程池中的任务）"""
+    try:
+        return _submit_to_process(get_process_executor(), func, *args, **kwargs).result()
+    except BrokenProcessPool:
+        _discard_process_executor()
+        raise
+
+def imap_in_process(func, items):
+    """把各部分分发到进程池并行执行，按完成顺序逐个返回结果；提前结束时取消尚未开始的部分"""
+    executor = get_process_executor()
+    futures = []
+    try:
+        for item in items:
+            futures.append(_submit_to_process(executor, func, item))
+        for future in as_completed(futures):
+            yield future.result()
+    except BrokenProcessPool:
+        _discard_process_executor()
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+# 任务结果存储（默认 SQLite，可在 settings.TASK_STORE 中替换）
+task_store = get_task_store()
 
 # 清理过期结果的线程
-def cleanup_results():
-    """定期清理过期的结果文件"""
+def expire(key):
+    """过期调度回调：删除到期的任务记录及其结果文件，或启动时发现的未跟踪文件"""
+    kind, value = key
+    if kind == 'file':
+        storage.delete(value)
+        return
+    if kind == 'upload':
+        remove_inputs([value])
+        return
+    
+    data = task_store.get(value)
+    if data is None:
+        return
+    expires_at = record_deadline(data)
+    if expires_at > time.time():
+        # 记录在登记后被更新过，按新的时间重新登记
+        expiry.register(key, expires_at)
+        return
+    if is_active(data):
+        # 排队、运行中和挂起的任务不过期；心跳超时说明所属进程已退出，由这里接管
+        recover_stale(value, data)
+        return
+    
+    if is_result(data):
+        if not data.get('archived_at'):
+            # 热存储保留期已过，转入归档
+            if archive_result(value, data):
+                return
+        elif data.get('hot_until'):
+            # 下载时恢复的热副本到期，只删除热副本
+            storage.delete(data['path'])
+            task_store.update(value, hot_until=0)
+            data['hot_until'] = 0
+            if record_deadline(data) > time.time():
+                expiry.register(key, record_deadline(data))
+                return
+        archive.delete(value)
+    remove_record(value, data)
+
+def remove_record(record_id, data):
+    """删除记录及其结果文件和暂存的输入文件"""
+    if data.get('path'):
+        storage.delete(data['path'])
+    remove_inputs(data.get('inputs'))
+    task_store.delete(record_id)
+    task_store.clear_latest(record_id)
+
+expiry = ExpiryScheduler(expire, name='result-expiry')
+
+# 尚未结束的任务状态，处于这些状态的任务记录不会过期
+ACTIVE_STATUSES = ('queued', 'processing', 'suspended')
+
+def is_active(data):
+    """是否为尚未结束的任务记录（排队、运行中或挂起）"""
+    return data.get('status') in ACTIVE_STATUSES
+
+# 本进程的标识，写入排队和运行中任务记录的 owner 字段
+INSTANCE_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+# 任务心跳：本进程排队和运行中的任务按间隔刷新 updated_at，
+# 超过 TASK_HEARTBEAT_TIMEOUT 未刷新的任务视为所属进程已异常退出（SIGKILL、OOM 等）
+HEARTBEAT_INTERVAL = max(1, settings.TASK_HEARTBEAT_TIMEOUT // 4)
+_owned = set()
+_heartbeat_thread = None
+_heartbeat_lock = threading.Lock()
+
+def own_task(task_id):
+    """登记本进程负责的任务，由心跳线程定期刷新"""
+    global _heartbeat_thread
+    _owned.add(task_id)
+    if _heartbeat_thread is None:
+        with _heartbeat_lock:
+            if _heartbeat_thread is None:
+                _heartbeat_thread = threading.Thread(target=_heartbeat_loop, name='task-heartbeat', daemon=True)
+                _heartbeat_thread.start()
+
+def heartbeat():
+    """刷新本进程排队和运行中任务的 updated_at，已结束、已挂起或被其他进程接管的任务不再刷新"""
+    now = time.time()
+    for task_id in list(_owned):
+        data = task_store.get(task_id)
+        if (data is None or data.get('status') not in ('queued', 'processing')
+                or not task_store.claim(task_id, 'owner', INSTANCE_ID, updated_at=now)):
+            _owned.discard(task_id)
+
+def _heartbeat_loop():
     while True:
+        time.sleep(HEARTBEAT_INTERVAL)
         try:
-            current_time = time.time()
-            ids_to_remove = []
-            
-            for result_id, data in list(TASK_RESULTS.items()):
-                # 删除超过15分钟的结果
-                if current_time - data['timestamp'] > 15 * 60:
-                    try:
-                        if 'path' in data and os.path.exists(data['path']):
-                            os.remove(data['path'])
-                        ids_to_remove.append(result_id)
-                    except Exception:
-                        pass
-            
-            
-            for result_id in ids_to_remove:
-                del TASK_RESULTS[result_id]
+            heartbeat()
+        except Exception as e:
+            logger.error(f"刷新任务心跳失败: {str(e)}")
 
-            
-            # 额外清理可能未跟踪的effect_results目录中的文件
-            for directory in [RESULTS_DIR, EFFECT_RESULTS_DIR, TRACING_RESULTS_DIR]:
-                for filename in os.listdir(directory):
-                    file_path = os.path.join(directory, filename)
-                    file_modified_time = os.path.getmtime(file_path)
-                    if current_time - file_modified_time > 15 * 60:
-                        try:
-                            os.remove(file_path)
-                        except Exception:
-                            pass
-        
-        except Exception:
+def recover_stale(task_id, data):
+    """接管所属进程已退出（心跳超时）的任务：带有恢复参数的任务挂起后重新排队，其余任务标记失败并删除暂存的输入文件
+
+    对 updated_at 比较并替换（任务状态变化时都会刷新 updated_at），多个进程同时发现时只有一个处理，
+    所属进程实际仍在运行时也不会覆盖它写入的新状态。
+    """
+    if data['status'] != 'suspended' and task_id in _owned and data.get('owner') == INSTANCE_ID:
+        # 本进程仍在处理，心跳稍有延迟
+        expiry.register(('record', task_id), time.time() + settings.TASK_HEARTBEAT_TIMEOUT)
+        return
+    now = time.time()
+    if data['status'] != 'suspended':
+        cancelled = data.get('cancel_requested') and not data.get('suspend_requested')
+        if data.get('resume') and not cancelled:
+            if not task_store.claim(task_id, 'updated_at', data.get('updated_at'), status='suspended',
+                                    updated_at=now, owner=None):
+                return
+        else:
+            fields = {'status': 'cancelled'} if cancelled else {
+                'status': 'failed', 'error': '服务进程异常退出，任务已中断，请重新提交'}
+            if task_store.claim(task_id, 'updated_at', data.get('updated_at'), finished_at=now,
+                                updated_at=now, owner=None, **fields):
+                logger.warning(f"任务 {task_id} 所属进程 {data.get('owner')} 已无响应，任务已中断")
+                expiry.register(('record', task_id), now + settings.TASK_RESULT_TTL)
+                remove_inputs(data.get('inputs'))
+            return
+        logger.warning(f"任务 {task_id} 所属进程 {data.get('owner')} 已无响应，任务已挂起")
+    # 挂起的任务（包括恢复时队列已满的任务）重新排队
+    resume_claimed(task_id, data)
+
+def finish_task(task_id, status, **fields):
+    """任务进入终态，保留期从结束时开始计算"""
+    now = time.time()
+    task_store.update(task_id, status=status, finished_at=now, updated_at=now, **fields)
+    _owned.discard(task_id)
+    expiry.register(('record', task_id), now + settings.TASK_RESULT_TTL)
+
+def is_result(data):
+    """是否为已完成的结果记录（而不是任务记录）"""
+    return data.get('type') in RESULT_TYPES and bool(data.get('path'))
+
+def record_deadline(data):
+    """记录的下一个到期时间：热存储保留期，已归档的结果为热副本或归档的保留期，
+    尚未结束的任务为心跳超时的时间"""
+    if is_active(data):
+        return (data.get('updated_at') or data['timestamp']) + settings.TASK_HEARTBEAT_TIMEOUT
+    if data.get('archived_at'):
+        return data.get('hot_until') or data['archived_at'] + settings.RESULT_ARCHIVE['TTL']
+    return (data.get('finished_at') or data['timestamp']) + settings.TASK_RESULT_TTL
+
+# 停机或进程池异常导致归档转换未完成时，间隔一段时间后重试（秒）
+ARCHIVE_RETRY_DELAY = 60
+
+# 正在进程池中转换归档的结果ID
+_archiving = set()
+
+def archive_result(result_id, data):
+    """把结果文件转入归档：读取工作簿和压缩写入在进程池中进行，过期调度线程只提交转换，
+    完成后由回调更新记录并删除热存储中的文件。结果文件不存在时返回 False（结果按原逻辑删除）"""
+    if result_id in _archiving:
+        return True
+    if not storage.exists(data['path']):
+        return False
+    try:
+        future = _submit_to_process(get_process_executor(), archive.store, result_id, storage.path(data['path']))
+    except (TaskSuspended, BrokenProcessPool) as e:
+        if isinstance(e, BrokenProcessPool):
+            _discard_process_executor()
+        expiry.register(('record', result_id), time.time() + ARCHIVE_RETRY_DELAY)
+        return True
+    _archiving.add(result_id)
+    future.add_done_callback(lambda f: _archived(result_id, data, f))
+    return True
+
+def _archived(result_id, data, future):
+    """归档转换完成的回调（在进程池的管理线程中执行，只做记录和文件的更新）"""
+    _archiving.discard(result_id)
+    try:
+        stored = future.result()
+    except (CancelledError, BrokenProcessPool) as e:
+        # 停机或 worker 异常退出，稍后重试
+        if isinstance(e, BrokenProcessPool):
+            _discard_process_executor()
+        expiry.register(('record', result_id), time.time() + ARCHIVE_RETRY_DELAY)
+        return
+    except Exception:
+        stored = False
+    try:
+        if not stored:
+            # 无法转换的结果按原逻辑删除
+            archive.delete(result_id)
+            remove_record(result_id, data)
+            return
+        now = time.time()
+        task_store.update(result_id, archived_at=now, hot_until=0)
+        storage.delete(data['path'])
+        expiry.register(('record', result_id), now + settings.RESULT_ARCHIVE['TTL'])
+    except Exception as e:
+        logger.error(f"结果 {result_id} 归档后更新记录失败: {str(e)}")
+
+def ensure_result_file(result_id, data):
+    """确认结果文件在热存储中，已归档的结果先恢复；文件不可用时返回 False"""
+    name = data.get('path')
+    if not name:
+        return False
+    if storage.exists(name):
+        return True
+    if not data.get('archived_at'):
+        return False
+    
+    temp_path = storage.temp_path(name)
+    try:
+        if not archive.restore(result_id, temp_path):
+            return False
+        storage.commit(temp_path, name)
+    finally:
+        storage.discard(temp_path)
+    
+    # 恢复的热副本保留一个热存储保留期
+    hot_until = time.time() + settings.TASK_RESULT_TTL
+    task_store.update(result_id, hot_until=hot_until)
+    expiry.register(('record', result_id), hot_until)
+    logger.info(f"结果 {result_id} 已从归档恢复")
+    return True
+
+def remove_inputs(paths):
+    """删除任务的暂存上传文件"""
+    for path in paths or ():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
             pass
-        
-        # 每5分钟运行一次
-        time.sleep(300)
 
-# 启动清理线程
-cleanup_thread = threading.Thread(target=cleanup_results, daemon=True)
-cleanup_thread.start()
+def put_record(record_id, record):
+    """写入任务/结果记录，并按保留时间登记过期；尚未结束的任务记录归本进程所有，由心跳线程刷新"""
+    if is_active(record):
+        record = dict(record, owner=INSTANCE_ID, updated_at=record['timestamp'])
+        own_task(record_id)
+    task_store.put(record_id, record)
+    expiry.register(('record', record_id), record_deadline(record))
+
+def owner_exited(owner):
+    """任务所属的进程是否确定已经退出：只能判断同一主机上的进程，其他主机上的进程按心跳超时判断"""
+    if os.name == 'nt':
+        # Windows 上 os.kill(pid, 0) 会向进程发送 CTRL_C_EVENT，只按心跳超时判断
+        return False
+    host, _, rest = (owner or '').partition(':')
+    pid, _, nonce = rest.partition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    if int(pid) == os.getpid():
+        # 进程号相同但标识不同：之前使用这个进程号的进程已经退出
+        return owner != INSTANCE_ID
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+def reconcile_results():
+    """启动时执行一次：登记已有记录的过期时间，未被任何记录引用的文件按修改时间登记过期
+
+    同一主机上已退出的进程（例如被 SIGKILL 终止）遗留的排队和运行中任务立即接管，不等心跳超时。
+    """
+    tracked = set()
+    for data in task_store.find():
+        if data.get('status') in ('queued', 'processing') and owner_exited(data.get('owner')):
+            recover_stale(data['task_id'], data)
+        else:
+            expiry.register(('record', data['task_id']), record_deadline(data))
+        if data.get('path'):
+            tracked.add(data['path'])
+        tracked.update(data.get('inputs', []))
+    
+    for area in AREAS:
+        for name, mtime in storage.list(area):
+            if name not in tracked:
+                expiry.register(('file', name), mtime + settings.TASK_RESULT_TTL)
+    
+    for filename in os.listdir(UPLOAD_SPOOL_DIR):
+        file_path = os.path.join(UPLOAD_SPOOL_DIR, filename)
+        if file_path in tracked:
+            continue
+        try:
+            expiry.register(('upload', file_path), os.path.getmtime(file_path) + settings.TASK_RESULT_TTL)
+        except OSError:
+            pass
+
+# 结果缓存：相同输入再次提交时直接返回已有结果
+result_cache = get_result_cache()
+
+# 各分析阶段的存储分区、结果文件名前缀和记录类型
+STAGES = {
+    'exposure': ('results', 'result', 'exposure_analysis'),
+    'effects': ('effect_results', 'effect_analysis', 'effects_analysis'),
+    'tracing': ('tracing_results', 'tracing_result', 'tracing_analysis'),
+}
+RESULT_TYPES = {record_type for _, _, record_type in STAGES.values()}
+
+def result_name(stage, user_id, result_id):
+    """结果文件的存储名称"""
+    area, prefix, _ = STAGES[stage]
+    return storage.name_for(area, f"{prefix}_{user_id}_{result_id}.xlsx")
+
+def latest_exposure_key(user_id):
+    """用户最新暴露分析结果的缓存键，后续阶段的缓存键以此区分输入，没有时返回 None"""
+    latest = task_store.get_latest(user_id, 'exposure')
+    if latest is None:
+        return None
+    record = task_store.get(latest['result_id'])
+    return record.get('cache_key') if record else None
 
-def process_files_task(file1_binary, file2_binary, user_id):
+def submit_cached(stage, key, user_id, task_id=None, **fields):
+    """缓存命中时直接写入结果记录和已完成的任务记录，不进入调度队列
+
+    返回任务ID（传入 task_id 时使用预先分配的ID），未命中时返回 None。
+    """
+    if key is None:
+        return None
+    record_type = STAGES[stage][2]
+    result_id = uuid.uuid4().hex
+    name = result_name(stage, user_id, result_id)
+    temp_path = storage.temp_path(name)
+    meta = result_cache.get(key, temp_path)
+    if meta is None:
+        return None
+    storage.commit(temp_path, name)
+    task_id = task_id or uuid.uuid4().hex
+    
+    now = time.time()
+    put_record(result_id, dict(
+        fields,
+        status='completed',
+        path=name,
+        timestamp=now,
+        user_id=user_id,
+        type=record_type,
+        cache_key=key
+    ))
+    put_record(task_id, dict(
+        meta,
+        timestamp=now,
+        user_id=user_id,
+        status='completed',
+        type=f'{record_type}_task',
+        result_id=result_id,
+        cached=True
+    ))
+    task_store.set_latest(user_id, stage, result_id, name)
+    logger.info(f"用户 {user_id} 的{record_type}任务命中结果缓存")
+    return task_id
+
+# 客户端请求ID记录的类型，这类记录没有 status，不是任务记录
+REQUEST_TYPE = 'request'
+
+def request_record_id(user_id, stage, request_key):
+    """客户端请求ID对应的记录ID（同一用户、同一阶段、同一输入内唯一）
+
+    效应分析和溯源分析的输入包括用户最新的暴露分析结果，暴露分析重新计算后，
+    沿用旧请求ID的提交按新提交处理，不会返回基于旧结果的任务。
+    """
+    identity = ''
+    if stage != 'exposure':
+        identity = (task_store.get_latest(user_id, 'exposure') or {}).get('result_id') or ''
+    digest = hashlib.sha256(f'{user_id}:{stage}:{identity}:{request_key}'.encode('utf-8')).hexdigest()
+    return f'request_{digest[:32]}'
+
+def claim_request(user_id, stage, request_key):
+    """幂等提交：登记客户端请求ID，返回 (任务ID, 是否为新提交)
+
+    首次提交时预先分配任务ID并写入排队中的占位记录，重复提交（双击、浏览器重试）返回已有任务ID。
+    已有任务被取消或失败时按新提交处理：对请求记录的 request_task_id 比较并替换，
+    并发的重试只有一个能登记新任务。
+    """
+    record_id = request_record_id(user_id, stage, request_key)
+    existing = task_store.get(record_id)
+    if existing is not None:
+        task = task_store.get(existing['request_task_id'])
+        if task is not None and task['status'] not in ('cancelled', 'failed') and not task.get('cancel_requested'):
+            return existing['request_task_id'], False
+    
+    # 先写入占位的任务记录，再登记请求ID，重复提交查到请求ID时任务记录一定存在
+    task_id = uuid.uuid4().hex
+    now = time.time()
+    put_record(task_id, {
+        'timestamp': now,
+        'user_id': user_id,
+        'status': 'queued',
+        'type': f'{STAGES[stage][2]}_task'
+    })
+    record = {'timestamp': now, 'user_id': user_id, 'type': REQUEST_TYPE, 'request_task_id': task_id}
+    if existing is None:
+        claimed = task_store.add(record_id, record)
+    else:
+        claimed = task_store.claim(record_id, 'request_task_id', existing['request_task_id'], **record)
+    if not claimed:
+        # 并发的重复提交先登记了请求ID
+        task_store.delete(task_id)
+        expiry.discard(('record', task_id))
+        winner = (task_store.get(record_id) or {}).get('request_task_id')
+        if winner is None:
+            # 请求记录在此期间被释放，重新认领
+            return claim_request(user_id, stage, request_key)
+        return winner, False
+    expiry.register(('record', record_id), now + settings.TASK_RESULT_TTL)
+    return task_id, True
+
+def release_request(user_id, stage, request_key, task_id):
+    """提交失败时释放请求ID和占位记录，客户端重试时重新提交"""
+    record_id = request_record_id(user_id, stage, request_key)
+    if (task_store.get(record_id) or {}).get('request_task_id') == task_id:
+        task_store.delete(record_id)
+        expiry.discard(('record', record_id))
+    task_store.delete(task_id)
+    expiry.discard(('record', task_id))
+
+def mark_cancelled(task_id):
+    """任务被取消：更新任务状态（未完成的结果文件由任务函数删除）"""
+    finish_task(task_id, 'cancelled')
+    logger.info(f"任务 {task_id} 已取消")
+
+def cancel_task(task_id):
+    """取消任务：排队中和停机挂起的任务立即取消，运行中的任务在下一个检查点停止
+
+    返回 True 表示任务已直接取消，False 表示已记录取消请求、等待任务自行停止。
+    """
+    task_store.update(task_id, cancel_requested=True)
+    if scheduler.cancel(task_id) or task_store.claim(task_id, 'status', 'suspended', status='cancelled'):
+        finish_task(task_id, 'cancelled')
+        # 任务不会再执行，由这里删除暂存的上传文件
+        remove_inputs((task_store.get(task_id) or {}).get('inputs'))
+        return True
+    return False
+
+def stop_cancelled(task_id, suspend=False):
+    """任务在检查点停止：停机时挂起（保留输入文件，下次启动时恢复）并返回 True，否则按取消处理"""
+    if suspend or (task_store.get(task_id) or {}).get('suspend_requested'):
+        task_store.update(task_id, status='suspended', progress=None, updated_at=time.time(), owner=None,
+                          cancel_requested=False, suspend_requested=False)
+        _owned.discard(task_id)
+        logger.info(f"任务 {task_id} 已挂起，下次启动时恢复")
+        return True
+    mark_cancelled(task_id)
+    return False
+
+def process_files_task(task_id, upload1, upload2, user_id):
     """处理文件的任务函数"""
+    # 任务从队列中派发，开始执行
+    task_store.update(task_id, status='processing', updated_at=time.time())
+    cancel_token = CancellationToken(task_store, task_id)
+    progress = ProgressReporter(task_store, task_id)
+    temp_path = None
+    suspended = False
+    
     try:
+        # 排队期间可能已被取消
+        cancel_token.check()
+        
         # 创建唯一结果ID
         result_id = uuid.uuid4().hex
         
-        ## 创建临时文件和结果路径
-        temp_file1_path = os.path.join(RESULTS_DIR, f"temp_input1_{user_id}_{result_id}.xlsx")
-        temp_file2_path = os.path.join(RESULTS_DIR, f"temp_input2_{user_id}_{result_id}.xlsx")
-        result_path = os.path.join(RESULTS_DIR, f"result_{user_id}_{result_id}.xlsx")
+        # 结果先写入临时文件，完成后原子替换为正式名称
+        name = result_name('exposure', user_id, result_id)
+        temp_path = storage.temp_path(name)
         
-        try:
-            # 写入临时文件
-            with open(temp_file1_path, 'wb') as f:
-                f.write(file1_binary)
-                
-            with open(temp_file2_path, 'wb') as f:
-                f.write(file2_binary)
-            
-            # 导入计算模块并处理
-            from . import calculate
-            calculate.process_data(temp_file1_path, temp_file2_path, result_path)
-            
-            # 保存结果信息
-            TASK_RESULTS[result_id] = {
-                'status': 'completed',
-                'path': result_path,
-                'timestamp': time.time(),
-                'user_id': user_id
-            }
-            
-            return result_id
-            
-        finally:
-            # 清理临时输入文件
-            try:
-                if os.path.exists(temp_file1_path):
-                    os.remove(temp_file1_path)
-                if os.path.exists(temp_file2_path):
-                    os.remove(temp_file2_path)
-            except Exception:
-                pass
+        # 导入计算模块并处理（计算进程直接读取暂存的上传文件，两份输入只解析一次）
+        from . import calculate, descriptor_generation
+        reference, detected = run_in_process(calculate.read_inputs, upload1.path, upload2.path,
+                                             cancel_token=cancel_token, progress=progress)
+        # 缓存和输入文件中都没有描述符、但提供了结构的新物质，先在进程池中并行生成描述符
+        structures = descriptor_generation.pending_structures(reference, detected)
+        descriptor_generation.generate(structures, imap_in_process, settings.PROCESS_POOL_WORKERS,
+                                       cancel_token=cancel_token, progress=progress)
+        cancel_token.check()
+        used = run_in_process(calculate.quantify_inputs, reference, detected, temp_path,
+                              cancel_token=cancel_token, progress=progress)
+        storage.commit(temp_path, name)
+        # 缓存键按计算实际使用的描述符版本（包括本任务写入的描述符）计算
+        key = cache_key('exposure', upload1.sha256, upload2.sha256, used)
+        
+        # 保存结果信息
+        put_record(result_id, {
+            'status': 'completed',
+            'path': name,
+            'timestamp': time.time(),
+            'user_id': user_id,
+            'type': 'exposure_analysis',
+            'cache_key': key
+        })
+        result_cache.put(key, storage.path(name))
+        finish_task(task_id, 'completed', result_id=result_id)
+        task_store.set_latest(user_id, 'exposure', result_id, name)
+        
+        return result_id
                 
+    except TaskCancelled as e:
+        suspended = stop_cancelled(task_id, isinstance(e, TaskSuspended))
+        return None
+    
     except Exception as e:
-        # 创建错误结果记录，但不记录日志
-        error_id = uuid.uuid4().hex
-        TASK_RESULTS[error_id] = {
-            'status': 'failed',
-            'error': str(e),
-            'timestamp': time.time(),
-            'user_id': user_id
-        }
+        # 在任务记录上标记失败，但不记录日志
+        finish_task(task_id, 'failed', error=str(e))
         
-        return error_id
-
-# 提交任务到线程池并返回跟踪ID
-def submit_task(file1_binary, file2_binary, user_id):
-    """提交任务到线程池并返回可用于跟踪的ID"""
-    future = executor.submit(
-        process_files_task,
-        file1_binary,
-        file2_binary,
-        user_id
-    )
-    
-    # 生成任务跟踪ID
-    task_id = uuid.uuid4().hex
+        return None
+    
+    finally:
+        # 挂起的任务保留暂存文件，恢复后继续使用
+        if not suspended:
+            upload1.remove()
+            upload2.remove()
+        if temp_path:
+            storage.discard(temp_path)
+
+# 提交任务到调度队列并返回跟踪ID
+def submit_task(upload1, upload2, user_id, priority=PRIORITY_INTERACTIVE, task_id=None):
+    """提交任务到调度队列并返回可用于跟踪的ID（暂存的上传文件此后由任务负责删除）"""
+    # 相同上传文件已有结果、且描述符缓存没有变化时直接返回
+    key = cache_key('exposure', upload1.sha256, upload2.sha256, descriptor_cache.version())
+    cached_id = submit_cached('exposure', key, user_id, task_id=task_id)
+    if cached_id:
+        upload1.remove()
+        upload2.remove()
+        return cached_id
     
-    # 存储future对象以便检查状态
-    TASK_RESULTS[task_id] = {
-        'future': future,
+    # 生成任务跟踪ID（幂等提交时使用预先分配的ID）
+    task_id = task_id or uuid.uuid4().hex
+    
+    # 先写入任务记录，再提交，保证任务函数总能找到自己的记录
+    put_record(task_id, {
         'timestamp': time.time(),
         'user_id': user_id,
-        'status': 'processing'
-    }
+        'status': 'queued',
+        'priority': priority,
+        'type': 'exposure_analysis_task',
+        'inputs': [upload1.path, upload2.path],
+        # 停机时挂起、下次启动恢复所需的参数
+        'resume': {'stage': 'exposure', 'uploads': [upload1.handle(), upload2.handle()]}
+    })
+    
+    try:
+        scheduler.submit(
+            task_id,
+            user_id,
+            priority,
+            upload1.size + upload2.size,
+            process_files_task,
+            task_id,
+            upload1,
+            upload2,
+            user_id
+        )
+    except QueueFull:
+        # 未被接收的任务不保留记录和暂存文件
+        task_store.delete(task_id)
+        expiry.discard(('record', task_id))
+        upload1.remove()
+        upload2.remove()
+        raise
     
     return task_id
 
-def process_endpoint_task(endpoint, user_id):
+def find_latest_exposure_result(user_id):
+    """通过最新结果索引查找同一用户最新的暴露分析结果文件路径"""
+    latest = task_store.get_latest(user_id, 'exposure')
+    if latest is None:
+        return None
+    data = task_store.get(latest['result_id'])
+    if data is None or not ensure_result_file(latest['result_id'], data):
+        return None
+    return storage.path(data['path'])
+
+def process_endpoint_task(task_id, endpoint, user_id):
     """处理毒性终点分析的任务函数"""
+    # 任务从队列中派发，开始执行
+    task_store.update(task_id, status='processing', updated_at=time.time())
+    cancel_token = CancellationToken(task_store, task_id)
+    progress = ProgressReporter(task_store, task_id)
+    temp_path = None
+    
     try:
+        # 排队期间可能已被取消
+        cancel_token.check()
+        
         # 创建唯一结果ID
         result_id = uuid.uuid4().hex
         
         # 查找同一用户最新的暴露分析结果
-        exposure_result_path = None
-        latest_timestamp = 0
-        
-        for temp_id, data in TASK_RESULTS.items():
-            if (data.get('user_id') == user_id and 
-                data.get('status') == 'completed' and 
-                'path' in data and 
-                os.path.exists(data['path']) and 
-                'timestamp' in data and 
-                data['timestamp'] > latest_timestamp and
-                'path' in data and 
-                data['path'].endswith('.xlsx') and
-                'result_' in data['path']):  # 暴露分析的结果文件名格式
-                
-                latest_timestamp = data['timestamp']
-                exposure_result_path = data['path']
+        exposure_result_path = find_latest_exposure_result(user_id)
         
         # 如果找不到暴露分析的结果，抛出错误
         if not exposure_result_path:
             raise ValueError("未找到暴露分析结果，请先完成暴露分析步骤")
         
-        # 创建效应分析结果文件路径
-        result_path = os.path.join(EFFECT_RESULTS_DIR, f"effect_analysis_{user_id}_{result_id}.xlsx")
+        exposure_key = latest_exposure_key(user_id)
+        key = cache_key('effects', exposure_key, endpoint) if exposure_key else None
+        
+        # 创建效应分析结果文件，完成后原子替换为正式名称
+        name = result_name('effects', user_id, result_id)
+        temp_path = storage.temp_path(name)
         
         try:
             # 导入计算模块并处理
             from . import calculate_effects
-            risk_data = calculate_effects.calculate_risk_ranking(endpoint, exposure_result_path, result_path)           
+            risk_data = run_in_process(calculate_effects.calculate_risk_ranking, endpoint, exposure_result_path, temp_path,
+                                       cancel_token=cancel_token, progress=progress)
+            storage.commit(temp_path, name)           
             # 保存结果信息
-            TASK_RESULTS[result_id] = {
+            put_record(result_id, {
                 'status': 'completed',
-                'path': result_path,
+                'path': name,
                 'timestamp': time.time(),
                 'user_id': user_id,
                 'endpoint': endpoint,
-                'type': 'effects_analysis'
-            }
+                'type': 'effects_analysis',
+                'cache_key': key
+            })
+            if key:
+                result_cache.put(key, storage.path(name), {'risk_data': risk_data})
+            finish_task(task_id, 'completed', result_id=result_id, risk_data=risk_data)
+            task_store.set_latest(user_id, 'effects', result_id, name)
 
             return result_id, risk_data  
+        except TaskCancelled:
+            raise
         except Exception as e:
             # 记录错误但不抛出
             logger.error(f"效应分析计算错误: {str(e)}")
             raise
             
+    except TaskCancelled as e:
+        stop_cancelled(task_id, isinstance(e, TaskSuspended))
+        return None, None
+    
     except Exception as e:
-        # 创建错误结果记录
-        error_id = uuid.uuid4().hex
-        TASK_RESULTS[error_id] = {
-            'status': 'failed',
-            'error': str(e),
-            'timestamp': time.time(),
-            'user_id': user_id,
-            'type': 'effects_analysis'
-        }
+        # 在任务记录上标记失败
+        finish_task(task_id, 'failed', error=str(e))
         
-        return error_id, None
+        return None, None
+    
+    finally:
+        if temp_path:
+            storage.discard(temp_path)
 
 # 提交效应分析任务函数
-def submit_endpoint_task(endpoint, user_id):
-    """提交效应分析任务到线程池并返回可用于跟踪的ID"""
-    future = executor.submit(
-        process_endpoint_task,
-        endpoint,
-        user_id
-    )
-    
-    # 生成任务跟踪ID
-    task_id = uuid.uuid4().hex
+def submit_endpoint_task(endpoint, user_id, priority=PRIORITY_INTERACTIVE, task_id=None):
+    """提交效应分析任务到调度队列并返回可用于跟踪的ID"""
+    # 同一暴露分析结果和毒性终点已有结果时直接返回
+    exposure_key = latest_exposure_key(user_id)
+    if exposure_key:
+        cached_id = submit_cached('effects', cache_key('effects', exposure_key, endpoint), user_id,
+                                  task_id=task_id, endpoint=endpoint)
+        if cached_id:
+            return cached_id
     
-    # 存储future对象以便检查状态
-    TASK_RESULTS[task_id] = {
-        'future': future,
+    # 生成任务跟踪ID（幂等提交时使用预先分配的ID）
+    task_id = task_id or uuid.uuid4().hex
+    
+    put_record(task_id, {
         'timestamp': time.time(),
         'user_id': user_id,
-        'status': 'processing',
-        'type': 'effects_analysis_task'
-    }
+        'status': 'queued',
+        'priority': priority,
+        'type': 'effects_analysis_task',
+        # 停机时挂起、下次启动恢复所需的参数
+        'resume': {'stage': 'effects', 'endpoint': endpoint}
+    })
+    
+    try:
+        scheduler.submit(
+            task_id,
+            user_id,
+            priority,
+            0,
+            process_endpoint_task,
+            task_id,
+            endpoint,
+            user_id
+        )
+    except QueueFull:
+        # 未被接收的任务不保留记录
+        task_store.delete(task_id)
+        expiry.discard(('record', task_id))
+        raise
     
     return task_id
 
-def process_tracing_task(file_binary, user_id):
+def process_tracing_task(task_id, upload, user_id):
     """处理风险溯源的任务函数"""
+    # 任务从队列中派发，开始执行
+    task_store.update(task_id, status='processing', updated_at=time.time())
+    cancel_token = CancellationToken(task_store, task_id)
+    progress = ProgressReporter(task_store, task_id)
+    temp_path = None
+    suspended = False
+    
     try:
+        # 排队期间可能已被取消
+        cancel_token.check()
+        
         # 创建唯一结果ID
         result_id = uuid.uuid4().hex
         
         # 查找同一用户最新的暴露分析结果
-        exposure_result_path = None
-        latest_timestamp = 0
-        
-        for temp_id, data in TASK_RESULTS.items():
-            if (data.get('user_id') == user_id and 
-                data.get('status') == 'completed' and 
-                'path' in data and 
-                os.path.exists(data['path']) and 
-                'timestamp' in data and 
-                data['timestamp'] > latest_timestamp and
-                'path' in data and 
-                data['path'].endswith('.xlsx') and
-                'result_' in data['path']):  # 暴露分析的结果文件名格式
-                
-                latest_timestamp = data['timestamp']
-                exposure_result_path = data['path']
+        exposure_result_path = find_latest_exposure_result(user_id)
         
         # 如果找不到暴露分析的结果，抛出错误
         if not exposure_result_path:
             raise ValueError("未找到暴露分析结果，请先完成暴露分析步骤")
-        # 创建临时文件和结果路径
-        temp_file_path = os.path.join(TRACING_RESULTS_DIR, f"temp_input_{user_id}_{result_id}.xlsx")
-        result_path = os.path.join(TRACING_RESULTS_DIR, f"tracing_result_{user_id}_{result_id}.xlsx")
+        exposure_key = latest_exposure_key(user_id)
+        key = cache_key('tracing', exposure_key, upload.sha256) if exposure_key else None
         
-        try:
-            # 写入临时文件
-            with open(temp_file_path, 'wb') as f:
-                f.write(file_binary)
-            
-            
-            # 导入计算模块并处理
-
-            from . import calculate_tracing
-            calculate_tracing.process_tracing(temp_file_path, exposure_result_path,result_path)
-            
-            
-            # 保存结果信息
-            TASK_RESULTS[result_id] = {
-                'status': 'completed',
-                'path': result_path,
-                'timestamp': time.time(),
-                'user_id': user_id,
-                'type': 'tracing_analysis'
-            }
-            
-            return result_id
-            
-        finally:
-            # 清理临时输入文件
-            try:
-                if os.path.exists(temp_file_path):
-                    os.remove(temp_file_path)
-            except Exception:
-                pass
-            
-    except Exception as e:
-        # 创建错误结果记录
-        error_id = uuid.uuid4().hex
-        TASK_RESULTS[error_id] = {
-            'status': 'failed',
-            'error': str(e),
+        # 结果先写入临时文件，完成后原子替换为正式名称
+        name = result_name('tracing', user_id, result_id)
+        temp_path = storage.temp_path(name)
+        
+        # 导入计算模块并处理（计算进程直接读取暂存的上传文件）
+        from . import calculate_tracing
+        run_in_process(calculate_tracing.process_tracing, upload.path, exposure_result_path, temp_path,
+                       cancel_token=cancel_token, progress=progress)
+        storage.commit(temp_path, name)
+        
+        # 保存结果信息
+        put_record(result_id, {
+            'status': 'completed',
+            'path': name,
             'timestamp': time.time(),
             'user_id': user_id,
-            'type': 'tracing_analysis'
-        }
+            'type': 'tracing_analysis',
+            'cache_key': key
+        })
+        if key:
+            result_cache.put(key, storage.path(name))
+        finish_task(task_id, 'completed', result_id=result_id)
+        task_store.set_latest(user_id, 'tracing', result_id, name)
+        
+        return result_id
+            
+    except TaskCancelled as e:
+        suspended = stop_cancelled(task_id, isinstance(e, TaskSuspended))
+        return None
+    
+    except Exception as e:
+        # 在任务记录上标记失败
+        finish_task(task_id, 'failed', error=str(e))
         
         # 记录错误
         logger.error(f"风险溯源分析错误: {str(e)}")
         
-        return error_id
+        return None
+    
+    finally:
+        # 挂起的任务保留暂存文件，恢复后继续使用
+        if not suspended:
+            upload.remove()
+        if temp_path:
+            storage.discard(temp_path)
 
 # 提交风险溯源任务函数
-def submit_tracing_task(file_binary, user_id):
-    """提交风险溯源任务到线程池并返回可用于跟踪的ID"""
-    future = executor.submit(
-        process_tracing_task,
-        file_binary,
-        user_id
-    )
-    
-    # 生成任务跟踪ID
-    task_id = uuid.uuid4().hex
+def submit_tracing_task(upload, user_id, priority=PRIORITY_INTERACTIVE, task_id=None):
+    """提交风险溯源任务到调度队列并返回可用于跟踪的ID（暂存的上传文件此后由任务负责删除）"""
+    # 同一暴露分析结果和上传文件已有结果时直接返回
+    exposure_key = latest_exposure_key(user_id)
+    if exposure_key:
+        cached_id = submit_cached('tracing', cache_key('tracing', exposure_key, upload.sha256), user_id,
+                                  task_id=task_id)
+        if cached_id:
+            upload.remove()
+            return cached_id
     
-    # 存储future对象以便检查状态
-    TASK_RESULTS[task_id] = {
-        'future': future,
+    # 生成任务跟踪ID（幂等提交时使用预先分配的ID）
+    task_id = task_id or uuid.uuid4().hex
+    
+    put_record(task_id, {
         'timestamp': time.time(),
         'user_id': user_id,
-        'status': 'processing',
-        'type': 'tracing_analysis_task'
-    }
+        'status': 'queued',
+        'priority': priority,
+        'type': 'tracing_analysis_task',
+        'inputs': [upload.path],
+        # 停机时挂起、下次启动恢复所需的参数
+        'resume': {'stage': 'tracing', 'uploads': [upload.handle()]}
+    })
+    
+    try:
+        scheduler.submit(
+            task_id,
+            user_id,
+            priority,
+            upload.size,
+            process_tracing_task,
+            task_id,
+            upload,
+            user_id
+        )
+    except QueueFull:
+        # 未被接收的任务不保留记录和暂存文件
+        task_store.delete(task_id)
+        expiry.discard(('record', task_id))
+        upload.remove()
+        raise
     
     return task_id
 
+def resume_task(task_id, data):
+    """把挂起的任务按记录中的参数重新放入调度队列，输入文件已丢失时标记失败"""
+    spec = data.get('resume') or {}
+    uploads = [SpooledUpload.from_handle(handle) for handle in spec.get('uploads', ())]
+    user_id = data['user_id']
+    if spec.get('stage') not in STAGES or any(not os.path.exists(u.path) for u in uploads):
+        finish_task(task_id, 'failed', error='任务输入文件已丢失，请重新提交')
+        remove_inputs(data.get('inputs'))
+        return False
+    
+    if spec['stage'] == 'exposure':
+        func, args = process_files_task, (task_id, uploads[0], uploads[1], user_id)
+    elif spec['stage'] == 'effects':
+        func, args = process_endpoint_task, (task_id, spec['endpoint'], user_id)
+    else:
+        func, args = process_tracing_task, (task_id, uploads[0], user_id)
+    try:
+        scheduler.submit(task_id, user_id, data.get('priority', PRIORITY_INTERACTIVE),
+                         sum(u.size for u in uploads), func, *args)
+    except JobTooLarge as e:
+        finish_task(task_id, 'failed', error=str(e))
+        remove_inputs(data.get('inputs'))
+        return False
+    except QueueFull:
+        # 队列已满，保持挂起，心跳超时后由过期调度再次尝试，或留待下次启动
+        now = time.time()
+        task_store.update(task_id, status='suspended', updated_at=now, owner=None)
+        _owned.discard(task_id)
+        expiry.register(('record', task_id), now + settings.TASK_HEARTBEAT_TIMEOUT)
+        return False
+    return True
+
+def resume_claimed(task_id, data):
+    """认领挂起的任务并重新排队
+
+    只认领状态为 suspended 的任务，通过 claim 比较并设置，多个进程同时认领时每个任务只会被一个进程恢复。
+    """
+    # 重置时间戳，恢复的任务重新计算保留期
+    now = time.time()
+    if not task_store.claim(task_id, 'status', 'suspended', status='queued', timestamp=now,
+                            owner=INSTANCE_ID, updated_at=now, progress=None,
+                            cancel_requested=False, suspend_requested=False):
+        return False
+    own_task(task_id)
+    expiry.register(('record', task_id), now + settings.TASK_HEARTBEAT_TIMEOUT)
+    return resume_task(task_id, data)
 
+def resume_suspended():
+    """启动时执行一次：认领上次停机时挂起的任务并重新排队
+
+    仍为 processing 且带有挂起请求的任务可能还在旧进程中运行到检查点，由旧进程挂起后才会被恢复。
+    """
+    resumed = 0
+    for data in task_store.find(status='suspended'):
+        if resume_claimed(data['task_id'], data):
+            resumed += 1
+    if resumed:
+        logger.info(f"已恢复 {resumed} 个挂起的任务")
+
+# 停机时等待运行中任务的期限（秒），以及超时后等待任务在检查点挂起的时间
+DRAIN_TIMEOUT = settings.TASK_DRAIN_TIMEOUT
+SUSPEND_GRACE = 10
+
+_shutdown_done = False
+_shutdown_lock = threading.Lock()
+
+def shutdown(timeout=DRAIN_TIMEOUT):
+    """停机：停止接收新任务，排队中的任务挂起到任务存储，等待运行中的任务结束
+
+    超过期限仍未结束的任务在下一个检查点挂起。挂起的任务连同暂存的输入文件保留，下次启动时自动恢复。
+    SIGTERM 处理函数和 atexit 都会调用，只执行一次。
+    """
+    global _shutdown_done
+    with _shutdown_lock:
+        if _shutdown_done:
+            return
+        _shutdown_done = True
+    queued = scheduler.close()
+    for task_id in queued:
+        task_store.update(task_id, status='suspended', updated_at=time.time(), owner=None)
+        _owned.discard(task_id)
+    if queued:
+        logger.info(f"停机：{len(queued)} 个排队任务已挂起")
+    if scheduler.wait_idle(timeout):
+        return
+    
+    running = scheduler.running_tasks()
+    for task_id in running:
+        task_store.update(task_id, cancel_requested=True, suspend_requested=True)
+    logger.info(f"停机：{len(running)} 个运行中的任务超过等待期限，将在下一个检查点挂起")
+    scheduler.wait_idle(SUSPEND_GRACE)
+
+_service_started = False
+_service_lock = threading.Lock()
+
+def start_service():
+    """Web 服务进程启动时执行一次（由 AppConfig.ready 调用，管理命令和进程池 worker 不执行）
+
+    先恢复上次停机挂起的任务，再核对已有记录和文件（同一主机上已退出的进程遗留的任务立即接管），
+    之后由过期调度线程在到期时清理。
+    """
+    global _service_started
+    with _service_lock:
+        if _service_started:
+            return
+        _service_started = True
+    resume_suspended()
+    reconcile_results()
+    expiry.start()
+    
+    # 解释器退出时执行停机流程；收到 SIGTERM 时由 apps.py 中的信号处理函数先行调用。
+    # concurrent.futures 在解释器退出时无限期等待线程池的工作线程结束（先于 atexit），
+    # 停机流程登记在同一阶段并先于它执行，服务器自己处理 SIGTERM 后退出时也能限时挂起未完成的任务
+    getattr(threading, '_register_atexit', atexit.register)(shutdown)
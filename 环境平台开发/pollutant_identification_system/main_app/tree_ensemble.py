@@ -0,0 +1,228 @@
+# main_app/tree_ensemble.py
+"""
+树集成模型编译
+
+把 scikit-learn 流水线（缺失值填充、标准化）和其中的 XGBoost 回归树集成编译为扁平的 NumPy 数组：
+- 预处理：每个输入列的填充值、均值和标准差，按 scikit-learn 的顺序在 float64 下计算；
+- 树：所有树的节点依次排列，feature、threshold、left、right、value 各为一个数组，
+  roots、depth 为每棵树的根节点位置和深度，叶子节点的 left、right 指向自身；
+- 推理时整批样本同时逐层遍历全部树（每层只推进深度足够的树），叶子值按树的顺序以 float32 累加，
+  与 XGBoost 的计算方式一致，结果与原流水线逐位相同。
+编译结果保存为 .npz，加载和推理只需要 NumPy，不再导入 xgboost 和 scikit-learn。
+"""
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# 输出为恒等变换的回归目标（预测值即树的叶子值之和）
+IDENTITY_OBJECTIVES = {'reg:squarederror', 'reg:absoluteerror', 'reg:pseudohubererror'}
+
+# 每次遍历的样本数，限制 (树数 × 样本数) 的中间数组大小
+BLOCK_SIZE = 4096
+
+
+class UnsupportedModel(ValueError):
+    """模型含有无法编译的步骤或参数，调用方继续使用原模型"""
+
+
+class CompiledModel:
+    """编译后的预处理和树集成，predict 接口与原流水线相同"""
+
+    ARRAYS = ('fill', 'mean', 'scale', 'roots', 'depth', 'feature', 'threshold', 'left', 'right',
+              'default_left', 'value')
+
+    def __init__(self, columns, base_score, **arrays):
+        self.columns = list(columns)
+        self.base_score = np.float32(base_score)
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        # 需要遍历的树按深度从深到浅排列，每一层只推进尚未到达叶子的树；只有一个叶子的树直接取叶子值
+        self._deep = np.flatnonzero(self.depth > 0)
+        self._deep = self._deep[np.argsort(-self.depth[self._deep], kind='stable')]
+        self._slot = np.full(len(self.roots), -1)
+        self._slot[self._deep] = np.arange(len(self._deep))
+        self._active = [int((self.depth[self._deep] > level).sum()) for level in range(int(self.depth.max(initial=0)))]
+
+    def transform(self, X):
+        """预处理：按列填充缺失值并标准化，返回 XGBoost 使用的 float32 特征矩阵"""
+        if isinstance(X, pd.DataFrame) and self.columns:
+            X = X[self.columns]
+        X = np.array(X, dtype='float64')
+        X = np.where(np.isnan(X), self.fill, X)
+        X -= self.mean
+        X /= self.scale
+        return X.astype('float32')
+
+    def _traverse(self, X):
+        """整批样本同时遍历全部（多于一个节点的）树，返回 (树数, 样本数) 的叶子节点编号"""
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        offsets = np.arange(n_rows) * n_features
+        missing = np.isnan(flat).any()
+        index = np.repeat(self.roots[self._deep][:, None], n_rows, axis=1)
+        for active in self._active:
+            nodes = index[:active]
+            x = flat[offsets + self.feature[nodes]]
+            go_left = x < self.threshold[nodes]
+            if missing:
+                go_left = np.where(np.isnan(x), self.default_left[nodes], go_left)
+            index[:active] = np.where(go_left, self.left[nodes], self.right[nodes])
+        return index
+
+    def predict(self, X):
+        X = self.transform(X)
+        prediction = np.full(len(X), self.base_score, dtype='float32')
+        for start in range(0, len(X), BLOCK_SIZE):
+            block = prediction[start:start + BLOCK_SIZE]
+            leaves = self._traverse(X[start:start + BLOCK_SIZE])
+            # 按树的顺序逐棵累加（与 XGBoost 相同的 float32 舍入顺序）
+            for tree, slot in enumerate(self._slot):
+                block += self.value[self.roots[tree]] if slot < 0 else self.value[leaves[slot]]
+        return prediction
+
+    def save(self, path):
+        """保存为 .npz（先写临时文件再原子替换）"""
+        meta = {'columns': self.columns, 'base_score': float(self.base_score)}
+        tmp_path = os.path.join(os.path.dirname(path) or '.', f'.{uuid.uuid4().hex}.tmp.npz')
+        try:
+            np.savez(tmp_path, meta=np.array(json.dumps(meta, ensure_ascii=False)),
+                     **{name: getattr(self, name) for name in self.ARRAYS})
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = {name: data[name] for name in cls.ARRAYS}
+        return cls(meta['columns'], meta['base_score'], **arrays)
+
+
+def _compile_preprocessing(transformer, n_features, feature_names=None):
+    """ColumnTransformer（各列为 SimpleImputer / StandardScaler 组成的流水线）-> (列名, 填充值, 均值, 标准差)；
+    没有预处理时按模型的特征名（没有特征名时按位置）取输入列"""
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    if transformer is None:
+        return list(feature_names or []), np.full(n_features, np.nan), np.zeros(n_features), np.ones(n_features)
+    if not isinstance(transformer, ColumnTransformer) or transformer.remainder != 'drop':
+        raise UnsupportedModel(f'不支持的预处理: {transformer!r}')
+    columns, fill, mean, scale = [], [], [], []
+    for name, step, selected in transformer.transformers_:
+        if step == 'drop' or len(selected) == 0:
+            continue
+        selected = list(selected)
+        if any(not isinstance(column, str) for column in selected):
+            raise UnsupportedModel(f'预处理 {name} 需要按列名选择输入列')
+        steps = [] if step == 'passthrough' else [s for _, s in step.steps] if isinstance(step, Pipeline) else [step]
+        step_fill = np.full(len(selected), np.nan)
+        step_mean = np.zeros(len(selected))
+        step_scale = np.ones(len(selected))
+        for i, s in enumerate(steps):
+            if isinstance(s, SimpleImputer) and i == 0 and not s.add_indicator:
+                if np.isnan(s.statistics_).any():
+                    raise UnsupportedModel(f'预处理 {name} 存在训练时全部缺失的列')
+                step_fill = np.asarray(s.statistics_, dtype='float64')
+            elif isinstance(s, StandardScaler) and i == len(steps) - 1:
+                if s.with_mean:
+                    step_mean = np.asarray(s.mean_, dtype='float64')
+                if s.with_std:
+                    step_scale = np.asarray(s.scale_, dtype='float64')
+            else:
+                raise UnsupportedModel(f'不支持的预处理步骤: {s!r}')
+        columns += selected
+        fill.append(step_fill)
+        mean.append(step_mean)
+        scale.append(step_scale)
+    if len(columns) != n_features:
+        raise UnsupportedModel(f'预处理输出 {len(columns)} 列，模型需要 {n_features} 列')
+    return columns, np.concatenate(fill), np.concatenate(mean), np.concatenate(scale)
+
+
+def _parse_base_score(value):
+    """base_score 在新版本中保存为 '[6.18E0]' 形式的向量"""
+    values = [float(v) for v in str(value).strip('[]').split(',') if v.strip()]
+    if len(values) != 1:
+        raise UnsupportedModel('只支持单输出回归模型')
+    return values[0]
+
+
+def _compile_trees(booster):
+    """XGBoost Booster -> (特征数, base_score, 扁平节点数组)"""
+    model = json.loads(booster.save_raw(raw_format='json'))['learner']
+    objective = model['objective']['name']
+    if objective not in IDENTITY_OBJECTIVES:
+        raise UnsupportedModel(f'不支持的目标函数: {objective}')
+    if model['gradient_booster']['name'] != 'gbtree':
+        raise UnsupportedModel(f"不支持的模型类型: {model['gradient_booster']['name']}")
+    params = model['learner_model_param']
+    n_features = int(params['num_feature'])
+    base_score = _parse_base_score(params['base_score'])
+    trees = model['gradient_booster']['model']['trees']
+    # 与 predict 一致：训练时启用了早停的模型只使用最佳轮次之前的树
+    best_iteration = booster.attr('best_iteration')
+    if best_iteration is not None:
+        indptr = model['gradient_booster']['model']['iteration_indptr']
+        trees = trees[:indptr[int(best_iteration) + 1]]
+
+    roots, depth, feature, threshold, left, right, default_left, value = [], [], [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        if any(tree['split_type']):
+            raise UnsupportedModel('不支持分类特征的分裂')
+        children_left = np.asarray(tree['left_children'], dtype='int64')
+        children_right = np.asarray(tree['right_children'], dtype='int64')
+        conditions = np.asarray(tree['split_conditions'], dtype='float32')
+        nodes = np.arange(len(children_left))
+        leaf = children_left == -1
+        roots.append(offset)
+        feature.append(np.where(leaf, 0, tree['split_indices']))
+        # 叶子节点的 split_conditions 保存的是叶子值
+        threshold.append(np.where(leaf, np.float32(0), conditions))
+        value.append(np.where(leaf, conditions, np.float32(0)))
+        left.append(np.where(leaf, nodes, children_left) + offset)
+        right.append(np.where(leaf, nodes, children_right) + offset)
+        default_left.append(np.asarray(tree['default_left'], dtype=bool))
+        # 计算树的深度：从根节点逐层展开
+        level, tree_depth = [0], 0
+        while True:
+            level = [child for node in level if not leaf[node]
+                     for child in (children_left[node], children_right[node])]
+            if not level:
+                break
+            tree_depth += 1
+        depth.append(tree_depth)
+        offset += len(nodes)
+
+    arrays = {
+        'roots': np.asarray(roots, dtype='int32'),
+        'depth': np.asarray(depth, dtype='int32'),
+        'feature': np.concatenate(feature).astype('int32'),
+        'threshold': np.concatenate(threshold).astype('float32'),
+        'left': np.concatenate(left).astype('int32'),
+        'right': np.concatenate(right).astype('int32'),
+        'default_left': np.concatenate(default_left),
+        'value': np.concatenate(value).astype('float32'),
+    }
+    return n_features, base_score, arrays
+
+
+def compile_pipeline(pipeline):
+    """把 [ColumnTransformer,] XGBRegressor 组成的流水线（或单独的 XGBRegressor）编译为 CompiledModel；
+    含有不支持的步骤时抛出 UnsupportedModel"""
+    steps = [step for _, step in getattr(pipeline, 'steps', [(None, pipeline)])]
+    if len(steps) > 2 or not hasattr(steps[-1], 'get_booster'):
+        raise UnsupportedModel(f'不支持的模型: {type(pipeline).__name__}')
+    booster = steps[-1].get_booster()
+    n_features, base_score, arrays = _compile_trees(booster)
+    columns, fill, mean, scale = _compile_preprocessing(
+        steps[0] if len(steps) == 2 else None, n_features, booster.feature_names)
+    return CompiledModel(columns, base_score, fill=fill, mean=mean, scale=scale, **arrays)
@@ -0,0 +1,66 @@
+# main_app/uploads.py
+"""
+上传文件的输入处理
+
+上传文件在请求中按块写入暂存目录（spool_upload），同时计算内容哈希，
+任务只持有暂存文件的句柄，排队任务的内存占用与上传大小无关。
+计算函数的输入可以是文件路径、文件对象，或内存中的字节（bytes / memoryview）。
+"""
+import hashlib
+import io
+import os
+import tempfile
+
+
+def as_readable(source):
+    """把字节类输入包装为 BytesIO，路径和文件对象原样返回"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, 'seek'):
+        # 同一个文件对象可能被重复读取，从头开始
+        source.seek(0)
+    return source
+
+
+class SpooledUpload:
+    """暂存到磁盘的上传文件句柄，只保存路径、大小和内容哈希，可以传入任务和进程池"""
+
+    def __init__(self, path, size, sha256, name=''):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.name = name
+
+    def handle(self):
+        """可序列化的句柄，写入任务记录，重启后用 from_handle 恢复"""
+        return {'path': self.path, 'size': self.size, 'sha256': self.sha256, 'name': self.name}
+
+    @classmethod
+    def from_handle(cls, handle):
+        return cls(handle['path'], handle['size'], handle['sha256'], handle.get('name', ''))
+
+    def remove(self):
+        """删除暂存文件"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def spool_upload(uploaded_file, directory, chunk_size=1024 * 1024):
+    """按块把上传文件写入暂存目录并同时计算 SHA-256，内存占用与文件大小无关"""
+    os.makedirs(directory, exist_ok=True)
+    suffix = os.path.splitext(uploaded_file.name or '')[1]
+    fd, path = tempfile.mkstemp(prefix='upload_', suffix=suffix, dir=directory)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in uploaded_file.chunks(chunk_size):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return SpooledUpload(path, size, digest.hexdigest(), uploaded_file.name)
@@ -6,6 +6,8 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('login/', views.user_login, name='login'),
     path('logout/', views.user_logout, name='logout'),
+    # 就绪检查（启动预热完成前返回 503）
+    path('ready/', views.readiness, name='readiness'),
     path('first_page/', views.first_page, name='first_page'),
 
      # 添加这些新路径
@@ -15,6 +17,16 @@ urlpatterns = [
     path('process_files/', views.process_files, name='process_files'),
     # 检查任务状态
     path('check_task_status/<str:task_id>/', views.check_task_status, name='check_task_status'),
+    # 批量检查任务状态
+    path('check_tasks_status/', views.check_tasks_status, name='check_tasks_status'),
+    # 取消任务
+    path('cancel_task/<str:task_id>/', views.cancel_task, name='cancel_task'),
+    # 任务队列状态
+    path('queue_status/', views.queue_status, name='queue_status'),
+    # 分子描述符缓存命中统计
+    path('descriptor_cache_status/', views.descriptor_cache_status, name='descriptor_cache_status'),
+    # 任务状态推送（SSE）
+    path('task_events/<str:task_id>/', views.task_events, name='task_events'),
     # 下载结果文件
     path('download_result/<str:result_id>/', views.download_result, name='download_result'),
 
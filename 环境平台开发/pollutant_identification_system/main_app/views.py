@@ -10,11 +10,20 @@ import os
 from django.conf import settings
 from django.http import JsonResponse, FileResponse
 from django.contrib.auth.decorators import login_required
-from .thread_pool import submit_task, TASK_RESULTS, logger
+from .thread_pool import submit_task, cancel_task as cancel_queued_task, task_store, ensure_result_file, storage, scheduler, logger
+from .thread_pool import claim_request, release_request, REQUEST_TYPE
+from .scheduler import PRIORITIES, PRIORITY_INTERACTIVE, JobTooLarge, QueueFull, SchedulerClosed
+from .uploads import spool_upload
+from . import warmup
+from .descriptor_cache import get_descriptor_cache
 import os
-import uuid
-from .thread_pool import executor, process_files_task, TASK_RESULTS
+import json
+import time
+import asyncio
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
 from django.urls import reverse
+from django.utils.http import content_disposition_header
 
 def index(request):
     """显示您上传的HTML主页"""
@@ -82,62 +91,49 @@ def download_template2(request):
     return response
 
 @login_required
-def process_files(request):
-    """处理上传的文件并等待计算完成"""
+async def process_files(request):
+    """处理上传的文件并提交异步计算任务"""
     if request.method == 'POST':
+        user = await request.auser()
         try:
             # 记录用户访问
-            logger.info(f"用户 {request.user.username} (ID: {request.user.id}) 请求文件处理")
+            logger.info(f"用户 {user.username} (ID: {user.id}) 请求文件处理")
             
-            # 获取上传的文件 - 使用正确的参数名
-            file1 = request.FILES.get('reference_submit_excel')  # 匹配前端参数名
-            file2 = request.FILES.get('detected_submit_excel')   # 匹配前端参数名
+            # 获取上传的文件 - 使用正确的参数名（解析请求体在线程中进行）
+            files = await run_sync(lambda: request.FILES)
+            file1 = files.get('reference_submit_excel')  # 匹配前端参数名
+            file2 = files.get('detected_submit_excel')   # 匹配前端参数名
             
             if not file1 or not file2:
                 return JsonResponse({'status': 'error', 'message': '请上传两个文件'})
             
-            # 读取文件内容到内存
-            file1_content = file1.read()
-            file2_content = file2.read()
-            user_id = request.user.id
+            # 重复提交（双击、浏览器重试）直接返回已有任务
+            request_key = get_request_key(request)
+            task_id, created = await claim_submission(user, 'exposure', request_key)
+            if not created:
+                logger.info(f"用户 {user.username} 重复提交，返回已有任务 {task_id}")
+                return JsonResponse(await run_sync(submission_payload, task_id, 'check_task_status'))
             
-            # 创建唯一结果ID
-            result_id = uuid.uuid4().hex
-            
-            # 创建Future对象，提交到线程池
-            future = executor.submit(
-                process_files_task,
-                file1_content, 
-                file2_content, 
-                user_id
-            )
+            try:
+                # 按块写入暂存文件，不把整个文件读入内存
+                upload1 = await run_sync(spool_upload, file1, settings.UPLOAD_SPOOL_DIR)
+                upload2 = await run_sync(spool_upload, file2, settings.UPLOAD_SPOOL_DIR)
+                
+                # 提交任务到线程池
+                task_id = await run_sync(submit_task, upload1, upload2, user.id, get_priority(request), task_id)
+            except Exception:
+                await release_submission(user, 'exposure', request_key, task_id)
+                raise
             
-            # 等待计算完成（阻塞当前请求直到计算完成）
-            task_result = future.result()
+            # 立即返回任务ID（命中缓存时直接返回结果），不等待计算完成
+            return JsonResponse(await run_sync(submission_payload, task_id, 'check_task_status'))
             
-            # 检查计算结果
-            if task_result and task_result in TASK_RESULTS:
-                result_data = TASK_RESULTS[task_result]
-                
-                if result_data['status'] == 'completed':
-                    return JsonResponse({
-                        'status': 'success',
-                        'message': '计算完成',
-                        'result_url': f"/download_result/{task_result}/"
-                    })
-                else:
-                    error_msg = result_data.get('error', '未知错误')
-                    return JsonResponse({
-                        'status': 'error',
-                        'message': f'计算过程出错: {error_msg}'
-                    })
-            else:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': '处理结果无效'
-                })
+        except QueueFull as e:
+            logger.info(f"任务队列已满，拒绝用户 {user.username} 的提交")
+            return queue_full_response(e)
             
         except Exception as e:
+            logger.error(f"处理文件请求时出错: {str(e)}")
             return JsonResponse({
                 'status': 'error',
                 'message': f'处理过程中出错: {str(e)}'
@@ -145,106 +141,290 @@ def process_files(request):
     
     return JsonResponse({'status': 'error', 'message': '仅支持POST请求'})
 
+def submission_payload(task_id, check_url_name):
+    """提交接口的响应内容：命中结果缓存的任务已经完成，直接返回结果；否则返回任务跟踪地址"""
+    task_data = task_store.get(task_id)
+    if task_data is not None and task_data['status'] == 'completed':
+        return dict(build_task_status(task_id, task_data), task_id=task_id, cached=True)
+    
+    return {
+        'status': 'processing',
+        'message': '任务已提交，正在处理中',
+        'task_id': task_id,
+        'check_url': reverse(check_url_name, args=[task_id]),
+        'events_url': reverse('task_events', args=[task_id]),
+        'cancel_url': reverse('cancel_task', args=[task_id]),
+        'queue_depth': scheduler.queue_depth()
+    }
+
+def queue_full_response(exc):
+    """队列已满时返回 HTTP 429（服务停机中返回 503），并通过 Retry-After 告知客户端退避时间；
+    单个任务数据量超过上限时返回 413"""
+    if isinstance(exc, JobTooLarge):
+        return JsonResponse({
+            'status': 'error',
+            'message': f'{exc}，请减小上传文件后重新提交',
+            'queue_depth': exc.queue_depth
+        }, status=413)
+    response = JsonResponse({
+        'status': 'error',
+        'message': f'服务器繁忙（{exc}），请 {exc.retry_after} 秒后重试',
+        'queue_depth': exc.queue_depth,
+        'retry_after': exc.retry_after
+    }, status=503 if isinstance(exc, SchedulerClosed) else 429)
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
 @login_required
-def check_task_status(request, task_id):
-    """检查任务状态"""
-    if task_id not in TASK_RESULTS:
-        return JsonResponse({'status': 'error', 'message': '任务不存在或已过期'})
-    
-    task_data = TASK_RESULTS[task_id]
-    
-    # 确保任务属于当前用户
-    if task_data.get('user_id') != request.user.id:
-        return JsonResponse({'status': 'error', 'message': '您无权访问此任务'})
-    
-    # 检查是否处理中的任务
-    if 'future' in task_data:
-        future = task_data['future']
-        
-        if future.done():
-            try:
-                # 获取处理结果
-                result_id = future.result()
-                
-                if result_id and result_id in TASK_RESULTS:
-                    result_data = TASK_RESULTS[result_id]
-                    
-                    # 删除原任务记录，保留结果记录
-                    del TASK_RESULTS[task_id]
-                    
-                    # 根据状态返回结果
-                    if result_data['status'] == 'completed':
-                        return JsonResponse({
-                            'status': 'success',
-                            'message': '计算完成',
-                            'result_url': f"/download_result/{result_id}/"
-                        })
-                    else:
-                        error_msg = result_data.get('error', '未知错误')
-                        return JsonResponse({
-                            'status': 'error',
-                            'message': f'计算过程出错: {error_msg}'
-                        })
-                else:
-                    return JsonResponse({
-                        'status': 'error',
-                        'message': '获取结果失败'
-                    })
-            
-            except Exception as e:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'处理任务结果时出错: {str(e)}'
-                })
-        else:
-            # 任务仍在处理中
-            return JsonResponse({
+def queue_status(request):
+    """返回当前任务队列状态，客户端可据此退避"""
+    return JsonResponse(dict(scheduler.stats(), status='success'))
+
+@login_required
+def descriptor_cache_status(request):
+    """返回分子描述符缓存的条目数和命中率"""
+    return JsonResponse(dict(get_descriptor_cache().stats(), status='success'))
+
+def readiness(request):
+    """就绪检查：启动预热完成后返回 200，否则返回 503，供负载均衡判断是否转发流量"""
+    state = warmup.status()
+    if state['status'] != 'ready':
+        return JsonResponse(state, status=503)
+    return JsonResponse(state)
+
+def get_request_key(request):
+    """客户端请求ID（表单字段 idempotency_key 或请求头 Idempotency-Key），没有时返回 None"""
+    return request.POST.get('idempotency_key') or request.headers.get('Idempotency-Key') or None
+
+async def claim_submission(user, stage, request_key):
+    """登记客户端请求ID，返回 (预先分配的任务ID, 是否为新提交)；没有请求ID时总是新提交"""
+    if not request_key:
+        return None, True
+    return await run_sync(claim_request, user.id, stage, request_key)
+
+async def release_submission(user, stage, request_key, task_id):
+    """提交失败时释放请求ID，客户端重试时重新提交"""
+    if request_key and task_id:
+        await run_sync(release_request, user.id, stage, request_key, task_id)
+
+def get_priority(request):
+    """读取提交请求中的优先级，页面提交默认为交互式，脚本批量提交可传 priority=batch"""
+    return PRIORITIES.get(request.POST.get('priority'), PRIORITY_INTERACTIVE)
+
+def build_task_status(task_id, task_data):
+    """根据任务记录生成状态响应内容（各检查状态接口与状态推送共用）"""
+    if task_data['status'] == 'queued':
+        # 排队中的任务对前端仍视为处理中，额外返回队列位置
+        position = scheduler.queue_position(task_id)
+        payload = {
+            'status': 'processing',
+            'state': 'queued',
+            'message': '任务排队中，请稍候...'
+        }
+        if position is not None:
+            payload['queue_position'] = position
+            payload['message'] = f'任务排队中，前面还有 {position} 个任务'
+        return payload
+    
+    if task_data['status'] == 'suspended' or task_data.get('suspend_requested'):
+        # 服务重启期间挂起的任务，重启后自动恢复
+        return {
+            'status': 'processing',
+            'state': 'suspended',
+            'message': '服务正在重启，任务将在重启后继续'
+        }
+    
+    if task_data['status'] == 'processing':
+        if task_data.get('cancel_requested'):
+            return {
                 'status': 'processing',
-                'message': '正在计算中，请稍候...'
-            })
-    
-    # 如果是已完成的任务结果
-    elif task_data['status'] == 'completed':
-        return JsonResponse({
-            'status': 'success',
-            'message': '计算完成',
-            'result_url': f"/download_result/{task_id}/"
-        })
-    else:
+                'state': 'cancelling',
+                'message': '正在取消任务...'
+            }
+        payload = {
+            'status': 'processing',
+            'state': 'running',
+            'message': '正在计算中，请稍候...'
+        }
+        progress = task_data.get('progress')
+        if progress:
+            payload['progress'] = progress
+            payload['message'] = f"正在计算中：{progress['stage']}（{progress['done']}/{progress['total']}）"
+        return payload
+    
+    if task_data['status'] == 'cancelled':
+        return {
+            'status': 'cancelled',
+            'message': '任务已取消'
+        }
+    
+    if task_data['status'] != 'completed':
         error_msg = task_data.get('error', '未知错误')
-        return JsonResponse({
+        return {
             'status': 'error',
             'message': f'计算过程出错: {error_msg}'
-        })
+        }
+    
+    # 任务完成时返回结果记录ID（直接查询结果记录时即为自身）
+    result_id = task_data.get('result_id', task_id)
+    payload = {
+        'status': 'success',
+        'message': '计算完成',
+        'result_id': result_id
+    }
+    if 'stage_times' in task_data:
+        # 各阶段耗时（秒）
+        payload['stage_times'] = task_data['stage_times']
+    task_type = task_data.get('type') or ''
+    if task_type.startswith('effects_analysis'):
+        if 'risk_data' in task_data:
+            payload['risk_data'] = task_data['risk_data']
+        payload['download_url'] = f"{reverse('download_risk_ranking')}?result_id={result_id}"
+    elif task_type.startswith('tracing_analysis'):
+        payload['download_url'] = reverse('download_tracing_result', args=[result_id])
+    else:
+        payload['result_url'] = reverse('download_result', args=[result_id])
+    return payload
 
-@login_required
-def download_result(request, result_id):
-    """下载计算结果"""
-    if result_id not in TASK_RESULTS:
+def run_sync(func, *args):
+    """在线程中执行阻塞调用（任务存储、文件读写），异步视图等待其结果而不阻塞事件循环"""
+    return sync_to_async(func, thread_sensitive=False)(*args)
+
+async def iter_file(f, chunk_size=FileResponse.block_size):
+    """异步分块读取文件，读取在线程中进行"""
+    try:
+        while True:
+            chunk = await run_sync(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+async def result_file_response(request, result_id, filename, label):
+    """结果文件下载（各下载接口共用）：校验归属，已归档的结果先恢复，再异步分块发送"""
+    user = await request.auser()
+    result_data = await run_sync(task_store.get, result_id) if result_id else None
+    if result_data is None:
         return JsonResponse({'status': 'error', 'message': '文件不存在或已过期'})
     
-    result_data = TASK_RESULTS[result_id]
-    
     # 检查文件是否属于当前用户
-    if result_data.get('user_id') != request.user.id:
+    if result_data.get('user_id') != user.id:
         return JsonResponse({'status': 'error', 'message': '您无权访问此文件'})
     
-    # 检查文件是否存在
-    if 'path' not in result_data or not os.path.exists(result_data['path']):
-        return JsonResponse({'status': 'error', 'message': '结果文件不存在'})
+    # 检查文件是否存在（已归档的结果先恢复）
+    if not await run_sync(ensure_result_file, result_id, result_data):
+        return JsonResponse({'status': 'error', 'message': '文件不存在或已过期'})
     
     # 记录下载
-    logger.info(f"用户 {request.user.username} 下载结果文件")
+    logger.info(f"用户 {user.username} 下载{label}")
     
     # 返回文件
     try:
-        return FileResponse(
-            open(result_data['path'], 'rb'),
-            as_attachment=True,
-            filename=f"分析结果_{result_id[:8]}.xlsx"
-        )
+        f = await run_sync(storage.open, result_data['path'])
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': f'下载文件时出错: {str(e)}'})
+    response = StreamingHttpResponse(
+        iter_file(f),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    try:
+        response['Content-Length'] = str(os.fstat(f.fileno()).st_size)
+    except (AttributeError, OSError):
+        pass
+    return response
+
+def get_user_task(task_id, user_id):
+    """读取任务记录并校验归属，返回 (任务记录, 错误信息)"""
+    task_data = task_store.get(task_id)
+    if task_data is None or task_data.get('type') == REQUEST_TYPE:
+        return None, '任务不存在或已过期'
+    
+    # 确保任务属于当前用户
+    if task_data.get('user_id') != user_id:
+        return None, '您无权访问此任务'
+    
+    return task_data, None
+
+@login_required
+async def check_task_status(request, task_id):
+    """检查任务状态"""
+    user = await request.auser()
+    task_data, error = await run_sync(get_user_task, task_id, user.id)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error})
+    
+    return JsonResponse(build_task_status(task_id, task_data))
+
+@login_required
+async def cancel_task(request, task_id):
+    """取消任务：排队中的任务立即取消，计算中的任务在下一个检查点停止"""
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': '仅支持POST请求'})
+    
+    user = await request.auser()
+    task_data, error = await run_sync(get_user_task, task_id, user.id)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error})
+    
+    if task_data['status'] == 'cancelled':
+        return JsonResponse({'status': 'cancelled', 'message': '任务已取消'})
+    if task_data['status'] not in ('queued', 'processing', 'suspended'):
+        return JsonResponse({'status': 'error', 'message': '任务已结束，无法取消'})
+    
+    logger.info(f"用户 {user.username} (ID: {user.id}) 取消任务 {task_id}")
+    if await run_sync(cancel_queued_task, task_id):
+        return JsonResponse({'status': 'cancelled', 'message': '任务已取消'})
+    return JsonResponse({
+        'status': 'processing',
+        'state': 'cancelling',
+        'message': '已请求取消，任务将在当前计算步骤结束后停止'
+    })
+
+@login_required
+async def check_tasks_status(request):
+    """批量检查任务状态
+
+    GET 参数 task_ids（可重复或以逗号分隔），或 POST JSON {"task_ids": [...]}，
+    一次返回所有任务的状态和结果链接。
+    """
+    if request.method == 'POST':
+        try:
+            task_ids = json.loads(request.body or b'{}').get('task_ids', [])
+        except (ValueError, AttributeError):
+            return JsonResponse({'status': 'error', 'message': '请求格式错误'}, status=400)
+    else:
+        task_ids = [task_id for value in request.GET.getlist('task_ids')
+                    for task_id in value.split(',') if task_id]
+    
+    if not isinstance(task_ids, list) or not task_ids:
+        return JsonResponse({'status': 'error', 'message': '请提供任务ID列表'}, status=400)
+    if len(task_ids) > settings.TASK_STATUS_BATCH_LIMIT:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'单次最多查询 {settings.TASK_STATUS_BATCH_LIMIT} 个任务'
+        }, status=400)
+    
+    # 一次查询取回全部任务记录
+    user = await request.auser()
+    records = await run_sync(task_store.get_many, task_ids)
+    tasks = {}
+    for task_id in task_ids:
+        task_data = records.get(task_id)
+        if task_data is None or task_data.get('type') == REQUEST_TYPE:
+            tasks[task_id] = {'status': 'error', 'message': '任务不存在或已过期'}
+        elif task_data.get('user_id') != user.id:
+            tasks[task_id] = {'status': 'error', 'message': '您无权访问此任务'}
+        else:
+            tasks[task_id] = build_task_status(task_id, task_data)
+    
+    return JsonResponse({'status': 'success', 'tasks': tasks})
+
+@login_required
+async def download_result(request, result_id):
+    """下载计算结果"""
+    return await result_file_response(request, result_id, f"分析结果_{result_id[:8]}.xlsx", '结果文件')
     
 @login_required
 def second_page(request):
@@ -254,33 +434,47 @@ def second_page(request):
 # 修改views.py中的process_endpoint函数
 
 @login_required
-def process_endpoint(request):
+async def process_endpoint(request):
     """处理选择的毒性终点并提交异步任务"""
     if request.method == 'POST':
+        user = await request.auser()
         try:
             # 记录用户访问
-            logger.info(f"用户 {request.user.username} (ID: {request.user.id}) 请求效应分析")
+            logger.info(f"用户 {user.username} (ID: {user.id}) 请求效应分析")
             
             # 获取选择的毒性终点
-            endpoint = request.POST.get('endpoint')
+            post = await run_sync(lambda: request.POST)
+            endpoint = post.get('endpoint')
             
             if not endpoint:
                 return JsonResponse({'status': 'error', 'message': '请选择一个毒性终点'})
             
-            # 提交任务到线程池
-            from .thread_pool import submit_endpoint_task
-            task_id = submit_endpoint_task(endpoint, request.user.id)
+            # 重复提交（双击、浏览器重试）直接返回已有任务
+            request_key = get_request_key(request)
+            task_id, created = await claim_submission(user, 'effects', request_key)
+            if not created:
+                logger.info(f"用户 {user.username} 重复提交，返回已有任务 {task_id}")
+            else:
+                # 提交任务到线程池
+                from .thread_pool import submit_endpoint_task
+                try:
+                    task_id = await run_sync(submit_endpoint_task, endpoint, user.id, get_priority(request), task_id)
+                except Exception:
+                    await release_submission(user, 'effects', request_key, task_id)
+                    raise
             
             # 保存任务ID到会话中，以便后续使用
-            request.session['effect_task_id'] = task_id
+            await request.session.aset('effect_task_id', task_id)
             
-            # 立即返回任务ID，不等待计算完成
-            return JsonResponse({
-                'status': 'processing',
-                'message': '任务已提交，正在处理中',
-                'task_id': task_id,
-                'check_url': reverse('check_endpoint_status', args=[task_id])
-            })
+            # 立即返回任务ID（命中缓存时直接返回结果），不等待计算完成
+            payload = await run_sync(submission_payload, task_id, 'check_endpoint_status')
+            if payload['status'] == 'success':
+                await request.session.aset('effect_result_id', payload['result_id'])
+            return JsonResponse(payload)
+            
+        except QueueFull as e:
+            logger.info(f"任务队列已满，拒绝用户 {user.username} 的提交")
+            return queue_full_response(e)
             
         except Exception as e:
             # 处理其他异常
@@ -293,115 +487,25 @@ def process_endpoint(request):
     return JsonResponse({'status': 'error', 'message': '仅支持POST请求'})
 
 @login_required
-def check_endpoint_status(request, task_id):
+async def check_endpoint_status(request, task_id):
     """检查效应分析任务状态"""
-    from .thread_pool import TASK_RESULTS
-    
-    if task_id not in TASK_RESULTS:
-        return JsonResponse({'status': 'error', 'message': '任务不存在或已过期'})
+    user = await request.auser()
+    task_data, error = await run_sync(get_user_task, task_id, user.id)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error})
     
-    task_data = TASK_RESULTS[task_id]
-    
-    # 确保任务属于当前用户
-    if task_data.get('user_id') != request.user.id:
-        return JsonResponse({'status': 'error', 'message': '您无权访问此任务'})
+    payload = build_task_status(task_id, task_data)
+    if payload['status'] == 'success':
+        # 保存结果ID到会话
+        await request.session.aset('effect_result_id', payload['result_id'])
     
-    # 检查是否处理中的任务
-    if 'future' in task_data:
-        future = task_data['future']
-        
-        if future.done():
-            try:
-                # 获取处理结果
-                result_id, risk_data = future.result()
-                
-                if result_id and result_id in TASK_RESULTS:
-                    result_data = TASK_RESULTS[result_id]
-                    
-                    # 删除原任务记录，保留结果记录
-                    del TASK_RESULTS[task_id]
-                    
-                    # 保存结果ID到会话
-                    request.session['effect_result_id'] = result_id
-                    
-                    # 根据状态返回结果
-                    if result_data['status'] == 'completed':
-                        return JsonResponse({
-                            'status': 'success',
-                            'message': '计算完成',
-                            'result_id': result_id,
-                            'risk_data': risk_data,
-                            'download_url': f"{reverse('download_risk_ranking')}?result_id={result_id}"
-                        })
-                    else:
-                        error_msg = result_data.get('error', '未知错误')
-                        return JsonResponse({
-                            'status': 'error',
-                            'message': f'计算过程出错: {error_msg}'
-                        })
-                else:
-                    return JsonResponse({
-                        'status': 'error',
-                        'message': '获取结果失败'
-                    })
-            
-            except Exception as e:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'处理任务结果时出错: {str(e)}'
-                })
-        else:
-            # 任务仍在处理中
-            return JsonResponse({
-                'status': 'processing',
-                'message': '正在计算中，请稍候...'
-            })
-    
-    # 如果是已完成的任务结果
-    elif task_data['status'] == 'completed':
-        return JsonResponse({
-            'status': 'success',
-            'message': '计算完成',
-            'result_id': task_id,
-            'download_url': f"{reverse('download_risk_ranking')}?result_id={task_id}"
-        })
-    else:
-        error_msg = task_data.get('error', '未知错误')
-        return JsonResponse({
-            'status': 'error',
-            'message': f'计算过程出错: {error_msg}'
-        })
+    return JsonResponse(payload)
 
 @login_required
-def download_risk_ranking(request):
+async def download_risk_ranking(request):
     """下载风险排序结果"""
-    result_id = request.GET.get('result_id')
-    
-    if not result_id or result_id not in TASK_RESULTS:
-        return JsonResponse({'status': 'error', 'message': '文件不存在或已过期'})
-    
-    result_data = TASK_RESULTS[result_id]
-    
-    # 检查文件是否属于当前用户
-    if result_data.get('user_id') != request.user.id:
-        return JsonResponse({'status': 'error', 'message': '您无权访问此文件'})
-    
-    # 检查文件是否存在
-    if 'path' not in result_data or not os.path.exists(result_data['path']):
-        return JsonResponse({'status': 'error', 'message': '结果文件不存在'})
-    
-    # 记录下载
-    logger.info(f"用户 {request.user.username} 下载风险排序结果文件")
-    
-    # 返回文件
-    try:
-        return FileResponse(
-            open(result_data['path'], 'rb'),
-            as_attachment=True,
-            filename=f"风险排序结果_{result_id[:8]}.xlsx"
-        )
-    except Exception as e:
-        return JsonResponse({'status': 'error', 'message': f'下载文件时出错: {str(e)}'})
+    result_id = request.GET.get('result_id') or ''
+    return await result_file_response(request, result_id, f"风险排序结果_{result_id[:8]}.xlsx", '风险排序结果文件')
 
 
 @login_required
@@ -433,33 +537,47 @@ def download_tracing_template(request):
     return response
 
 @login_required
-def process_tracing(request):
+async def process_tracing(request):
     """处理风险溯源请求"""
     if request.method == 'POST':
+        user = await request.auser()
         try:
             # 记录用户访问
-            logger.info(f"用户 {request.user.username} (ID: {request.user.id}) 请求风险溯源分析")
+            logger.info(f"用户 {user.username} (ID: {user.id}) 请求风险溯源分析")
             
-            # 获取上传的文件
-            tracing_file = request.FILES.get('tracing_file')
+            # 获取上传的文件（解析请求体在线程中进行）
+            files = await run_sync(lambda: request.FILES)
+            tracing_file = files.get('tracing_file')
             
             if not tracing_file:
                 return JsonResponse({'status': 'error', 'message': '请上传企业生产使用化学品清单'})
             
-            # 读取文件内容到内存
-            file_binary = tracing_file.read()
+            # 重复提交（双击、浏览器重试）直接返回已有任务
+            request_key = get_request_key(request)
+            task_id, created = await claim_submission(user, 'tracing', request_key)
+            if not created:
+                logger.info(f"用户 {user.username} 重复提交，返回已有任务 {task_id}")
+            else:
+                try:
+                    # 按块写入暂存文件，不把整个文件读入内存
+                    upload = await run_sync(spool_upload, tracing_file, settings.UPLOAD_SPOOL_DIR)
+                    
+                    # 提交任务到线程池
+                    from .thread_pool import submit_tracing_task
+                    task_id = await run_sync(submit_tracing_task, upload, user.id, get_priority(request), task_id)
+                except Exception:
+                    await release_submission(user, 'tracing', request_key, task_id)
+                    raise
             
-            # 提交任务到线程池
-            from .thread_pool import submit_tracing_task
-            task_id = submit_tracing_task(file_binary, request.user.id)
+            # 返回任务ID和检查状态的URL（命中缓存时直接返回结果）
+            payload = await run_sync(submission_payload, task_id, 'check_tracing_status')
+            if payload['status'] == 'success':
+                await request.session.aset('tracing_result_id', payload['result_id'])
+            return JsonResponse(payload)
             
-            # 返回任务ID和检查状态的URL
-            return JsonResponse({
-                'status': 'processing',
-                'message': '任务已提交，正在处理中',
-                'task_id': task_id,
-                'check_url': reverse('check_tracing_status', args=[task_id])
-            })
+        except QueueFull as e:
+            logger.info(f"任务队列已满，拒绝用户 {user.username} 的提交")
+            return queue_full_response(e)
             
         except Exception as e:
             logger.error(f"处理风险溯源请求时出错: {str(e)}")
@@ -471,111 +589,62 @@ def process_tracing(request):
     return JsonResponse({'status': 'error', 'message': '仅支持POST请求'})
 
 @login_required
-def check_tracing_status(request, task_id):
+async def check_tracing_status(request, task_id):
     """检查风险溯源任务状态"""
-    from .thread_pool import TASK_RESULTS
+    user = await request.auser()
+    task_data, error = await run_sync(get_user_task, task_id, user.id)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error})
     
-    if task_id not in TASK_RESULTS:
-        return JsonResponse({'status': 'error', 'message': '任务不存在或已过期'})
+    payload = build_task_status(task_id, task_data)
+    if payload['status'] == 'success':
+        # 保存结果ID到会话
+        await request.session.aset('tracing_result_id', payload['result_id'])
     
-    task_data = TASK_RESULTS[task_id]
-    
-    # 确保任务属于当前用户
-    if task_data.get('user_id') != request.user.id:
-        return JsonResponse({'status': 'error', 'message': '您无权访问此任务'})
-    
-    # 检查是否处理中的任务
-    if 'future' in task_data:
-        future = task_data['future']
-        
-        if future.done():
-            try:
-                # 获取处理结果
-                result_id = future.result()
-                
-                if result_id and result_id in TASK_RESULTS:
-                    result_data = TASK_RESULTS[result_id]
-                    
-                    # 删除原任务记录，保留结果记录
-                    del TASK_RESULTS[task_id]
-                    
-                    # 保存结果ID到会话
-                    request.session['tracing_result_id'] = result_id
-                    
-                    # 根据状态返回结果
-                    if result_data['status'] == 'completed':
-                        return JsonResponse({
-                            'status': 'success',
-                            'message': '计算完成',
-                            'result_id': result_id,
-                            'download_url': reverse('download_tracing_result', args=[result_id])
-                        })
-                    else:
-                        error_msg = result_data.get('error', '未知错误')
-                        return JsonResponse({
-                            'status': 'error',
-                            'message': f'计算过程出错: {error_msg}'
-                        })
-                else:
-                    return JsonResponse({
-                        'status': 'error',
-                        'message': '获取结果失败'
-                    })
-            
-            except Exception as e:
-                return JsonResponse({
-                    'status': 'error',
-                    'message': f'处理任务结果时出错: {str(e)}'
-                })
-        else:
-            # 任务仍在处理中
-            return JsonResponse({
-                'status': 'processing',
-                'message': '正在计算中，请稍候...'
-            })
-    
-    # 如果是已完成的任务结果
-    elif task_data['status'] == 'completed':
-        return JsonResponse({
-            'status': 'success',
-            'message': '计算完成',
-            'result_id': task_id,
-            'download_url': reverse('download_tracing_result', args=[task_id])
-        })
-    else:
-        error_msg = task_data.get('error', '未知错误')
-        return JsonResponse({
-            'status': 'error',
-            'message': f'计算过程出错: {error_msg}'
-        })
+    return JsonResponse(payload)
 
 @login_required
-def download_tracing_result(request, result_id):
+async def download_tracing_result(request, result_id):
     """下载风险溯源结果"""
-    from .thread_pool import TASK_RESULTS
-    
-    if result_id not in TASK_RESULTS:
-        return JsonResponse({'status': 'error', 'message': '文件不存在或已过期'})
-    
-    result_data = TASK_RESULTS[result_id]
-    
-    # 检查文件是否属于当前用户
-    if result_data.get('user_id') != request.user.id:
-        return JsonResponse({'status': 'error', 'message': '您无权访问此文件'})
-    
-    # 检查文件是否存在
-    if 'path' not in result_data or not os.path.exists(result_data['path']):
-        return JsonResponse({'status': 'error', 'message': '结果文件不存在'})
-    
-    # 记录下载
-    logger.info(f"用户 {request.user.username} 下载风险溯源结果文件")
+    return await result_file_response(request, result_id, f"风险溯源结果_{result_id[:8]}.xlsx", '风险溯源结果文件')
+
+@login_required
+async def task_events(request, task_id):
+    """以 Server-Sent Events 推送任务状态变化，任务结束后关闭连接"""
+    user = await request.auser()
+    task_data, error = await run_sync(get_user_task, task_id, user.id)
+    if error:
+        return JsonResponse({'status': 'error', 'message': error})
+    
+    async def event_stream():
+        last_payload = None
+        last_sent = time.monotonic()
+        deadline = last_sent + settings.TASK_EVENTS_TIMEOUT
+        current = task_data
+        while True:
+            if current is None:
+                payload = {'status': 'error', 'message': '任务不存在或已过期'}
+            else:
+                payload = build_task_status(task_id, current)
+            
+            # 只在状态或进度变化时推送
+            if payload != last_payload:
+                yield f"event: status\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                last_payload = payload
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent > 15:
+                # 心跳注释，防止代理断开空闲连接
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            
+            # 任务结束，或超过单次连接时长（浏览器会自动重连）
+            if payload['status'] != 'processing' or time.monotonic() > deadline:
+                return
+            
+            await asyncio.sleep(settings.TASK_EVENTS_INTERVAL)
+            current, _ = await run_sync(get_user_task, task_id, user.id)
     
-    # 返回文件
-    try:
-        return FileResponse(
-            open(result_data['path'], 'rb'),
-            as_attachment=True,
-            filename=f"风险溯源结果_{result_id[:8]}.xlsx"
-        )
-    except Exception as e:
-        return JsonResponse({'status': 'error', 'message': f'下载文件时出错: {str(e)}'})
\ No newline at end of file
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,152 @@
+# main_app/warmup.py
+"""
+启动预热
+
+进程启动后在后台线程中依次完成各项冷启动开销：导入计算依赖、读取并校验参考数据、加载模型、
+加载 URL 配置（同时导入视图和任务模块）、启动计算进程池。
+全部完成前就绪检查接口（/ready/）返回 503，负载均衡不会把请求转发到尚未预热的进程。
+只有明确识别为 Web 服务的进程（is_server_process）才预热，管理命令、测试和脚本不会启动进程池。
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('access')
+
+_ready = threading.Event()
+_lock = threading.Lock()
+_started = False
+_state = {'status': 'pending', 'steps': {}, 'error': None}
+
+
+def _import_libraries():
+    import numpy, openpyxl, pandas  # noqa: F401
+
+
+def _load_assets():
+    from . import assets
+    assets.preload()
+    assets.validate()
+
+
+def _load_models():
+    from .model_registry import get_model_registry
+    get_model_registry().preload()
+
+
+def _load_urls():
+    from django.urls import get_resolver
+    # 访问 url_patterns 时导入 URL 配置及其引用的视图、任务模块
+    get_resolver().url_patterns
+
+
+def _start_process_pool():
+    from concurrent.futures import wait
+    from django.conf import settings
+    from .thread_pool import get_process_executor
+
+    # 提交与 worker 数量相同的空任务，让每个 worker 启动并完成初始化（导入计算模块、读取参考数据）
+    executor = get_process_executor()
+    wait([executor.submit(os.getpid) for _ in range(settings.PROCESS_POOL_WORKERS)])
+
+
+# 预热步骤：(名称, 函数)，按顺序执行
+STEPS = [
+    ('导入计算依赖', _import_libraries),
+    ('读取参考数据', _load_assets),
+    ('加载模型', _load_models),
+    ('加载URL配置', _load_urls),
+    ('启动计算进程池', _start_process_pool),
+]
+
+
+# 计算进程池的 worker 在初始化时设置这个环境变量（mark_process_worker），不会被识别为服务进程
+PROCESS_WORKER_ENV = 'POLLUTANT_PROCESS_WORKER'
+
+
+def mark_process_worker():
+    """标记当前进程为计算进程池的 worker"""
+    os.environ[PROCESS_WORKER_ENV] = '1'
+
+
+# 以这些程序启动的进程视为 Web 服务进程（python -m 启动时 argv[0] 为包内的 __main__.py）
+SERVER_PROGRAMS = {'gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi', 'waitress-serve'}
+
+
+def is_server_process(argv):
+    """是否为提供 Web 服务的进程：settings.SERVER_PROCESS 为 'auto' 时按启动命令识别，
+    只有 runserver（自动重载时为子进程）和常见的 WSGI/ASGI 服务器算作服务进程，
+    包括这些服务器以多进程方式启动的 worker（uvicorn --workers、hypercorn 等）；计算进程池的 worker 除外。
+    其他部署方式（如 mod_wsgi）设为 '1' 明确开启，设为 '0' 时总是关闭"""
+    from django.conf import settings
+
+    mode = str(getattr(settings, 'SERVER_PROCESS', 'auto')).lower()
+    if mode in ('1', 'true', 'yes'):
+        return True
+    if mode in ('0', 'false', 'no') or os.environ.get(PROCESS_WORKER_ENV) == '1' or not argv:
+        return False
+    program = os.path.basename(argv[0])
+    if program == '__main__.py':
+        program = os.path.basename(os.path.dirname(argv[0]))
+    if program.endswith('.py'):
+        program = program[:-3]
+    if program in ('manage', 'django-admin'):
+        if len(argv) < 2 or argv[1] != 'runserver':
+            return False
+        # 自动重载时由子进程（RUN_MAIN=true）提供服务
+        return '--noreload' in argv or os.environ.get('RUN_MAIN') == 'true'
+    return program in SERVER_PROGRAMS
+
+
+def run():
+    """依次执行全部预热步骤，记录每步耗时；任一步骤失败时进程保持未就绪"""
+    _state['status'] = 'warming'
+    started = time.monotonic()
+    for name, step in STEPS:
+        step_started = time.monotonic()
+        try:
+            step()
+        except Exception as e:
+            _state['status'] = 'error'
+            _state['error'] = f'{name}失败: {str(e)}'
+            logger.error(f"启动预热失败（{name}）: {str(e)}")
+            return
+        _state['steps'][name] = round(time.monotonic() - step_started, 3)
+    _state['status'] = 'ready'
+    _ready.set()
+    logger.info(f"启动预热完成，耗时 {time.monotonic() - started:.2f} 秒")
+
+
+def start():
+    """在后台线程中开始预热（每个进程只执行一次）"""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=run, name='warmup', daemon=True).start()
+
+
+def skip():
+    """不预热时直接标记为就绪，首次请求按需加载"""
+    _state['status'] = 'ready'
+    _ready.set()
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def wait_ready(timeout=None):
+    """等待预热完成，返回是否已就绪"""
+    return _ready.wait(timeout)
+
+
+def status():
+    """预热状态：status（pending / warming / ready / error）、各步骤耗时和错误信息"""
+    return {
+        'status': _state['status'],
+        'steps': dict(_state['steps']),
+        'error': _state['error'],
+    }
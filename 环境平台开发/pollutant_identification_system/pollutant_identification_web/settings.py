@@ -11,7 +11,11 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -132,6 +136,104 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 运行测试（manage.py test）时，任务存储、结果文件和各类缓存都放在临时目录中，测试结束后删除
+TESTING = sys.argv[1:2] == ['test']
+if TESTING:
+    MEDIA_ROOT = tempfile.mkdtemp(prefix='pollutant_test_')
+    atexit.register(shutil.rmtree, MEDIA_ROOT, True)
+
 # 登录设置
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'first_page'
+
+# Web 服务进程：'auto' 按启动命令识别（runserver、gunicorn、uvicorn 等），'1' 明确开启，'0' 关闭。
+# 只有服务进程才恢复挂起的任务、启动过期清理和停机流程，并按 WARMUP_ON_STARTUP 预热
+SERVER_PROCESS = os.environ.get('SERVER_PROCESS', 'auto')
+
+# 启动预热：进程启动后在后台读取参考数据、启动计算进程池，完成前 /ready/ 返回 503
+WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', '1') != '0'
+
+# 模型注册表：模型名称 -> 模型文件路径。每个进程只加载一次，文件被替换后自动加载新版本；
+# 模型版本（文件内容哈希）是结果缓存键的一部分
+MODEL_REGISTRY = {
+    'MODELS': {
+        # 响应因子（logRF）预测模型
+        'response_factor': os.environ.get(
+            'RESPONSE_FACTOR_MODEL', str(BASE_DIR.parent.parent / 'nju_gui' / '模型测试' / 'xgb_predict RF.pkl')
+        ),
+    },
+    # 检查模型文件是否被替换的最小间隔（秒）
+    'CHECK_INTERVAL': 5,
+    # 树集成模型编译为 NumPy 数组后的保存目录（按模型版本命名），推理不再依赖 xgboost；设为 None 时直接使用原模型
+    'COMPILED_PATH': os.path.join(MEDIA_ROOT, 'compiled_models'),
+}
+
+# 任务执行设置
+# 线程池处理任务编排和 I/O，进程池运行 Excel 解析、模型推理等计算阶段
+THREAD_POOL_WORKERS = int(os.environ.get('THREAD_POOL_WORKERS', 10))
+PROCESS_POOL_WORKERS = int(os.environ.get('PROCESS_POOL_WORKERS', os.cpu_count() or 1))
+# 以下队列限制都按 Web 进程分别计算：部署 N 个进程时，实际上限为 N 倍
+# 每个用户同时运行的任务数上限，超出的任务排队等待
+TASK_MAX_PER_USER = int(os.environ.get('TASK_MAX_PER_USER', 2))
+# 准入控制：排队任务数上限，以及排队和运行中任务持有的上传数据总量上限（字节）
+# 超出时提交接口返回 HTTP 429 和 Retry-After；单个任务超过数据量上限时返回 413
+TASK_QUEUE_MAX_DEPTH = int(os.environ.get('TASK_QUEUE_MAX_DEPTH', 100))
+TASK_QUEUE_MAX_BYTES = int(os.environ.get('TASK_QUEUE_MAX_BYTES', 512 * 1024 * 1024))
+
+# 停机时等待运行中任务完成的期限（秒），超时的任务挂起，连同排队任务在下次启动时恢复
+TASK_DRAIN_TIMEOUT = int(os.environ.get('TASK_DRAIN_TIMEOUT', 30))
+
+# 任务心跳超时（秒）：排队和运行中的任务由所属进程定期刷新心跳，超时未刷新说明进程已异常退出
+# （SIGKILL、OOM 等），任务由其他进程接管：带有恢复参数的任务重新排队，其余任务标记失败
+TASK_HEARTBEAT_TIMEOUT = int(os.environ.get('TASK_HEARTBEAT_TIMEOUT', 120))
+
+# 任务状态推送（SSE）：服务端检查间隔和单次连接最长时间（秒）
+TASK_EVENTS_INTERVAL = 1.0
+TASK_EVENTS_TIMEOUT = 600
+
+# 批量查询任务状态时单次允许的最大任务数
+TASK_STATUS_BATCH_LIMIT = 100
+
+# 任务记录和结果文件的保留时间（秒），到期后删除
+TASK_RESULT_TTL = int(os.environ.get('TASK_RESULT_TTL', 15 * 60))
+
+# 结果文件存储（BACKEND 可替换为其他 ResultStorage 实现，例如更快的独立卷）
+RESULT_STORAGE = {
+    'BACKEND': 'main_app.storage.LocalResultStorage',
+    'OPTIONS': {
+        'root': MEDIA_ROOT,
+    },
+}
+
+# 结果归档：热存储保留期（TASK_RESULT_TTL）过后结果转为压缩列式归档，下载时自动恢复；
+# 归档保留 TTL 秒，总大小超过 MAX_BYTES 时淘汰最久未使用的归档
+RESULT_ARCHIVE = {
+    'PATH': os.path.join(MEDIA_ROOT, 'archive'),
+    'MAX_BYTES': int(os.environ.get('RESULT_ARCHIVE_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+    'TTL': int(os.environ.get('RESULT_ARCHIVE_TTL', 7 * 24 * 60 * 60)),
+}
+
+# 上传文件暂存目录：上传内容按块写入这里，任务只持有文件句柄
+UPLOAD_SPOOL_DIR = os.path.join(MEDIA_ROOT, 'uploads')
+
+# 结果缓存：按上传内容和参考数据版本缓存各阶段结果，超出大小或条目数上限时淘汰最久未使用的条目
+RESULT_CACHE = {
+    'PATH': os.path.join(MEDIA_ROOT, 'result_cache'),
+    'MAX_BYTES': int(os.environ.get('RESULT_CACHE_MAX_BYTES', 1024 * 1024 * 1024)),
+    'MAX_ENTRIES': 500,
+}
+
+# 分子描述符缓存：按 InChIKey 保存的列式描述符库，各批样品共用
+# GENERATED_PATH 保存按结构生成的描述符，与输入文件提供的描述符分开，不会覆盖后者
+DESCRIPTOR_CACHE = {
+    'PATH': os.environ.get('DESCRIPTOR_CACHE_PATH', os.path.join(MEDIA_ROOT, 'descriptor_cache')),
+    'GENERATED_PATH': os.environ.get('GENERATED_DESCRIPTORS_PATH', os.path.join(MEDIA_ROOT, 'generated_descriptors')),
+}
+
+# 任务存储设置（BACKEND 可替换为其他 TaskStore 实现）
+TASK_STORE = {
+    'BACKEND': 'main_app.task_store.SQLiteTaskStore',
+    'OPTIONS': {
+        'path': os.path.join(MEDIA_ROOT if TESTING else BASE_DIR, 'task_store.sqlite3'),
+    },
+}